@@ -1,9 +1,11 @@
 # Build individual executables (self contained files).
-# Build in the following order: __init__, utils, base, files, awk, scripts.
+# Build in the following order: __init__, utils, base, predicate, dataset,
+# arrow, columnar, compressed, files, bloom, awk, vectorized, rows, scripts.
 # This allows copying of scripts directly to user's ~/bin/ even if only internal
 # network access is allowed and user does not have administrator's privileges.
 PACKAGE_PATH=$(pwd)"/tabtools"
 BUILD_PATH=$(pwd)"/dist"
+MODULES='base|utils|predicate|dataset|arrow|columnar|compressed|files|bloom|awk|vectorized|rows'
 
 build_python_script() {
     SCRIPT_FILENAME=$BUILD_PATH/$1  # add prefir 't' to the function name
@@ -20,19 +22,41 @@ build_python_script() {
     cat LICENSE | sed "s/^/# /" >> $SCRIPT_FILENAME
 
     # Loop over modules and concatenate their content.
-    # Remove relative imports as they would be available after concatenation.
-    for module in '__init__.py' 'utils.py' 'base.py' 'files.py' 'awk.py' 'scripts.py'
+    # Remove relative imports as they would be available after concatenation,
+    # imports inside functions (lazy imports) are replaced with pass.
+    for module in '__init__.py' 'utils.py' 'base.py' 'predicate.py' 'dataset.py' 'arrow.py' 'columnar.py' 'compressed.py' 'files.py' 'bloom.py' 'awk.py' 'vectorized.py' 'rows.py' 'scripts.py'
     do
-        echo -e "\n#####\n# $module module\n#####" >> $SCRIPT_FILENAME
+        printf '\n#####\n# %s module\n#####\n' $module >> $SCRIPT_FILENAME
         cat $PACKAGE_PATH/$module \
             | grep -vE '^from tabtools import' \
-            | grep -vE '^from .base import' \
-            | grep -vE '^from .utils import' \
-            | grep -vE '^from .files import' \
-            | grep -vE '^from .awk import' >> $SCRIPT_FILENAME
+            | grep -vE "^from \.($MODULES) import" \
+            | sed -E "s/^([[:space:]]+)from \.($MODULES) import .*/\1pass/" >> $SCRIPT_FILENAME
     done
 
-    echo -e "\n\nif __name__ == \"__main__\":\n    "$1"()" >> $SCRIPT_FILENAME
+    printf '\n\nif __name__ == "__main__":\n    %s()\n' $1 >> $SCRIPT_FILENAME
+    chmod +x $SCRIPT_FILENAME
+}
+
+# Executable zip archive (see zipapp) with the package and its bytecode, so
+# modules are not compiled on every start and only the modules the tool
+# imports are loaded. Python of another version compiles the sources.
+build_bytecode_script() {
+    SCRIPT_FILENAME=$BUILD_PATH/$1
+    ARCHIVE_PATH=$(mktemp -d)
+    mkdir -p $BUILD_PATH $ARCHIVE_PATH/tabtools
+
+    cp $PACKAGE_PATH/*.py $ARCHIVE_PATH/tabtools/
+    printf 'from tabtools.scripts import %s\n%s()\n' $1 $1 > $ARCHIVE_PATH/__main__.py
+    python3 -m compileall -q -b --invalidation-mode unchecked-hash $ARCHIVE_PATH
+    (cd $ARCHIVE_PATH && python3 -m zipfile -c archive.zip __main__.py __main__.pyc tabtools)
+
+    echo "#!/usr/bin/env python3" > $SCRIPT_FILENAME
+    printf '# VERSION: ' >> $SCRIPT_FILENAME
+    grep -o "[0-9]\+,\s\+[0-9]\+,\s\+[0-9]\+" tabtools/__init__.py | sed 's/\,\s\+/\./g' >> $SCRIPT_FILENAME
+    cat LICENSE | sed "s/^/# /" >> $SCRIPT_FILENAME
+    cat $ARCHIVE_PATH/archive.zip >> $SCRIPT_FILENAME
+
+    rm -rf $ARCHIVE_PATH
     chmod +x $SCRIPT_FILENAME
 }
 
@@ -55,10 +79,18 @@ build_shell_script() {
     chmod +x $SCRIPT_FILENAME
 }
 
-build_python_script ttmap
-build_python_script ttreduce
-build_python_script ttsort
-build_python_script ttplot
+# Concatenated sources if python3 is not available (e.g. bare alpine VM).
+if command -v python3 > /dev/null
+then
+    BUILD_SCRIPT=build_bytecode_script
+else
+    BUILD_SCRIPT=build_python_script
+fi
+
+for tool in ttcat ttmap ttreduce ttjoin ttuniq ttsplit ttcache ttsort ttplot ttcompile
+do
+    $BUILD_SCRIPT $tool
+done
 
 build_shell_script tttail
 build_shell_script ttpretty
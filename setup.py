@@ -20,12 +20,23 @@ setup(
     long_description=long_description,
     entry_points={
         "console_scripts": [
-            'ttsort = tabtools.scripts:ttsort',
-            'ttmap = tabtools.scripts:ttmap',
-            'ttreduce = tabtools.scripts:ttreduce',
-            'ttplot = tabtools.scripts:ttplot',
+            'ttcat = tabtools.client:ttcat',
+            'ttsort = tabtools.client:ttsort',
+            'ttmap = tabtools.client:ttmap',
+            'ttreduce = tabtools.client:ttreduce',
+            'ttjoin = tabtools.client:ttjoin',
+            'ttuniq = tabtools.client:ttuniq',
+            'ttsplit = tabtools.client:ttsplit',
+            'ttcache = tabtools.client:ttcache',
+            'ttplot = tabtools.client:ttplot',
+            'ttcompile = tabtools.client:ttcompile',
+            'tabtools = tabtools.daemon:main',
         ]
     },
+    extras_require={
+        "arrow": ["pyarrow>=11"],
+        "numpy": ["numpy>=1.20"],
+    },
     scripts=[
         "bin/tttail",
         "bin/ttpretty",
@@ -41,6 +52,6 @@ setup(
         "Programming Language :: Python :: 3",
         "Topic :: Software Development :: Libraries :: Python Modules",
     ],
-    python_requires=">=3.4",
+    python_requires=">=3.7",
     license="MIT",
 )
@@ -3,3 +3,23 @@ __version = (0, 6, 0)
 
 __version__ = version = '.'.join(map(str, __version))
 __project__ = PROJECT = __name__
+
+# Library API is imported on first access, command line tools do not use it.
+_LAZY_ATTRIBUTES = {
+    "read_batches": ".vectorized",
+    "iter_rows": ".rows",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    from importlib import import_module
+    value = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
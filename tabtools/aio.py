@@ -0,0 +1,194 @@
+""" asyncio API for running tabtools pipelines.
+
+Commands (awk programs, sort) are started with create_subprocess_exec, so
+the event loop is not blocked. Command reads file bodies from a descriptor
+as in FileList.__call__, its output is read by a task into a bounded queue:
+if the consumer is slower than the command, the queue is full, the task
+stops reading the pipe and the command blocks on write, memory is bounded
+by the queue size.
+
+Runner limits the number of commands running at once with a semaphore,
+pipelines are async iterators of output lines or batches of them.
+
+    runner = Runner(max_workers=4)
+    pipeline = await runner.map(["a.tsv"], ["a", "b = a * 2"], ["a > 0"])
+    async for line in pipeline:
+        ...
+
+"""
+import asyncio
+import functools
+import os
+import shlex
+import subprocess
+from shlex import quote
+
+from .awk import AWKGroupProgram, AWKStreamProgram, awk_interpreter
+from .base import Field, Header, sort_key_options
+from .files import FileList
+
+QUEUE_SIZE = 16
+READ_BYTES = 1 << 16
+
+
+class Pipeline:
+
+    """ Command with file bodies as its input, output is read asynchronously.
+
+    Params
+    ------
+    files: FileList
+    args: shell words of the command, as in FileList.__call__.
+    header: Header of the output, optional.
+    semaphore: asyncio.Semaphore, optional, held while the command runs.
+    queue_size: int, number of output batches read ahead.
+
+    Pipeline could be iterated once. Command is killed if iteration stops
+    before the end of the output. subprocess.CalledProcessError is raised
+    if the command fails.
+
+    """
+
+    def __init__(self, files, *args, header=None, semaphore=None,
+                 queue_size=QUEUE_SIZE):
+        self.files = files
+        self.command = shlex.split(" ".join(args))
+        self.header = header
+        self.semaphore = semaphore
+        self.queue_size = queue_size
+
+    def __aiter__(self):
+        return self.lines()
+
+    async def lines(self):
+        """ Output lines, str without line ends."""
+        async for batch in self.batches():
+            for line in batch:
+                yield line
+
+    async def batches(self):
+        """ Lists of output lines, every list is read at once."""
+        if self.semaphore is None:
+            async for batch in self._batches():
+                yield batch
+            return
+
+        async with self.semaphore:
+            async for batch in self._batches():
+                yield batch
+
+    async def _batches(self):
+        loop = asyncio.get_running_loop()
+        feeders = []
+        descriptor = self.files._stdin(feeders)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=descriptor, stdout=subprocess.PIPE,
+                env=dict(os.environ, LC_ALL='C'))
+        finally:
+            os.close(descriptor)
+
+        queue = asyncio.Queue(self.queue_size)
+        reader = asyncio.ensure_future(self._read(process.stdout, queue))
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    break
+                yield batch
+            await reader
+        finally:
+            if process.returncode is None and not reader.done():
+                reader.cancel()
+                process.kill()
+            code = await process.wait()
+            await loop.run_in_executor(None, self.files._wait, feeders)
+
+        if code:
+            raise subprocess.CalledProcessError(code, self.command)
+
+    @staticmethod
+    async def _read(stream, queue):
+        """ Put lists of complete lines into the queue, None at the end."""
+        rest = b""
+        while True:
+            data = await stream.read(READ_BYTES)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b"\n") + 1
+            rest = data[end:]
+            if end:
+                await queue.put(data[:end - 1].decode('utf8').split("\n"))
+        if rest:
+            await queue.put([rest.decode('utf8')])
+        await queue.put(None)
+
+
+class Runner:
+
+    """ Create pipelines, at most max_workers commands run at once.
+
+    Params
+    ------
+    max_workers: int, number of CPUs by default.
+    queue_size: int, see Pipeline.
+
+    Methods which build programs resolve headers of the files in the
+    default executor, they accept the same expressions as the command line
+    tools.
+
+    """
+
+    def __init__(self, max_workers=None, queue_size=QUEUE_SIZE):
+        self.semaphore = asyncio.Semaphore(max_workers or os.cpu_count())
+        self.queue_size = queue_size
+
+    def run(self, files, *args, header=None):
+        """ Pipeline of a command with bodies of FileList as its input."""
+        return Pipeline(
+            files, *args, header=header, semaphore=self.semaphore,
+            queue_size=self.queue_size)
+
+    @staticmethod
+    async def files(paths, **kwargs):
+        """ FileList of the paths, first lines are read in the executor."""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(FileList, paths, **kwargs))
+
+    def _awk(self, files, program, fields):
+        delimiter = files.header.delimiter
+        header = Header(delimiter=delimiter, fields=[
+            Field(o.title, o._type) for o in fields
+            if o.title and not o.title.startswith('_')
+        ])
+        return self.run(
+            files, awk_interpreter(), '-F', quote(delimiter),
+            '-v', 'OFS=' + quote(delimiter), str(program), header=header)
+
+    async def map(self, paths, select, where=None):
+        """ Pipeline of ttmap -s select -w where."""
+        files = await self.files(paths)
+        program = AWKStreamProgram(
+            files.header.fields, filter_expressions=where,
+            output_expressions=select)
+        if program.semijoins:
+            raise ValueError("Large FILE membership is not supported")
+        return self._awk(files, program, program.output)
+
+    async def reduce(self, paths, groupby, select, mode="hash"):
+        """ Pipeline of ttreduce -g groupby -s select, input does not need
+        to be sorted in hash mode."""
+        files = await self.files(paths)
+        program = AWKGroupProgram(
+            files.header.fields, group_key=groupby,
+            group_expressions=select, mode=mode)
+        return self._awk(files, program, program.key + program.output)
+
+    async def sort(self, paths, keys):
+        """ Pipeline of ttsort -k keys."""
+        files = await self.files(paths)
+        header = files.header
+        return self.run(
+            files, 'sort', '--field-separator=' + quote(header.delimiter),
+            *sort_key_options(header, keys), header=header)
@@ -0,0 +1,218 @@
+""" Arrow IPC input and output.
+
+Requires optional pyarrow (pip install tabtools[arrow]). Arrow IPC files
+(Feather v2) and streams are converted into text lines for awk, output of
+the tools is converted into record batches while it is produced, so memory
+is bounded by the batch size in both directions.
+
+Types: num fields are float64, other fields are utf8. Integer and floating
+point Arrow columns are read as num fields.
+
+"""
+import atexit
+import os
+import sys
+import threading
+
+from .base import Header, Field
+
+FILE_MAGIC = b"ARROW1"
+STREAM_MAGIC = b"\xff\xff\xff\xff"
+OUTPUT_FORMATS = ["tsv", "arrow", "feather"]
+BLOCK_SIZE = 1 << 20
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.csv
+        import pyarrow.ipc
+    except ImportError:
+        raise ValueError(
+            "pyarrow is required for Arrow format, install tabtools[arrow]")
+    return pyarrow
+
+
+def is_arrow(fd):
+    """ Check whether regular file is Arrow IPC file or stream."""
+    head = os.pread(fd.fileno(), len(FILE_MAGIC), 0)
+    return head.startswith(FILE_MAGIC) or head.startswith(STREAM_MAGIC)
+
+
+def get_schema(header):
+    """ Arrow schema of the header fields."""
+    pa = _pyarrow()
+    return pa.schema([
+        pa.field(
+            f.title,
+            pa.float64() if f.type == Field.TYPES.NUMBER else pa.string())
+        for f in header.fields
+    ])
+
+
+def get_header(schema):
+    """ Tab delimited header of Arrow schema."""
+    pa = _pyarrow()
+    return Header(fields=[
+        Field(
+            f.name.replace(" ", "_"),
+            Field.TYPES.NUMBER.value
+            if pa.types.is_integer(f.type) or pa.types.is_floating(f.type)
+            else None)
+        for f in schema
+    ])
+
+
+class ArrowReader:
+
+    """ Text lines of Arrow IPC file or stream.
+
+    Params
+    ------
+    fd: file object of a regular file.
+    has_header: bool, write header line built from the schema.
+
+    Attributes
+    ----------
+    fd: file object, read end of a pipe with tab delimited lines.
+
+    """
+
+    def __init__(self, fd, has_header=True):
+        pa = _pyarrow()
+        self.name = getattr(fd, 'name', None)
+        self.error = None
+        read, write = os.pipe()
+        source = os.dup(fd.fileno())
+        self.thread = threading.Thread(
+            target=self._convert, args=(pa, source, write, has_header),
+            daemon=True)
+        self.thread.start()
+        self.fd = os.fdopen(read)
+
+    def _convert(self, pa, source, write, has_header):
+        try:
+            with open(source, 'rb') as raw, open(write, 'wb') as target:
+                is_file = os.pread(source, len(FILE_MAGIC), 0) == FILE_MAGIC
+                raw.seek(0)
+                if is_file:
+                    reader = pa.ipc.open_file(raw)
+                    batches = (
+                        reader.get_batch(i)
+                        for i in range(reader.num_record_batches))
+                else:
+                    reader = pa.ipc.open_stream(raw)
+                    batches = reader
+
+                if has_header:
+                    target.write(
+                        (str(get_header(reader.schema)) + "\n").encode('utf8'))
+                options = pa.csv.WriteOptions(
+                    include_header=False, delimiter="\t",
+                    quoting_style="none")
+                for batch in batches:
+                    pa.csv.write_csv(batch, target, options)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """ Wait for the conversion end, raise ValueError if it failed."""
+        self.thread.join()
+        if self.error is not None:
+            raise ValueError("Could not read Arrow data {}: {}".format(
+                self.name, self.error))
+
+
+class _PositionWriter:
+
+    """ Binary file wrapper which counts written bytes.
+
+    Arrow file writer needs tell(), it is not supported by pipes.
+
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.f.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.flush()
+        self.closed = True
+
+
+def write_arrow(source, target, output_format):
+    """ Convert header and delimited lines into Arrow IPC batches.
+
+    Params
+    ------
+    source: binary file object, the first line is a header.
+    target: binary file object.
+    output_format: "arrow" for IPC stream, "feather" for IPC file.
+
+    """
+    pa = _pyarrow()
+    header = Header.parse(source.readline().decode('utf8'))
+    schema = get_schema(header)
+    open_writer = pa.ipc.new_stream if output_format == "arrow" \
+        else pa.ipc.new_file
+
+    with open_writer(_PositionWriter(target), schema) as writer:
+        if not source.peek(1):
+            return
+
+        reader = pa.csv.open_csv(
+            source,
+            read_options=pa.csv.ReadOptions(
+                column_names=schema.names, block_size=BLOCK_SIZE),
+            parse_options=pa.csv.ParseOptions(
+                delimiter=header.delimiter, quote_char=False),
+            convert_options=pa.csv.ConvertOptions(
+                column_types=schema, null_values=[""],
+                strings_can_be_null=False)
+        )
+        for batch in reader:
+            writer.write_batch(batch)
+
+
+def arrow_output(output_format):
+    """ Convert standard output of the process and its children to Arrow.
+
+    Descriptor 1 is replaced with a pipe to the converter thread, it is
+    restored and the thread is waited for at exit.
+
+    """
+    _pyarrow()
+    sys.stdout.flush()
+    read, write = os.pipe()
+    stdout = os.dup(1)
+
+    def convert():
+        with open(read, 'rb') as source, \
+                open(stdout, 'wb', closefd=False) as target:
+            write_arrow(source, target, output_format)
+
+    thread = threading.Thread(target=convert, daemon=True)
+    thread.start()
+    os.dup2(write, 1)
+    os.close(write)
+
+    def finish():
+        sys.stdout.flush()
+        os.dup2(stdout, 1)
+        thread.join()
+
+    atexit.register(finish)
@@ -18,8 +18,42 @@ implementation for Linux, original AWK was written for Unix v7.
 """
 import ast
 import copy
+import functools
+import os
+import re
+import shutil
 import time
 from enum import Enum
+from shlex import quote
+
+
+@functools.lru_cache(maxsize=None)
+def _which(name, path):
+    return shutil.which(name, path=path)
+
+
+def awk_interpreter():
+    """ Path of awk, AWKPATH environment variable could set it.
+
+    Interpreter is looked up when a program is run, not at import. Lookups
+    are cached by AWKPATH and PATH, so daemon children reuse the lookup of
+    the daemon if their environment is the same.
+
+    """
+    return _which(os.environ.get('AWKPATH', 'awk'), os.environ.get('PATH'))
+
+
+def semijoin_variable(path, column):
+    """ Name of awk variable with result of a semi-join check.
+
+    Semi-join filter appends 0/1 column to the row for every (path, column)
+    check, see tabtools.bloom.
+
+    """
+    import hashlib
+
+    digest = hashlib.md5("{}:{}".format(path, column).encode('utf8'))
+    return "__semijoin_{}".format(digest.hexdigest()[:8])
 
 
 class AWKBaseProgram:
@@ -28,6 +62,20 @@ class AWKBaseProgram:
 
     class MODULES(Enum):
         DEQUE = 1
+        HASH = 2
+        HEAP = 3
+        SKETCH = 4
+        HLL = 5
+        KLL = 6
+        SPACE_SAVING = 7
+        MOMENTS = 8
+
+    # Modules which use functions of other modules.
+    MODULES_REQUIRED = {
+        MODULES.HLL: {MODULES.HASH, MODULES.SKETCH},
+        MODULES.KLL: {MODULES.SKETCH},
+        MODULES.SPACE_SAVING: {MODULES.SKETCH},
+    }
 
     def __str__(self):
         result = "'\n"
@@ -41,10 +89,30 @@ class AWKBaseProgram:
         result += "\n}'"
         return result
 
+    @property
+    def expressions(self):
+        """ All of the program expressions."""
+        return self.output
+
+    @property
+    def semijoins(self):
+        """ Sorted (path, column) membership checks done outside of awk."""
+        return sorted(set().union(*[
+            expression.semijoins for expression in self.expressions]))
+
+    @property
+    def semijoins_code(self):
+        """ Read semi-join results appended to the end of the row."""
+        return "".join([
+            "{} = $(NF - {});\n".format(
+                semijoin_variable(*semijoin), len(self.semijoins) - index - 1)
+            for index, semijoin in enumerate(self.semijoins)
+        ])
+
     @property
     def begin_code(self):
         return "\n".join([
-            expression.begin for expression in self.output
+            expression.begin for expression in self.expressions
             if expression.begin])
 
     @property
@@ -56,16 +124,19 @@ class AWKBaseProgram:
 
         """
         modules = set()
-        for expression in self.output:
+        for expression in self.expressions:
             modules |= expression.modules
 
+        for module in list(modules):
+            modules |= self.MODULES_REQUIRED.get(module, set())
+
         # if self.group_key:
             # for expression in self.key + self.group:
                 # modules |= expression.modules
 
         return "\n".join([
-            getattr(self, "module_{}".format(module))
-            for module in modules])
+            getattr(self, "module_{}".format(module.name.lower()))
+            for module in sorted(modules, key=lambda m: m.value)])
 
     @property
     def module_deque(self):
@@ -83,6 +154,132 @@ class AWKBaseProgram:
             'function deque_print(d){x="["; for (i=d["-"]; i<d["+"] - 1; i++) x = x d[i]", "; print x d[d["+"] - 1]"]; size: "d["+"] - d["-"] " [" d["-"] ", " d["+"] ")"}',  # nolint
         ])
 
+    @property
+    def module_hash(self):
+        """String hash implementation in awk, hash(s, m) is in [0, m).
+
+        hash_mix(h) scrambles bits of hash(s, 2147483647) for sketches, which
+        use both low and high bits of the value.
+
+        """
+        return "\n".join([
+            '# awk module hash',
+            'function hash_init(    i) {for (i = 0; i < 256; i++) __hash_ord[sprintf("%c", i)] = i; __hash_ready = 1}',  # nolint
+            'function hash(s, m,    i, h) {if (!__hash_ready) hash_init(); h = 0; for (i = 1; i <= length(s); i++) h = (h * 31 + __hash_ord[substr(s, i, 1)]) % 2147483647; return h % m}',  # nolint
+            'function hash_mix(h) {h = (h * 48271 + 11) % 2147483647; h = (h + (h % 46337) * int(h / 46337)) % 2147483647; h = (h * 16807) % 2147483647; h = (h + (h % 32768) * int(h / 65536)) % 2147483647; return (h * 48271) % 2147483647}',  # nolint
+        ])
+
+    @property
+    def module_heap(self):
+        """Bounded binary heap in awk.
+
+        Heap h[g, 1..k] keeps k largest values for c = 1 and k smallest for
+        c = -1, h[g, 0] is size. g allows to keep multiple heaps in one array.
+
+        """
+        return "\n".join([
+            '# awk module heap',
+            'function heap_init(h, g) {h[g, 0] = 0}',
+            'function heap_push(h, g, v, k, c,    n, i, j) {n = h[g, 0]; if (n < k) {h[g, 0] = ++n; for (i = n; i > 1 && c * h[g, j = int(i / 2)] > c * v; i = j) h[g, i] = h[g, j]; h[g, i] = v; return} if (c * v <= c * h[g, 1]) return; for (i = 1; (j = 2 * i) <= n; i = j) {if (j < n && c * h[g, j + 1] < c * h[g, j]) j++; if (c * h[g, j] >= c * v) break; h[g, i] = h[g, j]} h[g, i] = v}',  # nolint
+            'function heap_list(h, g, c, sep,    n, i, j, t, a, s) {n = h[g, 0]; for (i = 1; i <= n; i++) {t = h[g, i]; for (j = i - 1; j >= 1 && c * a[j] < c * t; j--) a[j + 1] = a[j]; a[j + 1] = t} s = ""; for (i = 1; i <= n; i++) s = s (i > 1 ? sep : "") a[i]; return s}',  # nolint
+        ])
+
+    @property
+    def module_sketch(self):
+        """Helpers shared by sketches: sort and state escaping."""
+        return "\n".join([
+            '# awk module sketch',
+            'function sketch_sort(a, w, lo, hi,    i, j, p, t) {if (lo >= hi) return; p = a[int((lo + hi) / 2)]; i = lo; j = hi; while (i <= j) {while (a[i] < p) i++; while (a[j] > p) j--; if (i <= j) {t = a[i]; a[i] = a[j]; a[j] = t; t = w[i]; w[i] = w[j]; w[j] = t; i++; j--}} sketch_sort(a, w, lo, j); sketch_sort(a, w, i, hi)}',  # nolint
+            'function sketch_escape(v) {gsub(/%/, "%25", v); gsub(/ /, "%20", v); gsub(/:/, "%3A", v); gsub(/\\|/, "%7C", v); return v}',  # nolint
+            'function sketch_unescape(v) {gsub(/%7C/, "|", v); gsub(/%3A/, ":", v); gsub(/%20/, " ", v); gsub(/%25/, "%", v); return v}',  # nolint
+        ])
+
+    @property
+    def module_hll(self):
+        """HyperLogLog distinct counter with 1024 registers (~3% error).
+
+        Only non-zero registers are stored: s[g, "r", i] is rank of register i,
+        s[g, "i", 1..n] are indexes of set registers. State is a string of 1024
+        base-36 ranks, merge takes maximum of the registers.
+
+        """
+        return "\n".join([
+            '# awk module hll',
+            'function hll_init(s, g,    j) {for (j = 1; j <= s[g, "n"]; j++) {delete s[g, "r", s[g, "i", j]]; delete s[g, "i", j]} s[g, "n"] = 0}',  # nolint
+            'function hll_set(s, g, i, r) {if (!((g, "r", i) in s)) {s[g, "i", ++s[g, "n"]] = i; s[g, "r", i] = r} else if (r > s[g, "r", i]) s[g, "r", i] = r}',  # nolint
+            'function hll_add(s, g, v,    h, w, r, t) {h = hash_mix(hash(v, 2147483647)); w = int(h / 1024); for (r = 1; r <= 21 && w < (t = 2 ^ (21 - r)); r++); hll_set(s, g, h % 1024, r)}',  # nolint
+            'function hll_merge(s, g, state,    i, r) {for (i = 1; i <= length(state); i++) if ((r = index("0123456789abcdefghijklmnopqrstuvwxyz", substr(state, i, 1)) - 1) > 0) hll_set(s, g, i - 1, r)}',  # nolint
+            'function hll_state(s, g,    i, x) {x = ""; for (i = 0; i < 1024; i++) x = x (((g, "r", i) in s) ? substr("0123456789abcdefghijklmnopqrstuvwxyz", s[g, "r", i] + 1, 1) : "0"); return x}',  # nolint
+            'function hll_estimate(s, g,    j, z, e) {z = 1024 - s[g, "n"]; e = z; for (j = 1; j <= s[g, "n"]; j++) e += 2 ^ -s[g, "r", s[g, "i", j]]; e = 0.7213 / (1 + 1.079 / 1024) * 1024 * 1024 / e; if (e <= 2.5 * 1024 && z > 0) e = 1024 * log(1024 / z); else if (e > 2 ^ 31 / 30) e = -(2 ^ 31) * log(1 - e / 2 ^ 31); return int(e + 0.5)}',  # nolint
+        ])
+
+    @property
+    def module_kll(self):
+        """Quantile sketch: hierarchy of compactors with 200 items per level.
+
+        Full level is sorted and every second item (alternating offset) is
+        promoted to the next level with double weight, error is about
+        log2(n / 200) / 200. State is "level:v v ...|level:v v ...".
+
+        """
+        return "\n".join([
+            '# awk module kll',
+            'function kll_init(s, g,    l, i) {for (l = 0; l < s[g, "L"]; l++) {for (i = 1; i <= s[g, l, "n"]; i++) delete s[g, l, i]; delete s[g, l, "n"]; delete s[g, l, "o"]} s[g, "L"] = 0}',  # nolint
+            'function kll_insert(s, g, l, v,    n) {if (l >= s[g, "L"]) s[g, "L"] = l + 1; n = ++s[g, l, "n"]; s[g, l, n] = v; if (n >= 200) kll_compact(s, g, l)}',  # nolint
+            'function kll_compact(s, g, l,    n, i, a, w, o) {n = s[g, l, "n"]; for (i = 1; i <= n; i++) a[i] = s[g, l, i]; sketch_sort(a, w, 1, n); o = s[g, l, "o"] = 1 - s[g, l, "o"]; s[g, l, "n"] = 0; for (i = 1 + o; i <= n; i += 2) kll_insert(s, g, l + 1, a[i])}',  # nolint
+            'function kll_add(s, g, v) {kll_insert(s, g, 0, v)}',
+            'function kll_merge(s, g, state,    levels, values, m, n, i, j, l) {m = split(state, levels, "|"); for (i = 1; i <= m; i++) {l = substr(levels[i], 1, index(levels[i], ":") - 1); n = split(substr(levels[i], index(levels[i], ":") + 1), values, " "); for (j = 1; j <= n; j++) kll_insert(s, g, l, values[j])}}',  # nolint
+            'function kll_state(s, g,    l, i, x, y) {x = ""; for (l = 0; l < s[g, "L"]; l++) {if (!s[g, l, "n"]) continue; y = l ":" s[g, l, 1]; for (i = 2; i <= s[g, l, "n"]; i++) y = y " " s[g, l, i]; x = x (x == "" ? "" : "|") y} return x}',  # nolint
+            'function kll_quantile(s, g, q,    l, i, n, a, w, t, c) {n = 0; t = 0; for (l = 0; l < s[g, "L"]; l++) for (i = 1; i <= s[g, l, "n"]; i++) {a[++n] = s[g, l, i]; t += w[n] = 2 ^ l} if (!n) return ""; sketch_sort(a, w, 1, n); c = 0; for (i = 1; i < n; i++) if ((c += w[i]) >= q * t) break; return a[i]}',  # nolint
+        ])
+
+    @property
+    def module_space_saving(self):
+        """Space-Saving heavy hitters with m counters.
+
+        Counter j keeps value s[g, "v", j], count s[g, "c", j] (overestimate)
+        and error bound s[g, "e", j], so the value was seen at least c - e
+        times. Unknown value replaces the minimal counter, O(m) per
+        replacement. Error of every count is at most n / m for n values, so
+        the list keeps much more counters than the k values it outputs and
+        reports the guaranteed counts c - e. State is "value:count:error ...",
+        merge adds counters as weighted updates.
+
+        """
+        return "\n".join([
+            '# awk module space saving',
+            'function space_saving_init(s, g,    j) {for (j = 1; j <= s[g, "n"]; j++) {delete s[g, "i", s[g, "v", j]]; delete s[g, "v", j]; delete s[g, "c", j]; delete s[g, "e", j]} s[g, "n"] = 0}',  # nolint
+            'function space_saving_update(s, g, v, c, e, k,    i, j) {if ((g, "i", v) in s) {j = s[g, "i", v]; s[g, "c", j] += c; s[g, "e", j] += e; return} if (s[g, "n"] < k) {j = ++s[g, "n"]; s[g, "v", j] = v; s[g, "i", v] = j; s[g, "c", j] = c; s[g, "e", j] = e; return} j = 1; for (i = 2; i <= s[g, "n"]; i++) if (s[g, "c", i] < s[g, "c", j]) j = i; delete s[g, "i", s[g, "v", j]]; s[g, "e", j] = s[g, "c", j] + e; s[g, "c", j] += c; s[g, "v", j] = v; s[g, "i", v] = j}',  # nolint
+            'function space_saving_add(s, g, v, k) {space_saving_update(s, g, v, 1, 0, k)}',  # nolint
+            'function space_saving_merge(s, g, state, k,    counters, values, n, i) {n = split(state, counters, " "); for (i = 1; i <= n; i++) {split(counters[i], values, ":"); space_saving_update(s, g, sketch_unescape(values[1]), values[2], values[3], k)}}',  # nolint
+            'function space_saving_state(s, g,    j, x) {x = ""; for (j = 1; j <= s[g, "n"]; j++) x = x (j > 1 ? " " : "") sketch_escape(s[g, "v", j]) ":" s[g, "c", j] ":" s[g, "e", j]; return x}',  # nolint
+            'function space_saving_list(s, g, k, sep,    n, i, j, a, c, x) {n = s[g, "n"]; for (i = 1; i <= n; i++) {c[i] = s[g, "c", i] - s[g, "e", i]; for (j = i - 1; j >= 1 && c[a[j]] < c[i]; j--) a[j + 1] = a[j]; a[j + 1] = i} x = ""; for (i = 1; i <= n && i <= k; i++) x = x (i > 1 ? sep : "") s[g, "v", a[i]] ":" c[a[i]]; return x}',  # nolint
+        ])
+
+    @property
+    def module_moments(self):
+        """Single pass moments: count, mean and central moment sums M2..M4.
+
+        Values are added with Welford/Pebay updates, states are combined with
+        pairwise formulas (Chan et al., Pebay 2008), which are exact and do
+        not suffer from cancellation of sum/sum of squares approach.
+        State is "n mean M2 M3 M4".
+
+        """
+        return "\n".join([
+            '# awk module moments',
+            'function moments_init(m, g) {m[g, "n"] = m[g, "mean"] = m[g, "m2"] = m[g, "m3"] = m[g, "m4"] = 0}',  # nolint
+            'function moments_add(m, g, x,    n, d, dn, dn2, t) {n = ++m[g, "n"]; d = x - m[g, "mean"]; dn = d / n; dn2 = dn * dn; t = d * dn * (n - 1); m[g, "mean"] += dn; m[g, "m4"] += t * dn2 * (n * n - 3 * n + 3) + 6 * dn2 * m[g, "m2"] - 4 * dn * m[g, "m3"]; m[g, "m3"] += t * dn * (n - 2) - 3 * dn * m[g, "m2"]; m[g, "m2"] += t}',  # nolint
+            'function moments_combine(m, g, nb, meanb, m2b, m3b, m4b,    na, n, d, d2, m2a, m3a) {na = m[g, "n"]; n = na + nb; if (!nb) return; if (!na) {m[g, "n"] = nb; m[g, "mean"] = meanb; m[g, "m2"] = m2b; m[g, "m3"] = m3b; m[g, "m4"] = m4b; return} d = meanb - m[g, "mean"]; d2 = d * d; m2a = m[g, "m2"]; m3a = m[g, "m3"]; m[g, "m4"] += m4b + d2 * d2 * na * nb * (na * na - na * nb + nb * nb) / (n * n * n) + 6 * d2 * (na * na * m2b + nb * nb * m2a) / (n * n) + 4 * d * (na * m3b - nb * m3a) / n; m[g, "m3"] += m3b + d2 * d * na * nb * (na - nb) / (n * n) + 3 * d * (na * m2b - nb * m2a) / n; m[g, "m2"] += m2b + d2 * na * nb / n; m[g, "mean"] += d * nb / n; m[g, "n"] = n}',  # nolint
+            'function moments_merge(m, g, state,    v) {if (split(state, v, " ") == 5) moments_combine(m, g, v[1], v[2], v[3], v[4], v[5])}',  # nolint
+            'function moments_state(m, g) {return sprintf("%d %.17g %.17g %.17g %.17g", m[g, "n"], m[g, "mean"], m[g, "m2"], m[g, "m3"], m[g, "m4"])}',  # nolint
+            'function moments_avg(m, g) {return m[g, "n"] ? m[g, "mean"] : ""}',  # nolint
+            'function moments_var(m, g) {return m[g, "n"] > 1 ? m[g, "m2"] / (m[g, "n"] - 1) : ""}',  # nolint
+            'function moments_std(m, g) {return m[g, "n"] > 1 ? sqrt(m[g, "m2"] / (m[g, "n"] - 1)) : ""}',  # nolint
+            'function moments_skew(m, g) {return m[g, "m2"] > 0 ? sqrt(m[g, "n"]) * m[g, "m3"] / m[g, "m2"] ^ 1.5 : ""}',  # nolint
+            'function moments_kurt(m, g) {return m[g, "m2"] > 0 ? m[g, "n"] * m[g, "m4"] / (m[g, "m2"] * m[g, "m2"]) - 3 : ""}',  # nolint
+        ])
+
 
 class AWKStreamProgram(AWKBaseProgram):
 
@@ -127,9 +324,14 @@ class AWKStreamProgram(AWKBaseProgram):
             self.context
         )
 
+    @property
+    def expressions(self):
+        return self.output + self.filters
+
     @property
     def output_code(self):
-        result = ";\n".join([str(o) for o in self.output]) + ';\n'
+        result = self.semijoins_code
+        result += ";\n".join([str(o) for o in self.output]) + ';\n'
         output_statement =  "print " + ", ".join([
             o.title for o in self.output
             if o.title and not o.title.startswith('_')
@@ -145,6 +347,87 @@ class AWKStreamProgram(AWKBaseProgram):
         return result
 
 
+class AWKMultiStreamProgram(AWKStreamProgram):
+
+    """ Several stream queries computed in one pass over the input.
+
+    Params
+    ------
+    fields: tabtools.base.DataDescription.fields
+    queries: list of (filter_expressions, output_expressions, output)
+        output is a file name to append rows to, None for standard output.
+
+    Queries share the context and are executed in the given order for every
+    row. Select statement identical to the one of a previous query is not
+    computed again, its result is reused. This way fields are split and
+    stateful expressions (e.g. moving averages) are updated only once.
+
+    """
+
+    def __init__(self, fields, queries):
+        self.fields = fields
+        self.context = {
+            field.title: Expression('${}'.format(index + 1), title=field.title)
+            for index, field in enumerate(self.fields)
+        }
+        self.queries = []
+        self.filters, self.output = [], []
+        defined = {}
+
+        for filter_expressions, output_expressions, output in queries:
+            filters = StreamExpression.from_str(
+                "; ".join(filter_expressions), self.context)
+            expressions, fields = [], []
+            for statement in ast.parse("; ".join(output_expressions)).body:
+                key = ast.dump(statement)
+                title = getattr(statement.value, "id", None) \
+                    if isinstance(statement, ast.Expr) \
+                    else statement.targets[0].id
+                if title in defined and defined[title][0] == key:
+                    fields.append(defined[title][1])
+                    continue
+
+                statement_expressions = StreamExpression(
+                    None, context=self.context).visit(
+                        ast.Module(body=[statement], type_ignores=[]))
+                expressions.extend(statement_expressions)
+                fields.append(statement_expressions[-1])
+                defined[statement_expressions[-1].title] = (
+                    key, statement_expressions[-1])
+
+            self.filters.extend(filters)
+            self.output.extend(expressions)
+            self.queries.append({
+                "filters": filters,
+                "output": expressions,
+                "fields": [
+                    f for f in fields
+                    if f.title and not f.title.startswith('_')
+                ],
+                "path": output,
+            })
+
+    @property
+    def output_code(self):
+        result = self.semijoins_code
+        for query in self.queries:
+            if query["output"]:
+                result += ";\n".join([str(o) for o in query["output"]])
+                result += ';\n'
+            output_statement = "print " + ", ".join(
+                f.title for f in query["fields"])
+            if query["path"] is not None:
+                output_statement += " >> " + Expression._quote(query["path"])
+            if query["filters"]:
+                result += "if({}) {{\n    {}\n}}\n".format(
+                    " && ".join([str(o) for o in query["filters"]]),
+                    output_statement
+                )
+            else:
+                result += output_statement + "\n"
+        return result
+
+
 class AWKGroupProgram(AWKBaseProgram):
 
     """ Awk Program generator.
@@ -160,78 +443,857 @@ class AWKGroupProgram(AWKBaseProgram):
         <final part>
     }
 
-    _NR local line number.
-    If program has group functionality, it star
-    If program does not have group functionality, it equals to NR
+    Modes
+    -----
+    sorted: input is sorted by group key, group is printed as soon as the key
+        changes. Only state of the current group is kept in memory.
+    hash: input is not sorted, state of every group is kept in awk arrays
+        indexed by group key. Groups are printed at the END in order of the
+        first appearance.
+
+    Aggregates with state larger than a scalar (e.g. TOPK) keep it in arrays
+    indexed by __group_state: grouping set index in sorted mode and grouping
+    set index with group key in hash mode.
+
+    explode: print one row per element of list aggregates (TOPK, BOTTOMK)
+        instead of a single row with list_separator joined elements.
+
+    Grouping sets
+    -------------
+    grouping_sets: list of subsets of key titles, every set is aggregated in
+        the same pass, e.g. [("symbol", "day"), ("symbol",), ()] for rollup.
+        Sets which are prefixes of the key are streamed in sorted mode, other
+        sets use hash mode. Rows of every set are printed with grouping_id
+        column (SQL GROUPING_ID: bit is set for every key not in the set) and
+        empty values of missing keys.
+    outputs: list of file names, one per grouping set. If given, rows are
+        appended to the files without grouping_id and missing key columns.
 
     """
 
-    def __init__(self, fields, group_key, group_expressions):
+    MODES = ("sorted", "hash")
+
+    def __init__(self, fields, group_key, group_expressions, mode="sorted",
+                 explode=False, list_separator=",", grouping_sets=None,
+                 outputs=None):
+        if mode not in self.MODES:
+            raise ValueError("Unknown group mode {}".format(mode))
+
         self.fields = fields
+        self.mode = mode
+        self.explode = explode
+        self.list_separator = list_separator
         self.context = {
             field.title: Expression('${}'.format(index + 1), title=field.title)
             for index, field in enumerate(self.fields)
         }
 
-        self.key = Expression.from_str(group_key, self.context)
-        # self.key[-1].title = "__group_key"
-        self.key.append(Expression(self.key[-1].title, title="__group_key"))
-        # self.context["__group_key"] = self.key[-1]
+        self.key = Expression.from_str(group_key or "", self.context)
+        self.key_titles = [k.title for k in self.key if self._is_output(k)]
 
         self.group_expressions = group_expressions or []
         self.output = GroupExpression.from_str(
             "; ".join(self.group_expressions), self.context)
 
+        if self.semijoins:
+            raise ValueError("Large FILE membership is not supported in groups")
+
+        self.grouping_sets = [
+            tuple(s) for s in (grouping_sets or [self.key_titles])]
+        for grouping_set in self.grouping_sets:
+            unknown = set(grouping_set) - set(self.key_titles)
+            if unknown:
+                raise ValueError("Grouping set fields {} are not in key {}".format(
+                    sorted(unknown), self.key_titles))
+
+        if outputs is not None and len(outputs) != len(self.grouping_sets):
+            raise ValueError("Number of outputs should match grouping sets")
+        self.outputs = outputs
+
+    @classmethod
+    def rollup(cls, titles):
+        """ Grouping sets of ROLLUP(titles): all prefixes, longest first."""
+        return [tuple(titles[:i]) for i in range(len(titles), -1, -1)]
+
     def __str__(self):
-        result = self.output_code
+        result = "'\n"
+        result += self.modules_code
+        result += "\nBEGIN{{\n__list_separator = {}\n}}\n".format(
+            Expression._quote(self.list_separator))
+        result += self.output_code
+        result += "\n'"
         return result
 
     @property
-    def output_code(self):
-        """ Get code of grouping part."""
-        result = "'{\n"
-        result += "\n".join(str(k) for k in self.key)
-        result += "\n"
-        group_code = "\n".join([
+    def expressions(self):
+        return self.key + self.output
+
+    @staticmethod
+    def _is_output(expression):
+        return bool(expression.title and not expression.title.startswith('_'))
+
+    @property
+    def has_grouping_id(self):
+        """ Whether rows have grouping_id column."""
+        return self.grouping_sets != [tuple(self.key_titles)] and \
+            self.outputs is None
+
+    def grouping_id(self, grouping_set):
+        """ Bit mask of key fields which are not in the set."""
+        return sum(
+            1 << (len(self.key_titles) - index - 1)
+            for index, title in enumerate(self.key_titles)
+            if title not in grouping_set
+        )
+
+    def _is_sorted(self, grouping_set):
+        return self.mode == "sorted" and \
+            list(grouping_set) == self.key_titles[:len(grouping_set)]
+
+    def _state(self, code):
+        """ Index aggregate variables by group in hash mode.
+
+        Aggregates of multiple grouping sets are always indexed, sorted sets
+        use set index as a state.
+
+        """
+        if self.mode == "sorted" and len(self.grouping_sets) == 1:
+            return code
+        return re.sub(r'\b(__var_\d+)\b(?!\[)', r'\1[__group_state]', code)
+
+    def _code(self, codes, indent):
+        return ("\n" + " " * indent).join(
+            self._state(code) for code in codes if code)
+
+    @property
+    def group_init(self):
+        return [
+            str(o) if not o.begin else str(o.begin) for o in self.output
+            if not self._is_output(o)
+        ]
+
+    @property
+    def group_update(self):
+        return [str(o) for o in self.output if not self._is_output(o)]
+
+    @property
+    def group_finalize(self):
+        return [o.final for o in self.output if o.final] + [
+            str(o) for o in self.output if self._is_output(o)]
+
+    def _key_code(self, grouping_set):
+        return " SUBSEP ".join(grouping_set) or '""'
+
+    def _values_code(self, grouping_set):
+        """ Printed key values of the set, joined with OFS."""
+        if self.outputs is not None:
+            titles = list(grouping_set)
+        else:
+            titles = [
+                title if title in grouping_set else '""'
+                for title in self.key_titles
+            ]
+        return " OFS ".join(titles)
+
+    def _print_code(self, index, values, indent):
+        """ Print group, one row per list element in explode mode."""
+        prefix = []
+        if self.has_grouping_id:
+            prefix.append(str(self.grouping_id(self.grouping_sets[index])))
+        if self._values_code(self.grouping_sets[index]):
+            prefix.append(values)
+
+        redirect = ""
+        if self.outputs is not None:
+            redirect = " >> {}".format(Expression._quote(self.outputs[index]))
+
+        titles = [o.title for o in self.output if self._is_output(o)]
+        lists = [
+            o.title for o in self.output
+            if self._is_output(o) and o.separator and self.explode
+        ]
+        if not lists:
+            return "print " + ", ".join(prefix + titles) + redirect
+
+        lines = ["__explode_size = 0"]
+        for title in lists:
+            lines.append(
+                "if ((__explode_n = split({t}, __explode_{t}, "
+                "__list_separator)) > __explode_size) "
+                "__explode_size = __explode_n".format(t=title))
+        lines.append(
+            "for (__explode_i = 1; __explode_i <= __explode_size; "
+            "__explode_i++) print " + ", ".join(prefix + [
+                "__explode_{}[__explode_i]".format(t) if t in lists else t
+                for t in titles
+            ]) + redirect)
+        return ("\n" + " " * indent).join(lines)
+
+    def _sorted_code(self, index):
+        """ Streamed grouping set, input is sorted by its key."""
+        grouping_set = self.grouping_sets[index]
+        code = "\n".join([
+            "__group_key_{i} = {key}",
+            "__group_state = {state}",
             "if(NR == 1){{",
             "    {group_init}",
             "}} else {{",
-            "  if(__group_key != __group_key_previous){{",
+            "  if(__group_key_{i} != __group_key_previous_{i}){{",
             "    {group_finalize}",
-            "    print __group_key_previous, {group_output}",
+            "    {group_print}",
             "    {group_init}",
             "  }} else {{",
             "    {group_update}",
             "  }}",
             "}}",
-            "__group_key_previous = __group_key;",
-            "}}\nEND{{",
+            "__group_key_previous_{i} = __group_key_{i}",
+            "__group_values_previous_{i} = {values}",
+        ])
+        end = "\n".join([
+            "if(NR){{",
+            "    __group_state = {state}",
             "    {group_finalize}",
-            "    print __group_key_previous, {group_output}",
+            "    {group_print}",
+            "}}",
         ])
-        group_code = group_code.format(
-            group_init="\n    ".join([
-                str(o) if not o.begin else str(o.begin) for o in self.output
-                if not (o.title and not o.title.startswith('_'))
-            ]),
-            group_update="\n    ".join([
-                str(o) for o in self.output
-                if not (o.title and not o.title.startswith('_'))
-            ]),
-            group_finalize="\n    ".join([
-                str(o) for o in self.output
-                if o.title and not o.title.startswith('_')
+        values = dict(
+            i=index,
+            key=self._key_code(grouping_set),
+            values=self._values_code(grouping_set) or '""',
+            state=index if len(self.grouping_sets) > 1 else '""',
+            group_init=self._code(self.group_init, 4),
+            group_update=self._code(self.group_update, 4),
+            group_finalize=self._code(self.group_finalize, 4),
+            group_print=self._print_code(
+                index, "__group_values_previous_{}".format(index), 4),
+        )
+        return code.format(**values), end.format(**values)
+
+    def _hash_code(self, index):
+        """ Grouping set with state of all groups in memory."""
+        grouping_set = self.grouping_sets[index]
+        code = "\n".join([
+            "__group_state = {i} SUBSEP {key}",
+            "if(!(__group_state in __groups)){{",
+            "    __groups[__group_state] = 1",
+            "    __groups_{i}[++__groups_size_{i}] = __group_state",
+            "    __groups_values_{i}[__groups_size_{i}] = {values}",
+            "    {group_init}",
+            "}} else {{",
+            "    {group_update}",
+            "}}",
+        ])
+        end = "\n".join([
+            "for(__group_index = 1; __group_index <= __groups_size_{i}; "
+            "__group_index++){{",
+            "    __group_state = __groups_{i}[__group_index]",
+            "    {group_finalize}",
+            "    {group_print}",
+            "}}",
+        ])
+        values = dict(
+            i=index,
+            key=self._key_code(grouping_set),
+            values=self._values_code(grouping_set) or '""',
+            group_init=self._code(self.group_init, 4),
+            group_update=self._code(self.group_update, 4),
+            group_finalize=self._code(self.group_finalize, 4),
+            group_print=self._print_code(
+                index, "__groups_values_{}[__group_index]".format(index), 4),
+        )
+        return code.format(**values), end.format(**values)
+
+    @property
+    def output_code(self):
+        """ Get code of grouping part."""
+        main, end = [], []
+        for index, grouping_set in enumerate(self.grouping_sets):
+            if self._is_sorted(grouping_set):
+                code = self._sorted_code(index)
+            else:
+                code = self._hash_code(index)
+            main.append(code[0])
+            end.append(code[1])
+
+        result = "{\n"
+        result += "".join(str(k) + "\n" for k in self.key)
+        result += "\n".join(main)
+        result += "\n}\nEND{\n"
+        result += "\n".join(end)
+        result += "\n}"
+        return result
+
+
+class AWKJoinProgram(AWKBaseProgram):
+
+    """ AWK hash join program.
+
+    Build side is loaded into an associative array keyed by the join columns,
+    probe side is streamed through it, no sorting is required. Build side
+    should be the first file passed to awk (ARGV[1]).
+
+    Params
+    ------
+    left_fields: tabtools.base.Header.fields
+    right_fields: tabtools.base.Header.fields
+    keys: list of "key" (same title in both files) or "left_key=right_key"
+    how: "inner" or "left"
+    build: "left" or "right", side to load into memory. Left join requires
+        right build side, otherwise unmatched rows could not be streamed.
+
+    Program structure
+    -----------------
+        FILENAME == ARGV[1] {
+            <store build row>
+            next
+        }
+        {
+            <lookup probe row and print matches>
+        }
+
+    """
+
+    HOWS = ("inner", "left")
+
+    def __init__(self, left_fields, right_fields, keys, how="inner",
+                 build="right"):
+        if how not in self.HOWS:
+            raise ValueError("Unknown join type {}".format(how))
+
+        if how == "left" and build != "right":
+            raise ValueError("Left join requires right build side")
+
+        if not keys:
+            raise ValueError("At least one join key is required")
+
+        self.left_fields = tuple(left_fields)
+        self.right_fields = tuple(right_fields)
+        self.how = how
+        self.build = build
+        self.output = []
+
+        left_titles = [f.title for f in self.left_fields]
+        right_titles = [f.title for f in self.right_fields]
+        self.keys = []
+        self.left_keys, self.right_keys = [], []
+        for key in keys:
+            left_key, _, right_key = key.partition("=")
+            right_key = right_key or left_key
+            if left_key not in left_titles:
+                raise ValueError("Key {} not in left file".format(left_key))
+            if right_key not in right_titles:
+                raise ValueError("Key {} not in right file".format(right_key))
+            self.keys.append((left_key, right_key))
+            self.left_keys.append(left_titles.index(left_key) + 1)
+            self.right_keys.append(right_titles.index(right_key) + 1)
+
+        # Right key columns duplicate left ones, do not output them.
+        self.right_columns = [
+            index + 1 for index in range(len(self.right_fields))
+            if index + 1 not in self.right_keys
+        ]
+
+        titles = left_titles + [
+            right_titles[index - 1] for index in self.right_columns]
+        duplicates = {t for t in titles if titles.count(t) > 1}
+        if duplicates:
+            raise ValueError("Duplicated fields {}, rename them first".format(
+                ", ".join(sorted(duplicates))))
+
+    @property
+    def fields(self):
+        """ Output fields: left fields followed by right non-key fields."""
+        return self.left_fields + tuple(
+            self.right_fields[index - 1] for index in self.right_columns)
+
+    @staticmethod
+    def _key_code(columns):
+        return " SUBSEP ".join("${}".format(c) for c in columns)
+
+    @staticmethod
+    def _columns_code(columns):
+        return " OFS ".join("${}".format(c) for c in columns)
+
+    @property
+    def output_code(self):
+        if self.build == "right":
+            build_keys, probe_keys = self.right_keys, self.left_keys
+            build_value = self._columns_code(self.right_columns) or '""'
+            match = "$0, __join_rows[__key, __i]" \
+                if self.right_columns else "$0"
+        else:
+            build_keys, probe_keys = self.left_keys, self.right_keys
+            build_value = "$0"
+            match = ", ".join(
+                ["__join_rows[__key, __i]"] +
+                ["${}".format(c) for c in self.right_columns]
+            )
+
+        code = "\n".join([
+            "FILENAME == ARGV[1] {{",
+            "    __key = {build_key}",
+            "    __join_rows[__key, ++__join_count[__key]] = {build_value}",
+            "    next",
+            "}}",
+            "{{",
+            "    __key = {probe_key}",
+            "    if (__key in __join_count) {{",
+            "        for (__i = 1; __i <= __join_count[__key]; __i++)",
+            "            print {match}",
+            "    }}",
+        ]).format(
+            build_key=self._key_code(build_keys),
+            probe_key=self._key_code(probe_keys),
+            build_value=build_value,
+            match=match,
+        )
+
+        if self.how == "left":
+            code += "\n    else\n        print {}".format(", ".join(
+                ["$0"] + ['""'] * len(self.right_columns)))
+
+        code += "\n}"
+        return code
+
+    def __str__(self):
+        return "'\n{}\n'".format(self.output_code)
+
+
+class AWKMergeJoinProgram(AWKJoinProgram):
+
+    """ AWK sort-merge join program.
+
+    Both files should be sorted by join keys the same way ttsort sorts them:
+    lexicographically, fields in order of keys. Left file (ARGV[1]) is
+    streamed, right file (ARGV[2]) is read with getline and only the run of
+    rows with the current key is buffered, so memory is O(largest key run).
+    Order is verified on the fly, program exits with status 2 if any of the
+    files is not sorted.
+
+    Program structure
+    -----------------
+        <functions>
+        BEGIN{
+            <open right file, read first row>
+        }
+        {
+            <check left order>
+            <skip smaller right keys, buffer run of equal right keys>
+            <print left row with buffered run>
+        }
+
+    """
+
+    def __init__(self, left_fields, right_fields, keys, how="inner"):
+        super(AWKMergeJoinProgram, self).__init__(
+            left_fields, right_fields, keys, how=how, build="right")
+
+    @staticmethod
+    def _key_code(columns, prefix="$"):
+        # Concatenation forces string comparison, even for a single field.
+        return " SUBSEP ".join(
+            "{}{}".format(prefix, c) for c in columns) + ' ""'
+
+    @property
+    def functions_code(self):
+        right_fields = "__join_right_fields[{}]"
+        return "\n".join([
+            "function __join_unsorted(file, key) {{",
+            '    printf "Join error: %s is not sorted, key %s\\n", '
+            'file, key > "/dev/stderr"',
+            "    exit 2",
+            "}}",
+            "function __join_read_right(    line) {{",
+            "    if ((getline line < __join_right) <= 0) {{",
+            "        __join_right_eof = 1",
+            "        return",
+            "    }}",
+            "    split(line, __join_right_fields, FS)",
+            "    __join_right_previous = __join_right_key",
+            "    __join_right_key = {key}",
+            "    __join_right_value = {value}",
+            "    if (__join_right_read++ && "
+            "__join_right_key < __join_right_previous)",
+            "        __join_unsorted(__join_right, __join_right_key)",
+            "}}",
+        ]).format(
+            key=" SUBSEP ".join(
+                right_fields.format(c) for c in self.right_keys) + ' ""',
+            value=" OFS ".join(
+                right_fields.format(c) for c in self.right_columns) or '""',
+        )
+
+    @property
+    def output_code(self):
+        match = "$0, __join_run[__i]" if self.right_columns else "$0"
+        code = "\n".join([
+            "{{",
+            "    __key = {key}",
+            "    if (NR > 1 && __key < __join_left_key)",
+            "        __join_unsorted(FILENAME, __key)",
+            "    __join_left_key = __key",
+            "    if (NR == 1 || __key != __join_run_key) {{",
+            "        while (!__join_right_eof && __join_right_key < __key)",
+            "            __join_read_right()",
+            "        __join_run_key = __key",
+            "        __join_run_size = 0",
+            "        while (!__join_right_eof && __join_right_key == __key) {{",
+            "            __join_run[++__join_run_size] = __join_right_value",
+            "            __join_read_right()",
+            "        }}",
+            "    }}",
+            "    for (__i = 1; __i <= __join_run_size; __i++)",
+            "        print {match}",
+        ]).format(key=self._key_code(self.left_keys), match=match)
+
+        if self.how == "left":
+            code += "\n    if (!__join_run_size)\n        print {}".format(
+                ", ".join(["$0"] + ['""'] * len(self.right_columns)))
+
+        code += "\n}"
+        return code
+
+    def __str__(self):
+        return "'\n{}\nBEGIN{{\n{}\n}}\n{}\n'".format(
+            self.functions_code,
+            "\n".join([
+                "    __join_right = ARGV[2]",
+                '    ARGV[2] = ""',
+                "    __join_read_right()",
             ]),
-            group_output=", ".join([
-                o.title for o in self.output
-                if o.title and not o.title.startswith('_')
-            ])
+            self.output_code
         )
-        result += group_code
-        result += "\n}'"
+
+
+class AWKUniqProgram(AWKBaseProgram):
+
+    """ AWK hash based distinct program.
+
+    Rows are deduplicated by key fields in a single pass, first row of every
+    key is output in the order keys appear in the input.
+
+    Params
+    ------
+    fields: tabtools.base.Header.fields
+    keys: list of field titles, optional. All of the fields by default.
+    count: bool, append number of rows with the same key.
+    max_keys: int, optional. Maximum number of keys kept in memory, rows
+        with new keys are written into spill_directory partitioned by key hash
+        together with row number. Partitions are deduplicated one by one in
+        the END block and merged back in the input order with sort(1).
+    spill_directory: str, required if max_keys is set.
+    partitions: int, number of spill files.
+
+    """
+
+    def __init__(self, fields, keys=None, count=False, max_keys=None,
+                 spill_directory=None, partitions=64):
+        if max_keys is not None and spill_directory is None:
+            raise ValueError("Spill directory is required for max_keys")
+
+        self.fields = fields
+        self.output = []
+        self.count = count
+        self.max_keys = max_keys
+        self.spill_directory = spill_directory
+        self.partitions = partitions
+
+        titles = [f.title for f in self.fields]
+        self.keys = []
+        for key in keys or []:
+            if key not in titles:
+                raise ValueError("Key {} not in fields".format(key))
+            self.keys.append(titles.index(key) + 1)
+
+    def _key_code(self, row="$"):
+        """ Key of the current row, or of the row split into array."""
+        if not self.keys:
+            return "$0" if row == "$" else "__row"
+        return " SUBSEP ".join(
+            "{}{}".format(row, k) if row == "$" else "{}[{}]".format(row, k)
+            for k in self.keys
+        )
+
+    @property
+    def modules_code(self):
+        if self.max_keys is None:
+            return ""
+        return self.module_hash
+
+    @property
+    def output_code(self):
+        code = ["{", "    __key = {}".format(self._key_code())]
+
+        if self.max_keys is not None:
+            code.extend([
+                "    if (!(__key in __uniq) && __uniq_size >= {}) {{".format(
+                    self.max_keys),
+                "        __spill = {} hash(__key, {})".format(
+                    self._spill_prefix, self.partitions),
+                "        __spilled[__spill] = 1",
+                "        print NR, $0 > __spill",
+                "        next",
+                "    }",
+            ])
+
+        if self.count:
+            code.extend([
+                "    if (!(__key in __uniq)) {",
+                "        __uniq_size++",
+                "        __uniq_keys[__uniq_size] = __key",
+                "        __uniq_rows[__key] = $0",
+                "    }",
+                "    __uniq[__key]++",
+            ])
+        else:
+            code.append("    if (!__uniq[__key]++) {__uniq_size++; print}")
+        code.append("}")
+        return "\n".join(code)
+
+    @property
+    def _spill_prefix(self):
+        return '"{}/"'.format(
+            self.spill_directory.replace("\\", "\\\\").replace('"', '\\"'))
+
+    @property
+    def end_code(self):
+        code = []
+        if self.count:
+            code.extend([
+                "    for (__i = 1; __i <= __uniq_size; __i++) {",
+                "        __key = __uniq_keys[__i]",
+                "        print __uniq_rows[__key], __uniq[__key]",
+                "    }",
+            ])
+
+        if self.max_keys is not None:
+            # Spilled keys appeared after the in-memory ones, output them
+            # after flushing the rest in order of their first row number.
+            output = '"sort -n | sed \\"s/^[0-9]*.//\\""'
+            code.extend([
+                "    fflush()",
+                '    split("", __uniq)',
+                "    for (__spill in __spilled) {",
+                "        close(__spill)",
+                "        while ((getline __line < __spill) > 0) {",
+                "            __row = substr(__line, index(__line, OFS) + 1)",
+                "            split(__row, __fields, FS)",
+                "            __key = {}".format(self._key_code("__fields")),
+                "            if (!(__key in __uniq))",
+                "                __uniq_lines[__key] = __line",
+                "            __uniq[__key]++",
+                "        }",
+                "        close(__spill)",
+                "        for (__key in __uniq_lines)",
+                "            print __uniq_lines[__key]{} | {}".format(
+                    ", __uniq[__key]" if self.count else "", output),
+                '        split("", __uniq)',
+                '        split("", __uniq_lines)',
+                "    }",
+                "    close({})".format(output),
+            ])
+
+        return "\n".join(code)
+
+    def __str__(self):
+        result = "'\n"
+        result += self.modules_code
+        result += "\n" + self.output_code
+        if self.end_code:
+            result += "\nEND{{\n{}\n}}".format(self.end_code)
+        result += "\n'"
         return result
 
 
+class AWKSplitProgram(AWKBaseProgram):
+
+    """ AWK program which writes rows into files chosen by the row values.
+
+    Params
+    ------
+    fields: tabtools.base.Header.fields
+    template: str, file name with {expression} placeholders, e.g.
+        "data/{symbol}/{strftime(\\"%Y\\", DateEpoch(date))}.tsv"
+    header: str, header line written once into every created file, None
+        to create files without header.
+    max_open_files: int, number of files kept open. Least recently used
+        file is closed (and its buffer flushed) when a new one is opened.
+    compress: str, shell command which compresses standard input to
+        standard output (e.g. "gzip -c"), None to write plain files.
+
+    Files are created (truncated) when the first row is written to them,
+    directories are created with mkdir -p. Rows are appended after a file was
+    closed by the LRU eviction, compressed files get a new compressed stream
+    appended.
+
+    """
+
+    PLACEHOLDER = re.compile(r'\{([^{}]+)\}')
+
+    def __init__(self, fields, template, header, max_open_files=256,
+                 compress=None):
+        if max_open_files < 1:
+            raise ValueError("At least one file should be open")
+
+        self.fields = fields
+        self.template = template
+        self.header = header
+        self.max_open_files = max_open_files
+        self.compress = compress
+        self.context = {
+            field.title: Expression('${}'.format(index + 1), title=field.title)
+            for index, field in enumerate(self.fields)
+        }
+
+        self.output = []
+        parts = []
+        for index, part in enumerate(self.PLACEHOLDER.split(template)):
+            if index % 2 == 0:
+                if part:
+                    parts.append(Expression._quote(part))
+                continue
+
+            title = "__partition_{}".format(index // 2)
+            self.output.extend(StreamExpression.from_str(
+                "{} = {}".format(title, part), self.context))
+            parts.append(title)
+
+        if not self.output:
+            raise ValueError("Template {} has no placeholders".format(template))
+        self.path_code = " ".join(parts)
+
+    @property
+    def begin_code(self):
+        code = super(AWKSplitProgram, self).begin_code
+        return "\n".join(filter(None, [code, '__lru_next[""] = __lru_prev[""] = ""']))
+
+    @property
+    def modules_code(self):
+        return "\n".join(filter(None, [
+            super(AWKSplitProgram, self).modules_code, self.module_lru]))
+
+    @property
+    def module_lru(self):
+        """LRU list of open files, lru_touch(path) closes the evicted one."""
+        return "\n".join([
+            '# awk module lru',
+            'function lru_touch(path, size,    tail) {if (path in __lru_next) {__lru_next[__lru_prev[path]] = __lru_next[path]; __lru_prev[__lru_next[path]] = __lru_prev[path]} else {if (__lru_size >= size) {tail = __lru_prev[""]; close(tail); __lru_next[__lru_prev[tail]] = ""; __lru_prev[""] = __lru_prev[tail]; delete __lru_next[tail]; delete __lru_prev[tail]; __lru_size--} __lru_size++} __lru_next[path] = __lru_next[""]; __lru_prev[path] = ""; __lru_prev[__lru_next[""]] = path; __lru_next[""] = path}',  # nolint
+            r'function shell_quote(s) {gsub(/\047/, "\047\\\\\047\047", s); return "\047" s "\047"}',  # nolint
+        ])
+
+    @property
+    def output_code(self):
+        if self.compress is None:
+            create = "__path"
+            output = "__path"
+            redirect = ">>"
+        else:
+            command = Expression._quote(self.compress)
+            create = '({} " > " shell_quote(__path))'.format(command)
+            output = '{} " >> " shell_quote(__path)'.format(command)
+            redirect = "|"
+
+        if self.header is None:
+            create_code = ['printf "" > __path', "close(__path)"]
+        else:
+            create_code = [
+                "print {} {} {}".format(
+                    Expression._quote(self.header),
+                    ">" if self.compress is None else "|", create),
+                "close({})".format(create),
+            ]
+
+        return "\n".join([str(o) for o in self.output] + [
+            "__path = {}".format(self.path_code),
+            "if (__path != __path_previous) {",
+            "    if (!(__path in __created)) {",
+            "        __directory = __path",
+            "        if (sub(/\\/[^\\/]*$/, \"\", __directory) && __directory != \"\" && !(__directory in __directories)) {",  # nolint
+            "            system(\"mkdir -p \" shell_quote(__directory))",
+            "            __directories[__directory] = 1",
+            "        }",
+        ] + ["        " + line for line in create_code] + [
+            "        __created[__path] = 1",
+            "    }",
+            "    __output = {}".format(output),
+            "    lru_touch(__output, {})".format(self.max_open_files),
+            "    __path_previous = __path",
+            "}",
+            "print {} __output".format(redirect),
+        ])
+
+
+SHELL_SCRIPT = """#!/bin/sh
+# {comment}
+# Input files or standard input should have the header fields:
+# {input_fields}
+# AWKPATH environment variable could set awk interpreter.
+input_fields={quoted_input_fields}
+
+check_header() {{
+    if [ "${{2%% #*}}" != "$input_fields" ]; then
+        printf '%s: unexpected header of %s\\n' "$0" "$1" >&2
+        exit 1
+    fi
+}}
+
+run() {{
+    LC_ALL=C "${{AWKPATH:-awk}}" -F {delimiter} -v OFS={delimiter} {program}
+}}
+
+if [ $# -eq 0 ]; then
+    if IFS= read -r line; then
+        check_header - "$line"
+    fi
+else
+    for f in "$@"; do
+        if [ ! -r "$f" ]; then
+            printf '%s: could not read %s\\n' "$0" "$f" >&2
+            exit 1
+        fi
+        if IFS= read -r line < "$f"; then
+            check_header "$f" "$line"
+        fi
+    done
+fi
+{output_header}
+if [ $# -eq 0 ]; then
+    run
+else
+    for f in "$@"; do
+        tail -n +2 -- "$f"
+    done | run
+fi
+"""
+
+
+def shell_script(program, input_header, output_header=None, comment=""):
+    """ POSIX shell script which runs the program without Python.
+
+    Params
+    ------
+    program: AWKBaseProgram built for the input header fields.
+    input_header: tabtools.base.Header, header of every input file.
+    output_header: tabtools.base.Header, printed first, optional.
+    comment: str, e.g. the command which generated the script.
+
+    Script reads files given as arguments or standard input, header fields
+    of the inputs are checked before the program starts, subheaders are
+    ignored.
+
+    """
+    fields = input_header.delimiter.join(map(str, input_header.fields))
+    return SHELL_SCRIPT.format(
+        comment=comment.replace("\n", " "),
+        input_fields=fields,
+        quoted_input_fields=quote(fields),
+        delimiter=quote(input_header.delimiter),
+        program=program,
+        output_header="" if output_header is None else
+        "printf '%s\\n' {}".format(quote(str(output_header))),
+    )
+
+
 class Expression(ast.NodeTransformer):
 
     """ Expression class.
@@ -243,21 +1305,32 @@ class Expression(ast.NodeTransformer):
 
     """
 
+    # Files used in "x in FILE(path)" starting from this size are not loaded
+    # into awk memory, see tabtools.bloom.
+    SEMIJOIN_MIN_SIZE = 64 * 2 ** 20
+
     def __init__(self, value, title=None, _type=None,
-                 context=None, begin=None, modules=None):
+                 context=None, begin=None, modules=None, semijoins=None,
+                 final=None, separator=None):
         """ Expression init.
 
         value: formula to use
         title: optional variable to assign
         begin: initial value
+        semijoins: set of (path, column) membership tests done outside awk
+        final: code to execute before group output
+        separator: value is a list joined with given separator variable
 
         """
         self.title = title
         self._type = _type
         self.value = value
         self.begin = begin
+        self.final = final
+        self.separator = separator
         self.context = context or {}
         self.modules = set(modules or {})
+        self.semijoins = set(semijoins or {})
 
     def __str__(self):
         if self.title is not None:
@@ -292,7 +1365,8 @@ class Expression(ast.NodeTransformer):
                 if isinstance(statement.value, ast.Name):
                     statement = ast.Assign(
                         targets=[statement.value], value=statement.value)
-                elif isinstance(statement.value, ast.Compare):
+                elif isinstance(statement.value, (
+                        ast.Compare, ast.BoolOp, ast.UnaryOp)):
                     pass
                 else:
                     raise ValueError("Incorrect input {}".format(statement))
@@ -350,7 +1424,8 @@ class Expression(ast.NodeTransformer):
                     options[op],
                     rights[-1].value
                 ),
-                context=self.context
+                context=self.context,
+                **self._inlined(lefts[-1], rights[-1])
             )
             output.append(expr)
             return output
@@ -367,6 +1442,7 @@ class Expression(ast.NodeTransformer):
         vals = []
         if op in options:
             output = []
+            inlined = []
 
             for value in node.values:
                 values = self.visit(value)
@@ -376,12 +1452,14 @@ class Expression(ast.NodeTransformer):
                     self.context.update(v.context)
 
                 vals.append(values[-1].value)
+                inlined.append(values[-1])
 
             expr = Expression(
                 " {} ".format(options[op]).join([
                     "({})".format(v) for v in vals
                 ]),
-                context=self.context
+                context=self.context,
+                **self._inlined(*inlined)
             )
             output.append(expr)
             return output
@@ -393,15 +1471,17 @@ class Expression(ast.NodeTransformer):
     def visit_UnaryOp(self, node):
         options = {
             ast.USub: '-',
+            ast.Not: '!',
         }
         op = type(node.op)
         if op in options:
-            output = self.visit(node.operand)
-            self.context.update(output[-1].context)
+            operands = self.visit(node.operand)
+            output = operands[:-1]
+            self.context.update(operands[-1].context)
 
             expr = Expression(
-                "{}{}".format(options[op], output[-1].value),
-                context=self.context)
+                "{}({})".format(options[op], operands[-1].value),
+                context=self.context, **self._inlined(operands[-1]))
             output.append(expr)
             return output
         else:
@@ -461,7 +1541,8 @@ class Expression(ast.NodeTransformer):
 
         self.context[var] = expression
         output.append(expression)
-        output.append(Expression(var, title=var))
+        output.append(Expression(
+            var, title=var, separator=expression.separator))
         return output
 
     def visit_Expr(self, node):
@@ -485,7 +1566,8 @@ class Expression(ast.NodeTransformer):
                 bodys[-1].value,
                 orelses[-1].value
             ),
-            context=self.context
+            context=self.context,
+            **self._inlined(tests[-1], bodys[-1], orelses[-1])
         )
         output.append(expr)
         return output
@@ -502,19 +1584,90 @@ class Expression(ast.NodeTransformer):
         lefts = self.visit(node.left)
         output = lefts[:-1]
         code = "({})".format(lefts[-1].value)
+        inlined = [lefts[-1]]
         for comparator, op in zip(node.comparators, node.ops):
+            op = type(op)
+            if op in (ast.In, ast.NotIn):
+                membership = self._visit_membership(lefts[-1], comparator)
+                inlined.append(membership)
+                code = "{}({})".format(
+                    "!" if op is ast.NotIn else "", membership.value)
+                continue
+
             comparators = self.visit(comparator)
             output.extend(comparators[:-1])
-            op = type(op)
             if op not in options:
                 raise ValueError('Unknown comparator {}'.format(op))
 
             code += " {} ({})".format(options[op], comparators[-1].value)
+            inlined.append(comparators[-1])
 
-        expr = Expression(code, context=self.context)
+        expr = Expression(
+            code, context=self.context, **self._inlined(*inlined))
         output.append(expr)
         return output
 
+    @staticmethod
+    def _inlined(*expressions):
+        """ Keep begin code and semi-joins of expressions used as values."""
+        return dict(
+            begin="; ".join(e.begin for e in expressions if e.begin) or None,
+            semijoins=set().union(*[e.semijoins for e in expressions]),
+        )
+
+    def _visit_membership(self, value, node):
+        """ Membership test: value in (a, b, c) or value in FILE("path").
+
+        Literal list and small files (first column, header is skipped) are
+        loaded into awk array in BEGIN block. Files larger than
+        SEMIJOIN_MIN_SIZE are not loaded into awk, rows are checked by
+        tabtools.bloom semi-join filter which appends 0/1 column instead.
+
+        """
+        var = "__in_{}".format(len(self.context))
+        self.context[var] = Expression(var)
+
+        if isinstance(node, ast.Call) and getattr(node.func, "id", None) == \
+                "FILE":
+            if len(node.args) != 1:
+                raise ValueError("FILE function: one argument is expected")
+            path = ast.literal_eval(node.args[0])
+
+            if os.path.getsize(path) >= self.SEMIJOIN_MIN_SIZE:
+                match = re.match(r"^\$(\d+)$", str(value.value))
+                if match is None:
+                    raise ValueError(
+                        "Only fields could be checked in large FILE")
+                semijoin = (os.path.abspath(path), int(match.group(1)))
+                return Expression(
+                    semijoin_variable(*semijoin), semijoins=[semijoin])
+
+            begin = " ".join([
+                'while ((getline __line < {path}) > 0)',
+                'if ({var}_n++) {{',
+                'split(__line, {var}_fields, FS);',
+                '{var}[{var}_fields[1]] = 1',
+                '}};',
+                'close({path})',
+            ]).format(path=self._quote(path), var=var)
+        else:
+            try:
+                values = ast.literal_eval(node)
+            except ValueError:
+                raise ValueError("Only constants could be used in IN list")
+            if not isinstance(values, (tuple, list, set, frozenset)):
+                raise ValueError("IN expects list or FILE(\"path\")")
+            begin = "; ".join(
+                "{}[{}] = 1".format(var, self._quote(v)) for v in values)
+
+        return Expression("({}) in {}".format(value.value, var), begin=begin)
+
+    @staticmethod
+    def _quote(value):
+        """ Represent python constant as awk string."""
+        return '"{}"'.format(
+            str(value).replace("\\", "\\\\").replace('"', '\\"'))
+
     def _get_suffix(self):
         """ Get unique suffix for variables insude the function."""
         return "_{}".format(int(time.time() * 10 ** 6))
@@ -745,6 +1898,9 @@ class GroupExpression(Expression):
 
     """ Expression for group operations."""
 
+    # Space-Saving counters per value returned by TOP_VALUES.
+    TOP_COUNTERS = 10
+
     def transform_FIRST(self, output, inputs):
         begin = "{o} = {v}".format(o=output, v=inputs[0].title)
         code = ""
@@ -781,3 +1937,202 @@ class GroupExpression(Expression):
         code = "{o}++".format(o=output)
         expression = Expression(code, begin=begin, context=self.context)
         return expression
+
+    def _transform_Heap(self, output, inputs, direction):
+        """ Keep k largest (direction 1) or smallest (-1) values of a group.
+
+        Values are kept in a bounded heap, O(log k) per row and O(k) memory per
+        group. Result is a list sorted from the best value.
+
+        """
+        if len(inputs) != 2:
+            raise ValueError("Function expects two arguments: (value, k)")
+
+        heap = "__heap{}".format(output)
+        begin = "heap_init({h}, __group_state); heap_push({h}, __group_state, {v}, {k}, {c})".format(  # nolint
+            h=heap, v=inputs[0].title, k=inputs[1].title, c=direction)
+        code = "heap_push({h}, __group_state, {v}, {k}, {c})".format(
+            h=heap, v=inputs[0].title, k=inputs[1].title, c=direction)
+        final = "{o} = heap_list({h}, __group_state, {c}, __list_separator)".format(  # nolint
+            o=output, h=heap, c=direction)
+        expression = Expression(
+            code, begin=begin, final=final, context=self.context,
+            modules=[AWKBaseProgram.MODULES.HEAP], separator="__list_separator")
+        return expression
+
+    def transform_TOPK(self, output, inputs):
+        return self._transform_Heap(output, inputs, direction=1)
+
+    def transform_BOTTOMK(self, output, inputs):
+        return self._transform_Heap(output, inputs, direction=-1)
+
+    def _transform_State(self, output, inputs, module, update, final,
+                         arguments=1, separator=None, **values):
+        """ Aggregate with state kept in an awk array of the module.
+
+        update and final are formatted with s (state array), o (output),
+        a0, a1 (arguments) and extra values.
+
+        """
+        if len(inputs) != arguments:
+            raise ValueError("Function expects {} argument(s)".format(arguments))
+
+        values.update({
+            "a{}".format(index): i.title for index, i in enumerate(inputs)})
+        values.update(s="__state{}".format(output), o=output)
+        update = update.format(**values)
+        begin = "{}_init({s}, __group_state); {}".format(
+            module.name.lower(), update, **values)
+        expression = Expression(
+            update, begin=begin, final=final.format(**values),
+            context=self.context, separator=separator, modules=[module])
+        return expression
+
+    def transform_COUNT_DISTINCT(self, output, inputs):
+        """ Approximate number of distinct values, HyperLogLog."""
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.HLL,
+            "hll_add({s}, __group_state, {a0})",
+            "{o} = hll_estimate({s}, __group_state)")
+
+    def transform_COUNT_DISTINCT_MERGE(self, output, inputs):
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.HLL,
+            "hll_merge({s}, __group_state, {a0})",
+            "{o} = hll_estimate({s}, __group_state)")
+
+    def transform_HLL(self, output, inputs):
+        """ Serialized HyperLogLog state, merged with HLL_MERGE."""
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.HLL,
+            "hll_add({s}, __group_state, {a0})",
+            "{o} = hll_state({s}, __group_state)")
+
+    def transform_HLL_MERGE(self, output, inputs):
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.HLL,
+            "hll_merge({s}, __group_state, {a0})",
+            "{o} = hll_state({s}, __group_state)")
+
+    def transform_QUANTILE(self, output, inputs):
+        """ Approximate q-quantile of the values, q in [0, 1]."""
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.KLL,
+            "kll_add({s}, __group_state, {a0})",
+            "{o} = kll_quantile({s}, __group_state, {a1})", arguments=2)
+
+    def transform_QUANTILE_MERGE(self, output, inputs):
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.KLL,
+            "kll_merge({s}, __group_state, {a0})",
+            "{o} = kll_quantile({s}, __group_state, {a1})", arguments=2)
+
+    def transform_KLL(self, output, inputs):
+        """ Serialized quantile sketch state, merged with KLL_MERGE."""
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.KLL,
+            "kll_add({s}, __group_state, {a0})",
+            "{o} = kll_state({s}, __group_state)")
+
+    def transform_KLL_MERGE(self, output, inputs):
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.KLL,
+            "kll_merge({s}, __group_state, {a0})",
+            "{o} = kll_state({s}, __group_state)")
+
+    def _transform_TopValues(self, output, inputs, update):
+        """ TOP_VALUES(x, k[, m]) with m Space-Saving counters, TOP_COUNTERS
+        times k by default."""
+        if len(inputs) not in (2, 3):
+            raise ValueError(
+                "Function expects (value, k) or (value, k, counters)")
+
+        counters = inputs[2].title if len(inputs) == 3 else \
+            "{} * {}".format(self.TOP_COUNTERS, inputs[1].title)
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.SPACE_SAVING, update,
+            "{o} = space_saving_list({s}, __group_state, {a1}, __list_separator)",  # nolint
+            arguments=len(inputs), separator="__list_separator",
+            m=counters)
+
+    def transform_TOP_VALUES(self, output, inputs):
+        """ Approximate k most frequent values as list of value:count.
+
+        Count is the guaranteed number of the value occurrences, it is less
+        than the true count by at most n / m for n values in the group.
+
+        """
+        return self._transform_TopValues(
+            output, inputs, "space_saving_add({s}, __group_state, {a0}, {m})")
+
+    def transform_TOP_VALUES_MERGE(self, output, inputs):
+        return self._transform_TopValues(
+            output, inputs,
+            "space_saving_merge({s}, __group_state, {a0}, {m})")
+
+    def transform_SPACE_SAVING(self, output, inputs):
+        """ Serialized Space-Saving state with m counters (second argument),
+        merged with SPACE_SAVING_MERGE or TOP_VALUES_MERGE."""
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.SPACE_SAVING,
+            "space_saving_add({s}, __group_state, {a0}, {a1})",
+            "{o} = space_saving_state({s}, __group_state)", arguments=2)
+
+    def transform_SPACE_SAVING_MERGE(self, output, inputs):
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.SPACE_SAVING,
+            "space_saving_merge({s}, __group_state, {a0}, {a1})",
+            "{o} = space_saving_state({s}, __group_state)", arguments=2)
+
+    def _transform_Moments(self, output, inputs, result, merge=False):
+        """ Aggregate based on moments of the values, see module_moments.
+
+        Functions with _MERGE suffix take "n mean M2 M3 M4" states, produced
+        by MOMENTS(x) or MOMENTS_MERGE(state), e.g. for every partition.
+
+        """
+        return self._transform_State(
+            output, inputs, AWKBaseProgram.MODULES.MOMENTS,
+            "moments_{}({{s}}, __group_state, {{a0}})".format(
+                "merge" if merge else "add"),
+            "{{o}} = moments_{}({{s}}, __group_state)".format(result))
+
+    def transform_AVG(self, output, inputs):
+        return self._transform_Moments(output, inputs, "avg")
+
+    def transform_VAR(self, output, inputs):
+        """ Sample variance."""
+        return self._transform_Moments(output, inputs, "var")
+
+    def transform_STD(self, output, inputs):
+        """ Sample standard deviation."""
+        return self._transform_Moments(output, inputs, "std")
+
+    def transform_SKEW(self, output, inputs):
+        """ Skewness g1 = m3 / m2 ^ 1.5."""
+        return self._transform_Moments(output, inputs, "skew")
+
+    def transform_KURT(self, output, inputs):
+        """ Excess kurtosis g2 = m4 / m2 ^ 2 - 3."""
+        return self._transform_Moments(output, inputs, "kurt")
+
+    def transform_MOMENTS(self, output, inputs):
+        return self._transform_Moments(output, inputs, "state")
+
+    def transform_AVG_MERGE(self, output, inputs):
+        return self._transform_Moments(output, inputs, "avg", merge=True)
+
+    def transform_VAR_MERGE(self, output, inputs):
+        return self._transform_Moments(output, inputs, "var", merge=True)
+
+    def transform_STD_MERGE(self, output, inputs):
+        return self._transform_Moments(output, inputs, "std", merge=True)
+
+    def transform_SKEW_MERGE(self, output, inputs):
+        return self._transform_Moments(output, inputs, "skew", merge=True)
+
+    def transform_KURT_MERGE(self, output, inputs):
+        return self._transform_Moments(output, inputs, "kurt", merge=True)
+
+    def transform_MOMENTS_MERGE(self, output, inputs):
+        return self._transform_Moments(output, inputs, "state", merge=True)
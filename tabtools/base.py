@@ -173,6 +173,40 @@ class SubheaderCount(Subheader):
         return subheader
 
 
+class SubheaderOrder(Subheader):
+
+    """ Subheader for file order information.
+
+    Value is a space separated list of <field>:<asc|desc>[:numeric], e.g.
+    ORDER: id:desc value:asc:numeric
+
+    """
+
+    def __init__(self, key, value):
+        super(SubheaderOrder, self).__init__(key, value.strip())
+
+    @property
+    def fields(self):
+        """ Return list of (title, direction, options) tuples."""
+        result = []
+        for item in self.value.split():
+            title, _, options = item.partition(":")
+            direction, _, options = options.partition(":")
+            result.append((title, direction or "asc", options))
+        return result
+
+    def is_sorted(self, titles):
+        """ Check whether file is sorted lexicographically by titles."""
+        return [f[:2] for f in self.fields[:len(titles)]] == \
+            [(title, "asc") for title in titles] and \
+            not any(f[2] for f in self.fields[:len(titles)])
+
+    @classmethod
+    def from_titles(cls, titles):
+        """ Ascending lexicographic order by titles, as ttsort sorts."""
+        return cls("order", " ".join(t + ":asc" for t in titles))
+
+
 class Header:
 
     """Data description based on the header
@@ -261,9 +295,15 @@ class Header:
         :return ValueError:
 
         """
+        # Most of the headers have the same fields, union distinct ones.
+        distinct_fields = {}
+        for header in headers:
+            distinct_fields.setdefault(
+                tuple(map(str, header.fields)), header.fields)
+
         fields = tuple(
             Field.union(*fields)
-            for fields in zip(*[header.fields for header in headers])
+            for fields in zip(*distinct_fields.values())
         )
 
         # Note: Instantiate class to be able to merge
@@ -287,3 +327,14 @@ class Header:
             fields=fields,
             subheaders=subheaders
         )
+
+
+def sort_key_options(header, keys):
+    """ Get sort options for given field titles.
+
+    Fields are compared lexicographically one by one, other tools which
+    rely on the order (e.g. ttjoin) expect the same comparison.
+
+    """
+    fields = [f.title for f in header.fields]
+    return ['-k{0},{0}'.format(fields.index(key) + 1) for key in keys]
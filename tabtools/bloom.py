@@ -0,0 +1,464 @@
+""" Bloom filter based semi-join.
+
+Membership check "x in FILE(path)" with a small key file is compiled into an
+awk array. Huge key lists (tens of millions of keys) would cost gigabytes of
+awk memory, so rows are checked before awk instead: Bloom filter rejects most
+of the keys which are not in the file, remaining keys are looked up in the
+sorted table of key hashes and verified with the key itself. Result of every
+check is appended to the row as 0/1 column, awk program reads it from the end
+of the row.
+
+Keys are hashed with 64 bit FNV-1a. With numpy rows are checked in blocks:
+hashes of a block of keys are computed column by column over their bytes,
+the filter is probed and the table is searched (numpy.searchsorted) for the
+whole block, only found keys are compared one by one. Without numpy every
+key is checked separately.
+
+Bloom filter, hash table and sorted keys are built once and cached next to
+the key file (<path>.bloom), cache is rebuilt if key file size or mtime
+changes.
+
+"""
+import hashlib
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+
+from .base import Header
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+MASK = 2 ** 64 - 1
+# Longer keys are hashed one by one, block of keys is hashed as a matrix of
+# their bytes with the width of the longest key.
+MAX_VECTOR_WIDTH = 64
+BLOCK_BYTES = 1 << 20
+UINT64 = struct.Struct("<Q")
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _mix(h):
+    """ Finalizer of murmur3, spreads FNV bits over both halves."""
+    h ^= h >> 33
+    h = (h * 0xff51afd7ed558ccd) & MASK
+    h ^= h >> 33
+    h = (h * 0xc4ceb9fe1a85ec53) & MASK
+    return h ^ (h >> 33)
+
+
+def key_hash(key):
+    """ 64 bit hash of bytes key."""
+    h = FNV_OFFSET
+    for byte in key:
+        h = ((h ^ byte) * FNV_PRIME) & MASK
+    return _mix(h)
+
+
+def key_hashes(keys):
+    """ numpy.uint64 array of hashes of bytes keys, same as key_hash."""
+    np = _numpy()
+    count = len(keys)
+    lengths = np.fromiter(map(len, keys), dtype=np.int64, count=count)
+    width = int(lengths.max()) if count else 0
+    if width > MAX_VECTOR_WIDTH:
+        return np.array([key_hash(key) for key in keys], dtype=np.uint64)
+
+    h = np.full(count, FNV_OFFSET, dtype=np.uint64)
+    if width:
+        matrix = np.array(keys, dtype="S{}".format(width)).view(np.uint8) \
+            .reshape(count, width)
+        prime = np.uint64(FNV_PRIME)
+        for column in range(width):
+            h = np.where(lengths > column, (h ^ matrix[:, column]) * prime, h)
+
+    for shift, factor in ((33, 0xff51afd7ed558ccd), (33, 0xc4ceb9fe1a85ec53)):
+        h ^= h >> np.uint64(shift)
+        h *= np.uint64(factor)
+    return h ^ (h >> np.uint64(33))
+
+
+class BloomFilter:
+
+    """ Bloom filter over bytes keys.
+
+    Params
+    ------
+    size: number of bits
+    hashes: number of hash functions
+    bits: bytearray, optional
+
+    Positions are generated with double hashing of the key hash halves.
+
+    """
+
+    def __init__(self, size, hashes, bits=None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def from_capacity(cls, capacity, error_rate=0.01):
+        """ Filter with optimal size for given number of keys."""
+        capacity = max(capacity, 1)
+        size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, int(round(size / capacity * math.log(2))))
+        return cls(size, hashes)
+
+    def _positions(self, h):
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def _vector_positions(self, hashes):
+        """ Positions matrix, row per hash."""
+        np = _numpy()
+        h1 = (hashes & np.uint64(0xffffffff))[:, None]
+        h2 = ((hashes >> np.uint64(32)) | np.uint64(1))[:, None]
+        steps = np.arange(self.hashes, dtype=np.uint64)[None, :]
+        return (h1 + steps * h2) % np.uint64(self.size)
+
+    def add(self, key):
+        for position in self._positions(key_hash(key)):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def add_hashes(self, hashes):
+        """ Add keys by numpy array of their hashes."""
+        np = _numpy()
+        positions = self._vector_positions(hashes).ravel()
+        np.bitwise_or.at(
+            np.frombuffer(self.bits, dtype=np.uint8),
+            positions >> np.uint64(3),
+            np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+
+    def contains_hashes(self, hashes):
+        """ Boolean numpy array, whether keys could be in the filter."""
+        np = _numpy()
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        positions = self._vector_positions(hashes)
+        found = bits[positions >> np.uint64(3)] & \
+            (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+        return found.all(axis=1)
+
+    def contains_hash(self, h):
+        """ Whether key with hash h could be in the filter."""
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(h)
+        )
+
+    def __contains__(self, key):
+        return self.contains_hash(key_hash(key))
+
+
+class KeySet:
+
+    """ Keys from the first column of a file with header.
+
+    Cache file structure:
+        <json metadata>\\n
+        <bloom filter bits, zero padded to 8 bytes>
+        <sorted key hashes, uint64 little endian>
+        <offsets of the keys in hashes order, uint64 little endian>
+        <sorted unique keys, one per line>
+
+    """
+
+    VERSION = 2
+    CACHE_SUFFIX = ".bloom"
+
+    def __init__(self, path, error_rate=0.01):
+        self.path = path
+        self.error_rate = error_rate
+        self.cache_path = self._cache_path()
+
+        if not self._load():
+            self.build()
+            self._load()
+
+    def _cache_path(self):
+        """ Cache next to the key file, temporary directory if read only."""
+        path = self.path + self.CACHE_SUFFIX
+        if os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+            return path
+
+        digest = hashlib.md5(os.path.abspath(path).encode('utf8'))
+        return os.path.join(
+            tempfile.gettempdir(),
+            "tabtools-{}{}".format(digest.hexdigest(), self.CACHE_SUFFIX)
+        )
+
+    @property
+    def fingerprint(self):
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load(self):
+        """ Load cache, return False if it does not exist or is stale."""
+        try:
+            f = open(self.cache_path, 'rb')
+        except IOError:
+            return False
+
+        with f:
+            meta = json.loads(f.readline().decode('utf8'))
+            if meta.get("version") != self.VERSION or \
+                    meta.get("source") != self.fingerprint:
+                return False
+
+            offset = f.tell()
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        bits_size = (meta["size"] + 7) // 8
+        self.bloom = BloomFilter(
+            meta["size"], meta["hashes"],
+            bits=self.data[offset:offset + bits_size])
+        self.count = meta["count"]
+        self.hashes_offset = offset + (bits_size + 7) // 8 * 8
+        self.offsets_offset = self.hashes_offset + 8 * self.count
+        self.keys_offset = self.offsets_offset + 8 * self.count
+
+        np = _numpy()
+        if np is not None:
+            self.table = np.frombuffer(
+                self.data, dtype="<u8", count=self.count,
+                offset=self.hashes_offset)
+            self.offsets = np.frombuffer(
+                self.data, dtype="<u8", count=self.count,
+                offset=self.offsets_offset)
+        return True
+
+    def build(self):
+        """ Sort unique keys with sort(1) and write cache atomically."""
+        with open(self.path) as f:
+            delimiter = Header.parse(f.readline()).delimiter
+
+        directory = os.path.dirname(self.cache_path)
+        env = dict(os.environ, LC_ALL='C')
+        with tempfile.TemporaryFile(dir=directory) as keys:
+            tail = subprocess.Popen(
+                ['tail', '-n+2', self.path], stdout=subprocess.PIPE, env=env)
+            cut = subprocess.Popen(
+                ['cut', '-d', delimiter, '-f1'], stdin=tail.stdout,
+                stdout=subprocess.PIPE, env=env)
+            tail.stdout.close()
+            sort = subprocess.Popen(
+                ['sort', '-u'], stdin=cut.stdout, stdout=keys, env=env)
+            cut.stdout.close()
+            if sort.wait() or cut.wait() or tail.wait():
+                raise ValueError("Could not sort keys of {}".format(self.path))
+
+            keys.seek(0)
+            if _numpy() is not None:
+                bloom, table = self._vector_table(keys)
+            else:
+                bloom, table = self._table(keys)
+
+            meta = {
+                "version": self.VERSION,
+                "source": self.fingerprint,
+                "size": bloom.size,
+                "hashes": bloom.hashes,
+                "count": len(table) // 16,
+            }
+            fd, path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as cache:
+                cache.write(json.dumps(meta).encode('utf8') + b'\n')
+                cache.write(bloom.bits)
+                cache.write(b"\0" * (-len(bloom.bits) % 8))
+                cache.write(table)
+                keys.seek(0)
+                shutil.copyfileobj(keys, cache)
+            os.rename(path, self.cache_path)
+
+    def _table(self, keys):
+        """ Bloom filter and bytes of hashes and offsets of the keys."""
+        items, offset = [], 0
+        for key in keys:
+            items.append((key_hash(key[:-1]), offset))
+            offset += len(key)
+        items.sort()
+
+        bloom = BloomFilter.from_capacity(len(items), self.error_rate)
+        for h, _ in items:
+            for position in bloom._positions(h):
+                bloom.bits[position >> 3] |= 1 << (position & 7)
+        return bloom, b"".join(
+            [UINT64.pack(h) for h, _ in items] +
+            [UINT64.pack(offset) for _, offset in items])
+
+    def _vector_table(self, keys):
+        """ Same as _table, keys are hashed in blocks with numpy."""
+        np = _numpy()
+        hashes, offsets, offset = [], [], 0
+        while True:
+            lines = keys.readlines(BLOCK_BYTES)
+            if not lines:
+                break
+            lengths = np.fromiter(map(len, lines), np.uint64, len(lines))
+            offsets.append(offset + np.cumsum(lengths) - lengths)
+            offset += int(lengths.sum())
+            hashes.append(key_hashes([line[:-1] for line in lines]))
+
+        bloom = BloomFilter.from_capacity(
+            sum(map(len, hashes)), self.error_rate)
+        for block in hashes:
+            bloom.add_hashes(block)
+        hashes = np.concatenate(hashes or [np.empty(0, np.uint64)])
+        offsets = np.concatenate(offsets or [np.empty(0, np.uint64)])
+        order = np.argsort(hashes, kind="stable")
+        return bloom, hashes[order].astype("<u8").tobytes() + \
+            offsets[order].astype("<u8").tobytes()
+
+    def _hash_at(self, index):
+        return UINT64.unpack_from(self.data, self.hashes_offset + 8 * index)[0]
+
+    def _key_at(self, index):
+        start = self.keys_offset + UINT64.unpack_from(
+            self.data, self.offsets_offset + 8 * index)[0]
+        return self.data[start:self.data.find(b'\n', start)]
+
+    def _verify(self, key, h, index):
+        """ Compare key with the keys of equal hashes starting from index."""
+        while index < self.count and self._hash_at(index) == h:
+            if self._key_at(index) == key:
+                return True
+            index += 1
+        return False
+
+    def __contains__(self, key):
+        h = key_hash(key)
+        if not self.bloom.contains_hash(h):
+            return False
+
+        lo, hi = 0, self.count
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self._hash_at(middle) < h:
+                lo = middle + 1
+            else:
+                hi = middle
+        return self._verify(key, h, lo)
+
+    def _equal(self, keys, index):
+        """ Boolean numpy array, whether keys are equal to the keys at index
+        of hashes table, compared as byte matrices."""
+        np = _numpy()
+        lengths = np.fromiter(map(len, keys), dtype=np.int64, count=len(keys))
+        width = int(lengths.max()) + 1 if len(keys) else 1
+        if width > MAX_VECTOR_WIDTH:
+            return np.array([
+                self._key_at(i) == key for key, i in zip(keys, index.tolist())
+            ], dtype=bool)
+
+        # Stored key is followed by newline, keys do not contain it.
+        expected = np.zeros((len(keys), width), dtype=np.uint8)
+        expected[:, :width - 1] = np.array(
+            keys, dtype="S{}".format(width - 1)).view(np.uint8) \
+            .reshape(len(keys), width - 1)
+        expected[np.arange(len(keys)), lengths] = ord('\n')
+
+        data = np.frombuffer(self.data, dtype=np.uint8)
+        starts = self.keys_offset + self.offsets[index].astype(np.int64)
+        stored = data[np.minimum(
+            starts[:, None] + np.arange(width), len(data) - 1)]
+        ignored = np.arange(width)[None, :] > lengths[:, None]
+        return ((stored == expected) | ignored).all(axis=1)
+
+    def contains(self, keys):
+        """ Boolean numpy array, whether every of bytes keys is in the set."""
+        np = _numpy()
+        hashes = key_hashes(keys)
+        result = self.bloom.contains_hashes(hashes)
+        candidates = np.flatnonzero(result)
+        index = np.searchsorted(self.table, hashes[candidates])
+        found = index < self.count
+        found[found] = self.table[index[found]] == hashes[candidates][found]
+        candidates, index = candidates[found], index[found]
+
+        found = self._equal([keys[c] for c in candidates.tolist()], index)
+        result[:] = False
+        result[candidates[found]] = True
+        # Hash collision: another key with the same hash could follow.
+        for position, i in zip(candidates[~found].tolist(),
+                               index[~found].tolist()):
+            result[position] = self._verify(
+                keys[position], int(hashes[position]), i + 1)
+        return result
+
+
+def semijoin(semijoins, delimiter):
+    """ Get function which appends membership checks to the rows.
+
+    Params
+    ------
+    semijoins: list of (path, column), column index starts from 1.
+    delimiter: str
+
+    Returns
+    -------
+    function(source, target) copying rows between binary streams.
+
+    """
+    np = _numpy()
+    checks = [(KeySet(path), column - 1) for path, column in semijoins]
+    delimiter = delimiter.encode('utf8')
+    yes, no = delimiter + b'1', delimiter + b'0'
+
+    def transform(source, target):
+        for line in source:
+            row = line.rstrip(b'\n')
+            values = row.split(delimiter)
+            target.write(row + b"".join([
+                yes if column < len(values) and values[column] in keys else no
+                for keys, column in checks
+            ]) + b'\n')
+
+    def vector_transform(source, target):
+        width = max(column for _, column in checks) + 1
+        # Suffix of the row for every combination of check results.
+        suffixes = [
+            b"".join(
+                yes if code >> index & 1 else no
+                for index in range(len(checks))
+            ) + b'\n'
+            for code in range(2 ** len(checks))
+        ]
+
+        def write(rows):
+            codes = np.zeros(len(rows), dtype=np.int64)
+            values = [row.split(delimiter, width) for row in rows]
+            counts = np.fromiter(
+                map(len, values), dtype=np.int64, count=len(values))
+            for index, (keys, column) in enumerate(checks):
+                found = keys.contains(
+                    [v[column] if len(v) > column else b"" for v in values])
+                codes |= (found & (counts > column)).astype(np.int64) << index
+            target.write(b"".join([
+                row + suffixes[code] for row, code in zip(rows, codes.tolist())
+            ]))
+
+        rest = b""
+        while True:
+            data = source.read(BLOCK_BYTES)
+            if not data:
+                break
+            rows = (rest + data).split(b'\n')
+            rest = rows.pop()
+            write(rows)
+        if rest:
+            write([rest])
+
+    return transform if np is None else vector_transform
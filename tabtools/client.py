@@ -0,0 +1,116 @@
+""" Thin clients of the tabtools daemon.
+
+If TABTOOLS_SOCKET environment variable is set and a daemon (tabtools serve)
+listens on it, the command line tools send their arguments, working
+directory and environment to the daemon together with descriptors 0, 1 and
+2 (SCM_RIGHTS), the tool runs in the daemon and reads and writes the
+client's descriptors directly. Otherwise the tool runs in this process.
+
+Request is the length of the message and NUL separated strings: tool,
+working directory, number of arguments, arguments and NAME=VALUE environment
+variables, none of them could contain NUL.
+
+The module imports only a few standard modules, socket is imported if the
+daemon is configured, scripts if there is no daemon.
+
+"""
+import os
+import struct
+import sys
+
+SOCKET_VARIABLE = "TABTOOLS_SOCKET"
+TOOLS = (
+    "ttcat", "ttsort", "ttmap", "ttreduce", "ttjoin", "ttuniq", "ttsplit",
+    "ttcache", "ttplot", "ttcompile",
+)
+DESCRIPTORS = (0, 1, 2)
+LENGTH = struct.Struct("!I")
+
+
+def encode(tool, argv, cwd, env):
+    """ Request message with its length."""
+    data = "\0".join(
+        [tool, cwd, str(len(argv))] + list(argv) +
+        ["{}={}".format(name, value) for name, value in env.items()]
+    ).encode('utf8', 'surrogateescape')
+    return LENGTH.pack(len(data)) + data
+
+
+def decode(data):
+    """ Request of the message without its length.
+
+    :return dict: tool, cwd, argv and env.
+    :raise ValueError:
+
+    """
+    items = data.decode('utf8', 'surrogateescape').split("\0")
+    if len(items) < 3 or not items[2].isdigit():
+        raise ValueError("Malformed request")
+    count = int(items[2])
+    return {
+        "tool": items[0],
+        "cwd": items[1],
+        "argv": items[3:3 + count],
+        "env": dict(item.split("=", 1) for item in items[3 + count:]),
+    }
+
+
+def request(tool, argv, path=None):
+    """ Run the tool in the daemon.
+
+    :return int: exit code of the tool, None if no daemon listens.
+
+    """
+    path = path or os.environ.get(SOCKET_VARIABLE)
+    if not path:
+        return None
+
+    import socket
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+
+    message = encode(tool, argv, os.getcwd(), os.environ)
+    with client:
+        client.sendmsg(
+            [message],
+            [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+              struct.pack("{}i".format(len(DESCRIPTORS)), *DESCRIPTORS))])
+        response = b""
+        while True:
+            data = client.recv(64)
+            if not data:
+                break
+            response += data
+
+    # Empty response: the tool was killed, e.g. by SIGPIPE.
+    return int(response) if response else 1
+
+
+def _tool(name):
+    def main():
+        code = request(name, sys.argv)
+        if code is None:
+            from . import scripts
+            return getattr(scripts, name)()
+        sys.exit(code)
+
+    main.__name__ = main.__qualname__ = name
+    main.__doc__ = "Run {} in the daemon if it listens.".format(name)
+    return main
+
+
+ttcat = _tool("ttcat")
+ttsort = _tool("ttsort")
+ttmap = _tool("ttmap")
+ttreduce = _tool("ttreduce")
+ttjoin = _tool("ttjoin")
+ttuniq = _tool("ttuniq")
+ttsplit = _tool("ttsplit")
+ttcache = _tool("ttcache")
+ttplot = _tool("ttplot")
+ttcompile = _tool("ttcompile")
@@ -0,0 +1,338 @@
+""" Columnar cache of text files.
+
+ttcache converts a file into a directory next to it (<path>.ttcache):
+
+    meta.json   header line, number of rows, column kinds, source fingerprint
+    <i>.npy     column values: int64, float64 or int32 dictionary codes
+    <i>.dict    dictionary of a string column, one value per line
+
+Columns are numeric only if all of their values are written canonically
+(str(int) or repr(float)), so the cache reproduces the file byte by byte.
+Arrays are in .npy format and could be memory mapped with numpy.load, numpy
+is not required to build or read them.
+
+Cache is used if the source size and mtime did not change. Only in-process
+numpy readers use it (tabtools.vectorized.read_batches and --engine numpy):
+numeric columns are read without parsing and strings are parsed once per
+dictionary value. awk reads the file itself, rebuilding text lines from the
+cache would be slower than reading them.
+
+"""
+import math
+import os
+import struct
+import sys
+from array import array
+from itertools import repeat
+
+from .base import Header, Field, Subheader
+
+BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# Size of .npy header, data is aligned for memory mapping.
+HEADER_SIZE = 128
+KINDS = {
+    # kind: (array typecode, npy descr)
+    "int": ('q', BYTE_ORDER + 'i8'),
+    "float": ('d', BYTE_ORDER + 'f8'),
+    "str": ('i', BYTE_ORDER + 'i4'),
+}
+
+
+def _batch_kind(values):
+    """ Kind and array of the values, array is None for strings.
+
+    Values are int or float if all of them are canonical numbers, the same
+    kind is checked for every batch of a column.
+
+    """
+    try:
+        numbers = list(map(int, values))
+    except ValueError:
+        pass
+    else:
+        if list(map(str, numbers)) == values and \
+                -2 ** 63 <= min(numbers) and max(numbers) < 2 ** 63:
+            return "int", array('q', numbers)
+        return "str", None
+
+    try:
+        numbers = list(map(float, values))
+    except ValueError:
+        return "str", None
+    if list(map(repr, numbers)) == values and \
+            all(map(math.isfinite, numbers)):
+        return "float", array('d', numbers)
+    return "str", None
+
+
+def _npy_header(descr, count):
+    """ Header of HEADER_SIZE bytes, it is rewritten with the final count."""
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}"\
+        .format(descr, count)
+    header += " " * (HEADER_SIZE - len(NPY_MAGIC) - 2 - len(header) - 1) + \
+        "\n"
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode('latin1')
+
+
+class _Column:
+
+    """ Column file written batch by batch, see ColumnarCache.build.
+
+    Kind of the column is the kind of its first batch. If a following batch
+    has other kind, written numbers are converted back to their canonical
+    strings and the column is rewritten with dictionary codes.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.kind = None
+        self.count = 0
+        self.dictionary = {}
+        self.file = open(path + ".npy", "w+b")
+        self.file.write(b"\0" * HEADER_SIZE)
+
+    def write(self, values):
+        kind, data = ("str", None) if self.kind == "str" else \
+            _batch_kind(values)
+        if self.kind is None:
+            self.kind = kind
+        elif kind != self.kind:
+            self._to_strings()
+        if self.kind == "str":
+            data = self._codes(values)
+        data.tofile(self.file)
+        self.count += len(values)
+
+    def _codes(self, values):
+        dictionary = self.dictionary
+        for value in dict.fromkeys(values):
+            if value not in dictionary:
+                dictionary[value] = len(dictionary)
+        return array('i', map(dictionary.__getitem__, values))
+
+    def _to_strings(self):
+        data = array(KINDS[self.kind][0])
+        self.file.seek(HEADER_SIZE)
+        data.fromfile(self.file, self.count)
+        self.file.seek(HEADER_SIZE)
+        self.file.truncate()
+        self.kind = "str"
+        self._codes(list(map(
+            str if data.typecode == 'q' else repr, data))).tofile(self.file)
+
+    def close(self):
+        """ Write header and dictionary, return kind of the column."""
+        kind = self.kind or "str"
+        self.file.seek(0)
+        self.file.write(_npy_header(KINDS[kind][1], self.count))
+        self.file.close()
+        if kind == "str":
+            with open(self.path + ".dict", "w", encoding='utf8',
+                      newline='') as f:
+                f.write("".join(value + "\n" for value in self.dictionary))
+        return kind
+
+
+class ColumnarCache:
+
+    """ Columnar cache of a regular file with header.
+
+    Params
+    ------
+    path: str, source file path.
+
+    Use ColumnarCache.load to get valid cache or None.
+
+    """
+
+    VERSION = 1
+    SUFFIX = ".ttcache"
+    BLOCK_SIZE = 1 << 22
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = self._directory(path)
+
+    @classmethod
+    def _directory(cls, path):
+        """ Cache next to the file, temporary directory if read only."""
+        directory = path + cls.SUFFIX
+        if os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+            return directory
+
+        import hashlib
+        import tempfile
+
+        digest = hashlib.md5(os.path.abspath(path).encode('utf8'))
+        return os.path.join(
+            tempfile.gettempdir(),
+            "tabtools-{}{}".format(digest.hexdigest(), cls.SUFFIX)
+        )
+
+    @staticmethod
+    def fingerprint(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @classmethod
+    def load(cls, path):
+        """ Cache of the file, None if it does not exist or is stale."""
+        cache = cls(path)
+        meta_path = os.path.join(cache.directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+
+        import json
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if meta.get("version") != cls.VERSION or \
+                meta.get("source") != cls.fingerprint(path):
+            return None
+
+        cache.meta = meta
+        return cache
+
+    @classmethod
+    def build(cls, path):
+        """ Build cache of the file in one pass, replace existing one."""
+        import json
+        import shutil
+        import tempfile
+
+        cache = cls(path)
+        source = cls.fingerprint(path)
+        with open(path, encoding='utf8', newline='') as f:
+            header_line = f.readline()
+            header = Header.parse(header_line)
+            directory = tempfile.mkdtemp(
+                dir=os.path.dirname(cache.directory) or ".")
+            try:
+                kinds, count = cls._write_columns(
+                    f, header.delimiter, len(header.fields), directory)
+                with open(os.path.join(directory, "meta.json"), "w") as meta:
+                    json.dump({
+                        "version": cls.VERSION,
+                        "source": source,
+                        "header": header_line,
+                        "count": count,
+                        "kinds": kinds,
+                    }, meta)
+                if os.path.isdir(cache.directory):
+                    shutil.rmtree(cache.directory)
+                os.rename(directory, cache.directory)
+            except BaseException:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise
+        return cls.load(path)
+
+    @classmethod
+    def remove(cls, path):
+        """ Remove cache of the file if it exists."""
+        import shutil
+
+        directory = cls(path).directory
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+
+    @classmethod
+    def _write_columns(cls, source, delimiter, size, directory):
+        """ Write columns of the lines by blocks, get kinds and row count.
+
+        Blocks are split into fields at once, the number of delimiters in
+        every line is checked first.
+
+        """
+        columns = [
+            _Column(os.path.join(directory, str(index)))
+            for index in range(size)
+        ]
+        count = 0
+        try:
+            while True:
+                text = source.read(cls.BLOCK_SIZE)
+                if not text:
+                    break
+                text += source.readline()
+                if not text.endswith("\n"):
+                    text += "\n"
+
+                lines = text[:-1].split("\n")
+                widths = list(map(str.count, lines, repeat(delimiter)))
+                if widths.count(size - 1) != len(lines):
+                    line = next(i for i, width in enumerate(widths)
+                                if width != size - 1)
+                    raise ValueError(
+                        "Line {} has {} values, {} expected".format(
+                            count + line + 2, widths[line] + 1, size))
+
+                fields = text[:-1].replace("\n", delimiter).split(delimiter)
+                for index, column in enumerate(columns):
+                    column.write(fields[index::size])
+                count += len(lines)
+        finally:
+            kinds = [column.close() for column in columns]
+        return kinds, count
+
+    @property
+    def header_line(self):
+        return self.meta["header"]
+
+    @property
+    def count(self):
+        return self.meta["count"]
+
+    @property
+    def titles(self):
+        return [f.title for f in Header.parse(self.header_line).fields]
+
+    @property
+    def kinds(self):
+        """ Dictionary title -> int, float or str."""
+        return dict(zip(self.titles, self.meta["kinds"]))
+
+    @property
+    def header(self):
+        """ Header with numeric column types and COUNT subheader."""
+        header = Header.parse(self.header_line)
+        fields = []
+        for field, kind in zip(header.fields, self.meta["kinds"]):
+            if field.type is None and kind != "str":
+                field = Field(field.title, "num")
+            fields.append(field)
+        subheaders = [s for s in header.subheaders if s.key != "count"]
+        count = Subheader("count", str(self.count)).proxy
+        count.__init__(count.key, count.value)
+        return Header(header.delimiter, fields, subheaders + [count])
+
+    def array_path(self, title):
+        """ Path of the column .npy file, e.g. for numpy.load."""
+        return os.path.join(
+            self.directory, "{}.npy".format(self.titles.index(title)))
+
+    def values(self, title):
+        """ Memory mapped column values, dictionary codes for strings."""
+        import mmap
+
+        kind = self.kinds[title]
+        with open(self.array_path(title), "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(NPY_MAGIC)] != NPY_MAGIC:
+            raise ValueError("{} is not a npy file".format(f.name))
+        offset = len(NPY_MAGIC) + 2 + struct.unpack("<H", data[8:10])[0]
+        if ("'descr': '{}'".format(KINDS[kind][1])).encode('latin1') \
+                not in data[:offset]:
+            raise ValueError("{} has unexpected byte order".format(f.name))
+        return memoryview(data)[offset:].cast(KINDS[kind][0])
+
+    def dictionary(self, title):
+        """ Values of a string column indexed by their codes."""
+        index = self.titles.index(title)
+        path = os.path.join(self.directory, "{}.dict".format(index))
+        with open(path, encoding='utf8', newline='') as f:
+            return f.read().split("\n")[:-1]
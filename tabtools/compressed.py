@@ -0,0 +1,224 @@
+""" Compressed input and output.
+
+Compressed regular files are recognized by their magic bytes and decompressed
+in a stream, header is read from the decompressed data. Parallel executables
+(pigz, zstd -T0, xz -T0, lbzip2) are preferred, python modules are used if
+none of the executables is installed.
+
+Output is compressed by a process which reads the standard output of the
+tool and its children.
+
+"""
+import atexit
+import os
+import subprocess
+import sys
+import threading
+
+
+def _gzip_open(fileobj, mode):
+    import gzip
+    return gzip.GzipFile(fileobj=fileobj, mode=mode)
+
+
+def _xz_open(fileobj, mode):
+    import lzma
+    return lzma.LZMAFile(fileobj, mode)
+
+
+def _bz2_open(fileobj, mode):
+    import bz2
+    return bz2.BZ2File(fileobj, mode)
+
+
+def _zstd_open(fileobj, mode):
+    """ zstd python implementation, standard since python 3.14."""
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(fileobj, mode)
+    except ImportError:
+        pass
+
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(
+            "zstd is not installed, install zstd or zstandard python package")
+
+    if 'r' in mode:
+        return zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True)
+    return zstandard.ZstdCompressor().stream_writer(fileobj)
+
+
+class Compression:
+
+    """ Compression format.
+
+    Params
+    ------
+    name: str, format name used in options.
+    magic: bytes, prefix of the compressed files.
+    commands: list of argv prefixes in order of preference, "-dc" is
+        appended to decompress, "-c" to compress standard input.
+    open: function(fileobj, mode) -> file object, python implementation.
+
+    Concatenated compressed streams are valid for all of the formats, so
+    files could be appended with new compressed data.
+
+    """
+
+    def __init__(self, name, magic, commands, open):
+        self.name = name
+        self.magic = magic
+        self.commands = commands
+        self.open = open
+
+    @property
+    def command(self):
+        """ First installed command, None if there is no one."""
+        import shutil
+
+        for command in self.commands:
+            if shutil.which(command[0]):
+                return command
+        return None
+
+    @property
+    def compress_command(self):
+        """ Shell command which compresses standard input to output."""
+        command = self.command
+        if command is None:
+            raise ValueError("{} is not installed".format(self.commands[0][0]))
+        return " ".join(command + ["-c"])
+
+
+COMPRESSIONS = [
+    Compression("gzip", b"\x1f\x8b", [["pigz"], ["gzip"]],
+                _gzip_open),
+    Compression("zstd", b"\x28\xb5\x2f\xfd", [["zstd", "-q", "-T0"]],
+                _zstd_open),
+    Compression("xz", b"\xfd7zXZ\x00", [["xz", "-T0"]],
+                _xz_open),
+    Compression("bz2", b"BZh", [["lbzip2"], ["pbzip2"], ["bzip2"]],
+                _bz2_open),
+]
+COMPRESSION_NAMES = [c.name for c in COMPRESSIONS]
+
+
+def get_compression(name):
+    for compression in COMPRESSIONS:
+        if compression.name == name:
+            return compression
+    raise ValueError("Unknown compression {}".format(name))
+
+
+def detect(fd):
+    """ Compression of a regular file by its magic bytes, None if plain."""
+    head = os.pread(fd.fileno(), 8, 0)
+    for compression in COMPRESSIONS:
+        if head.startswith(compression.magic):
+            return compression
+    return None
+
+
+COPY_BUFFER_SIZE = 1 << 20
+
+
+class Decompressor:
+
+    """ Decompressed stream of a compressed regular file.
+
+    Attributes
+    ----------
+    fd: file object, read end of a pipe with decompressed data.
+
+    """
+
+    def __init__(self, fd, compression):
+        self.name = getattr(fd, 'name', None)
+        self.compression = compression
+        self.error = None
+        read, write = os.pipe()
+        source = os.dup(fd.fileno())
+        os.lseek(source, 0, os.SEEK_SET)
+
+        command = compression.command
+        if command is not None:
+            self.process = subprocess.Popen(
+                command + ["-dc"], stdin=source, stdout=write)
+            self.thread = None
+            os.close(source)
+            os.close(write)
+        else:
+            self.process = None
+            self.thread = threading.Thread(
+                target=self._decompress, args=(source, write), daemon=True)
+            self.thread.start()
+
+        self.fd = os.fdopen(read)
+
+    def _decompress(self, source, write):
+        import shutil
+
+        try:
+            with open(source, 'rb') as raw, open(write, 'wb') as target:
+                with self.compression.open(raw, 'rb') as f:
+                    shutil.copyfileobj(f, target, COPY_BUFFER_SIZE)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """ Wait for the decompression end, raise ValueError if it failed."""
+        if self.process is not None:
+            failed = self.process.wait() not in (0, -13)  # -13 is SIGPIPE
+        else:
+            self.thread.join()
+            failed = self.error is not None
+        if failed:
+            raise ValueError("Could not decompress {} ({})".format(
+                self.name, self.compression.name))
+
+
+def compress_output(name):
+    """ Compress standard output of the process and its children.
+
+    Descriptor 1 is replaced with a pipe to the compressor, it is restored
+    and the compressor is waited for at exit.
+
+    """
+    compression = get_compression(name)
+    sys.stdout.flush()
+    read, write = os.pipe()
+    stdout = os.dup(1)
+
+    command = compression.command
+    if command is not None:
+        process = subprocess.Popen(
+            command + ["-c"], stdin=read, stdout=stdout)
+        os.close(read)
+        wait = process.wait
+    else:
+        def copy():
+            import shutil
+
+            with open(read, 'rb') as source, \
+                    open(stdout, 'wb', buffering=0, closefd=False) as raw:
+                with compression.open(raw, 'wb') as target:
+                    shutil.copyfileobj(source, target, COPY_BUFFER_SIZE)
+
+        thread = threading.Thread(target=copy, daemon=True)
+        thread.start()
+        wait = thread.join
+
+    os.dup2(write, 1)
+    os.close(write)
+
+    def finish():
+        sys.stdout.flush()
+        os.dup2(stdout, 1)
+        wait()
+
+    atexit.register(finish)
@@ -0,0 +1,209 @@
+""" Daemon which runs the command line tools for thin clients.
+
+    tabtools serve --socket /run/user/1000/tabtools.sock
+
+Modules, including the awk compiler, and awk interpreter lookup are done
+once before the first request. Header cache (TABTOOLS_HEADER_CACHE) is read
+by every request, other processes could update it.
+Every request is handled by a child forked from the daemon: the child
+replaces its descriptors 0, 1 and 2 with the client's ones, so data goes
+between the client's files and awk directly, changes directory and
+environment, runs the tool and sends its exit code back. At most
+--workers children run at once, other requests wait in the socket backlog.
+
+See tabtools.client for the protocol.
+
+"""
+import argparse
+import array
+import atexit
+import os
+import signal
+import socket
+import stat
+import sys
+import traceback
+
+from .client import DESCRIPTORS, LENGTH, SOCKET_VARIABLE, TOOLS, decode
+
+BACKLOG = 128
+TIMEOUT = 10
+
+
+def _receive(connection):
+    """ Get request message and descriptors of the client.
+
+    :return tuple: (message, descriptors)
+    :raise ValueError: malformed request, received descriptors are closed.
+
+    """
+    descriptors = array.array("i")
+    data, ancdata, _, _ = connection.recvmsg(
+        1 << 16, socket.CMSG_LEN(len(DESCRIPTORS) * descriptors.itemsize))
+    for level, kind, payload in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            descriptors.frombytes(
+                payload[:len(payload) - len(payload) % descriptors.itemsize])
+
+    try:
+        if len(descriptors) != len(DESCRIPTORS):
+            raise ValueError("Expected {} descriptors, got {}".format(
+                len(DESCRIPTORS), len(descriptors)))
+        while len(data) < LENGTH.size or \
+                len(data) < LENGTH.size + LENGTH.unpack_from(data)[0]:
+            chunk = connection.recv(1 << 16)
+            if not chunk:
+                raise ValueError("Incomplete request")
+            data += chunk
+        message = decode(data[LENGTH.size:])
+        if message.get("tool") not in TOOLS:
+            raise ValueError("Unknown tool {}".format(message.get("tool")))
+    except ValueError:
+        for fd in descriptors:
+            os.close(fd)
+        raise
+    return message, list(descriptors)
+
+
+def _call(tool):
+    """ Run the tool function, return its exit code."""
+    from . import scripts
+    try:
+        getattr(scripts, tool)()
+        code = 0
+    except SystemExit as e:
+        code = e.code
+        if code is None:
+            code = 0
+        elif not isinstance(code, int):
+            sys.stderr.write(str(code) + "\n")
+            code = 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+
+    # Compressed and Arrow outputs are finished at exit.
+    atexit._run_exitfuncs()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
+
+
+def _run(connection, message, descriptors):
+    """ Handle request in a forked child, never returns."""
+    code = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for target, fd in zip(DESCRIPTORS, descriptors):
+            os.dup2(fd, target)
+        for fd in set(descriptors) - set(DESCRIPTORS):
+            os.close(fd)
+        os.chdir(message["cwd"])
+        os.environ.clear()
+        os.environ.update(message["env"])
+        sys.argv = message["argv"]
+        code = _call(message["tool"])
+    finally:
+        try:
+            connection.sendall(str(code).encode())
+        except OSError:
+            pass
+        os._exit(code)
+
+
+def _reap(children, block=False):
+    """ Wait for finished children, block until one of them exits."""
+    while children:
+        pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+        if pid == 0:
+            return
+        children.discard(pid)
+        block = False
+
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+
+def serve(path, workers=None):
+    """ Listen on the Unix socket path and run requests of the clients.
+
+    Socket is accessible by the current user only, a stale socket file is
+    replaced. The socket file is removed on SIGTERM.
+
+    """
+    # Import the tools and the compiler and look up awk once, children
+    # forked with the same environment reuse them.
+    from . import scripts  # noqa
+    from .awk import awk_interpreter
+    awk_interpreter()
+
+    signal.signal(signal.SIGTERM, _terminate)
+
+    workers = workers or os.cpu_count() or 1
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(BACKLOG)
+
+    children = set()
+    try:
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                connection.settimeout(TIMEOUT)
+                try:
+                    message, descriptors = _receive(connection)
+                except (OSError, ValueError) as e:
+                    sys.stderr.write("Rejected request: {}\n".format(e))
+                    continue
+
+                _reap(children)
+                if len(children) >= workers:
+                    _reap(children, block=True)
+
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    server.close()
+                    connection.settimeout(None)
+                    _run(connection, message, descriptors)
+                children.add(pid)
+                for fd in descriptors:
+                    os.close(fd)
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tabtools daemon")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser(
+        "serve", help="Run the command line tools for thin clients")
+    serve_parser.add_argument(
+        "--socket", default=os.environ.get(SOCKET_VARIABLE),
+        help="Unix socket path, {} by default".format(SOCKET_VARIABLE))
+    serve_parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of requests run at once, number of CPUs by default")
+
+    args = parser.parse_args()
+    if args.command != "serve":
+        parser.error("command is required")
+    if not args.socket:
+        parser.error("--socket or {} is required".format(SOCKET_VARIABLE))
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers should be positive")
+
+    try:
+        serve(args.socket, args.workers)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,87 @@
+""" Hive style partitioned datasets.
+
+Dataset is a directory tree root/<key>=<value>/.../<file>. Partition keys are
+exposed as virtual columns appended to every row, filter expressions on them
+prune directories before any file of the directory is opened.
+
+"""
+import os
+
+
+class Dataset:
+
+    """ Partitioned dataset root directory.
+
+    Params
+    ------
+    root: str, dataset directory.
+
+    Files and directories starting with '.' or '_' (e.g. _SUCCESS) are
+    ignored. All of the files should have the same partition keys.
+
+    """
+
+    def __init__(self, root):
+        if not os.path.isdir(root):
+            raise ValueError("Dataset root {} is not a directory".format(root))
+        self.root = root
+
+    @staticmethod
+    def _is_hidden(name):
+        return name.startswith(".") or name.startswith("_")
+
+    @staticmethod
+    def parse_partition(name):
+        """ Get (key, value) of key=value directory name, None otherwise."""
+        from urllib.parse import unquote
+
+        key, sep, value = name.partition("=")
+        if not sep or not key:
+            return None
+        return unquote(key), unquote(value)
+
+    def partitions(self, filters=None):
+        """ Get list of (path, partition) of the dataset files.
+
+        Params
+        ------
+        filters: list of str filter expressions, directories for which they
+            are false are skipped.
+
+        Returns
+        -------
+        list of (path, [(key, value), ...]) sorted by path.
+
+        """
+        from .predicate import Predicate
+
+        predicate = Predicate(filters or [])
+        result = []
+        self._walk(self.root, [], predicate, result)
+
+        keys = {tuple(k for k, _ in partition) for _, partition in result}
+        if len(keys) > 1:
+            raise ValueError("Dataset {} has different partition keys {}".format(
+                self.root, sorted(keys)))
+        return result
+
+    def _walk(self, directory, partition, predicate, result):
+        for name in sorted(os.listdir(directory)):
+            if self._is_hidden(name):
+                continue
+
+            path = os.path.join(directory, name)
+            if not os.path.isdir(path):
+                result.append((path, partition))
+                continue
+
+            key_value = self.parse_partition(name)
+            if key_value is None:
+                self._walk(path, partition, predicate, result)
+                continue
+
+            values = dict(partition)
+            values[key_value[0]] = key_value[1]
+            if predicate(values) is False:
+                continue
+            self._walk(path, partition + [key_value], predicate, result)
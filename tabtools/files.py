@@ -1,11 +1,143 @@
 """File list abstraction module."""
+import contextlib
+import errno
+import functools
 import os
+import shlex
 import subprocess
 import sys
+import threading
 
-from .base import Header
+from .base import Header, Field
+from .arrow import ArrowReader, is_arrow
+from .columnar import ColumnarCache
+from .compressed import Decompressor, detect
+from .dataset import Dataset
 from .utils import cached_property
 
+# Header lines are the same for most of the files of a list, parse them once.
+parse_header = functools.lru_cache(maxsize=1024)(Header.parse)
+
+COPY_BUFFER_SIZE = 1 << 20
+
+
+def _write(target, data):
+    """ Write all of the data to the descriptor."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(target, view):]
+
+
+def _append_suffix(source, target, suffix):
+    """ Copy lines from binary file object appending suffix to them."""
+    for line in source:
+        _write(target, line.rstrip(b"\n") + suffix + b"\n")
+
+
+def copy_range(source, target, offset, count):
+    """ Copy count bytes from source descriptor offset to target descriptor.
+
+    copy_file_range copies data between regular files in kernel, sendfile
+    copies it to pipes and sockets. If neither of them is supported for the
+    descriptors, data is copied with a buffer. Position of the source is not
+    changed, target is written at its current position.
+
+    """
+    for method in ("copy_file_range", "sendfile"):
+        if count <= 0 or not hasattr(os, method):
+            continue
+        try:
+            while count > 0:
+                if method == "copy_file_range":
+                    copied = os.copy_file_range(source, target, count, offset)
+                else:
+                    copied = os.sendfile(target, source, offset, count)
+                if not copied:
+                    return
+                offset += copied
+                count -= copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                               errno.EBADF, errno.EOPNOTSUPP):
+                raise
+
+    while count > 0:
+        chunk = os.pread(source, min(count, COPY_BUFFER_SIZE), offset)
+        if not chunk:
+            return
+        _write(target, chunk)
+        offset += len(chunk)
+        count -= len(chunk)
+
+
+class HeaderCache:
+
+    """ First lines of regular files persisted between invocations.
+
+    Cache is a json file {path: [inode, size, mtime_ns, line]}, an entry is
+    used only if the file inode, size and modification time did not change.
+    FileList uses the cache from TABTOOLS_HEADER_CACHE environment variable.
+
+    """
+
+    VERSION = 1
+    ENVIRONMENT_VARIABLE = "TABTOOLS_HEADER_CACHE"
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = self._load()
+        self.changed = False
+
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get(cls.ENVIRONMENT_VARIABLE)
+        return cls(path) if path else None
+
+    def _load(self):
+        import json
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return {}
+        return data.get("lines", {})
+
+    @staticmethod
+    def fingerprint(stat):
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def get(self, path, stat):
+        """ Cached line of the file, None if it is unknown or stale."""
+        entry = self.lines.get(path)
+        if entry is not None and entry[:3] == self.fingerprint(stat):
+            return entry[3]
+
+    def set(self, path, stat, line):
+        self.lines[path] = self.fingerprint(stat) + [line]
+        self.changed = True
+
+    def save(self):
+        """ Write cache atomically, cache is optional so errors are ignored."""
+        if not self.changed:
+            return
+
+        import json
+        import tempfile
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(
+                    {"version": self.VERSION, "lines": self.lines}))
+            os.rename(path, self.path)
+        except OSError:
+            return
+        self.changed = False
+
 
 class File:
 
@@ -14,10 +146,18 @@ class File:
     Attributes:
     fd - file descriptor
     has_header (bool=True) whether file has header or not.
+    partition - list of (key, value) of dataset partition, values are
+        appended to every line as virtual columns.
+    header_cache - HeaderCache for regular files first lines, optional.
+    decoder - object with fd (text stream) and wait() methods, e.g.
+        tabtools.compressed.Decompressor. Compressed and Arrow files are read
+        as streams of decoded lines.
 
     """
 
-    def __init__(self, fd, has_header):
+    decoder = None
+
+    def __init__(self, fd, has_header, partition=None, header_cache=None):
         """ Init fie object.
 
         :param fd: file descriptor
@@ -26,12 +166,14 @@ class File:
         """
         self.fd = fd
         self.has_header = has_header
+        self.partition = partition or []
+        self.header_cache = header_cache
 
     @property
     def header(self):
         if self.header_line is None:
             raise ValueError("Header line is not defined")
-        return Header.parse(self.header_line)
+        return self._partition_header(parse_header(self.header_line))
 
     def generate_header(self):
         """Generate header based on the data line.
@@ -42,7 +184,76 @@ class File:
         Return: Header
         """
         header = Header.parse(self.first_data_line)
-        return Header.generate(header.delimiter, len(header.fields))
+        return self._partition_header(
+            Header.generate(header.delimiter, len(header.fields)))
+
+    def _partition_header(self, header):
+        """ Append partition keys to the header fields."""
+        if not self.partition:
+            return header
+
+        titles = {f.title for f in header.fields}
+        for key, _ in self.partition:
+            if key in titles:
+                raise ValueError("Partition key {} is a field of {}".format(
+                    key, self.fd.name))
+
+        return Header(
+            delimiter=header.delimiter,
+            fields=header.fields + tuple(Field(k) for k, _ in self.partition),
+            subheaders=header.subheaders
+        )
+
+    @property
+    def partition_suffix(self):
+        """ Partition values with delimiters, appended to every line."""
+        line = self.header_line if self.has_header else self.first_data_line
+        delimiter = parse_header(line).delimiter
+        return "".join(delimiter + value for _, value in self.partition)
+
+    @property
+    def size(self):
+        """ Size of the file in bytes, None if it is not known."""
+        return None
+
+    def copy_body(self, target):
+        """ Copy file lines except header to the target descriptor.
+
+        Data is copied from the current position of the descriptor, the
+        first data line has already been read.
+
+        """
+        suffix = self.partition_suffix.encode('utf8') if self.partition \
+            else b""
+        if not self.has_header and self.first_data_line is not None:
+            _write(target, self.first_data_line.encode('utf8') + suffix + b"\n")
+
+        source = self.fd.fileno()
+        if suffix:
+            with open(os.dup(source), 'rb') as f:
+                _append_suffix(f, target, suffix)
+        else:
+            while True:
+                chunk = os.read(source, COPY_BUFFER_SIZE)
+                if not chunk:
+                    break
+                _write(target, chunk)
+        self.wait()
+
+    def body_fd(self):
+        """ New descriptor positioned at the body, None if body has to be
+        copied (see copy_body)."""
+        return None
+
+    @property
+    def columnar_cache(self):
+        """ Valid tabtools.columnar.ColumnarCache of the file or None."""
+        return None
+
+    def wait(self):
+        """ Raise ValueError if the file could not be read completely."""
+        if self.decoder is not None:
+            self.decoder.wait()
 
     @property
     def proxy(self):
@@ -50,12 +261,24 @@ class File:
         try:
             self.fd.tell()
         except IOError:
-            return StreamFile(self.fd, self.has_header)
+            return StreamFile(self.fd, self.has_header, self.partition)
         except ValueError:
             # Operation on closed descriptor
             return None
         else:
-            return RegularFile(self.fd, self.has_header)
+            compression = detect(self.fd)
+            if compression is not None:
+                return StreamFile(
+                    None, self.has_header, self.partition,
+                    decoder=Decompressor(self.fd, compression))
+
+            if is_arrow(self.fd):
+                return StreamFile(
+                    None, self.has_header, self.partition,
+                    decoder=ArrowReader(self.fd, self.has_header))
+
+            return RegularFile(
+                self.fd, self.has_header, self.partition, self.header_cache)
 
 
 class RegularFile(File):
@@ -66,8 +289,9 @@ class RegularFile(File):
 
     """
 
-    def __init__(self, fd, has_header):
-        super(RegularFile, self).__init__(fd, has_header)
+    def __init__(self, fd, has_header, partition=None, header_cache=None):
+        super(RegularFile, self).__init__(
+            fd, has_header, partition, header_cache)
 
         if has_header:
             self.header_line = self.readline()
@@ -75,24 +299,76 @@ class RegularFile(File):
             self.first_data_line = self.readline()
 
     def readline(self):
-        """ Return regular file header."""
-        with open(self.fd.name) as f:
-            line = f.readline()
+        """ Return regular file first line, file position is not changed."""
+        fileno = self.fd.fileno()
+        path = getattr(self.fd, 'name', None)
+        cached = self.header_cache is not None and isinstance(path, str) \
+            and not path.startswith('<')
+        if cached:
+            path, stat = os.path.abspath(path), os.fstat(fileno)
+            line = self.header_cache.get(path, stat)
+            if line is not None:
+                return line
+
+        chunks, offset = [], 0
+        while True:
+            chunk = os.pread(fileno, 65536, offset)
+            end = chunk.find(b'\n')
+            if end >= 0:
+                chunks.append(chunk[:end + 1])
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        line = b"".join(chunks).decode('utf8')
+
+        if cached:
+            self.header_cache.set(path, stat, line)
         return line
 
     @property
-    def body_descriptor(self):
-        """ Return regular file descriptor.
+    def size(self):
+        return os.fstat(self.fd.fileno()).st_size
 
-        Regular file has header, descriptor consists of lines starting
-        from second.
+    def body_fd(self):
+        if self.partition:
+            return None
+        descriptor = os.dup(self.fd.fileno())
+        os.lseek(descriptor, self.body_offset, os.SEEK_SET)
+        return descriptor
+
+    @property
+    def columnar_cache(self):
+        name = getattr(self.fd, 'name', None)
+        if not self.has_header or not isinstance(name, str) or \
+                name.startswith('<'):
+            return None
+        return ColumnarCache.load(name)
+
+    @property
+    def body_offset(self):
+        """ Offset of the first data line in bytes."""
+        if not self.has_header:
+            return 0
+        return len(self.header_line.encode('utf8'))
+
+    def copy_body(self, target):
+        """ Copy file lines except header to the target descriptor.
+
+        Lines of partitioned files are copied with partition values, others
+        are copied in kernel without reading them into user space.
 
         """
-        os.lseek(self.fd.fileno(), 0, os.SEEK_SET)
-        if self.has_header:
-            return "<(tail -qn+2 {})".format(self.fd.name)
-        else:
-            return self.fd.name
+        source = self.fd.fileno()
+        if not self.partition:
+            copy_range(source, target, self.body_offset,
+                       self.size - self.body_offset)
+            return
+
+        with open(os.dup(source), 'rb') as f:
+            f.seek(self.body_offset)
+            _append_suffix(f, target, self.partition_suffix.encode('utf8'))
 
 
 class StreamFile(File):
@@ -103,14 +379,22 @@ class StreamFile(File):
 
     """
 
-    def __init__(self, fd, has_header):
-        super(StreamFile, self).__init__(fd, has_header)
+    def __init__(self, fd, has_header, partition=None, decoder=None):
+        if decoder is not None:
+            fd = decoder.fd
+            self.decoder = decoder
+        super(StreamFile, self).__init__(fd, has_header, partition)
 
         if has_header:
             self.header_line = self.readline()
         else:
             self.first_data_line = self.readline()
 
+    def body_fd(self):
+        if not self.has_header or self.partition:
+            return None
+        return os.dup(self.fd.fileno())
+
     def readline(self):
         """Read one line and return it."""
         chars = []
@@ -125,22 +409,6 @@ class StreamFile(File):
         else:
             return None
 
-    @property
-    def body_descriptor(self):
-        """ Return file descriptor in system."""
-        # NOTE: it is important to combine two file descriptors into one.
-        # Otherwise commands like tail would treat both stream independently and
-        # produce incorrect result (e.g. extra line for tail).
-        # This looks not great as one need to combile a line (echo-ed) with the
-        # rest of the stream into one stream.
-        # https://unix.stackexchange.com/questions/64736/
-        #   combine-output-from-two-commands-in-bash
-        if self.has_header:
-            return '/dev/fd/' + str(self.fd.fileno())
-        else:
-            return "<(cat <(echo \"{}\") <(cat /dev/fd/{}))".format(
-                self.first_data_line, self.fd.fileno())
-
 
 class FileList(list):
 
@@ -152,22 +420,100 @@ class FileList(list):
         <str> - use passed header, files should not have headers
     header should be an instance of a Header class.
 
+    files could contain tabtools.dataset.Dataset, it is expanded into its
+    files, partition values are appended to the lines. Passed header should
+    include partition fields. Dataset partitions for which filters are false
+    are skipped without opening their files.
+
+    First lines of the files are read in a thread pool, header_cache
+    (HeaderCache from the environment by default) skips reading of
+    unchanged files.
+
     """
 
-    def __init__(self, files=None, header_line=''):
+    MAX_WORKERS = 32
+
+    def __init__(self, files=None, header_line='', filters=None,
+                 header_cache=None):
         files = files or [sys.stdin]
         has_header = (header_line == '')
-        super(FileList, self).__init__([File(f, has_header).proxy for f in files])
+        if header_cache is None:
+            header_cache = HeaderCache.from_environment()
+
+        def proxy(item):
+            f, partition = item
+            if isinstance(f, str):
+                f = open(f)
+            return File(f, has_header, partition, header_cache).proxy
+
+        items = list(self._expand(files, filters))
+        workers = min(self.MAX_WORKERS, len(items))
+        if workers > 1:
+            # One thread per chunk of files, task overhead is comparable
+            # with reading of a cached header. Plain threads are used as
+            # concurrent.futures import takes longer than reading headers.
+            results = [None] * workers
+            errors = []
+
+            def read(index):
+                try:
+                    results[index] = [
+                        proxy(item) for item in items[index::workers]]
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [
+                threading.Thread(target=read, args=(i,))
+                for i in range(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+
+            proxies = [None] * len(items)
+            for i, result in enumerate(results):
+                proxies[i::workers] = result
+        else:
+            proxies = [proxy(item) for item in items]
+
+        super(FileList, self).__init__(proxies)
         self.header_line = header_line
+        if header_cache is not None:
+            header_cache.save()
 
-    @property
-    def body_descriptors(self):
-        """ Return list of file descriptors."""
-        return [f.body_descriptor for f in self]
+    @staticmethod
+    def _expand(files, filters):
+        """ Get (file, partition) pairs, dataset files are paths."""
+        for f in files:
+            if isinstance(f, Dataset):
+                for path, partition in f.partitions(filters):
+                    yield path, partition
+            else:
+                yield f, None
 
-    @property
+    def columnar_caches(self):
+        """ Columnar caches of the files, None if some file has no cache.
+
+        Caches are read by in-process engines only (see tabtools.columnar),
+        bodies of the files are read otherwise.
+
+        """
+        caches = [f.columnar_cache for f in self]
+        if not caches or None in caches:
+            return None
+        return caches
+
+    def copy_bodies(self, target):
+        """ Copy bodies of the files to the target descriptor."""
+        for f in self:
+            f.copy_body(target)
+
+    @cached_property
     def header(self):
-        """ Get header for files list.
+        """ Get header for files list, it is computed once.
 
         :return str: header
         :raise ValueError:
@@ -189,12 +535,117 @@ class FileList(list):
         return Header.parse(self.header_line)
 
     def __call__(self, *args, **kwargs):
-        command = [
-            '/bin/bash', '-o', 'pipefail', '-o', 'errexit', '-c',
-        ]
-        args = list(args)
-        subcommand = " ".join(
-            ['LC_ALL=C', args.pop(0)] + args + self.body_descriptors
-        )
-        command.append(subcommand)
-        subprocess.call(command)
+        """ Run command with file bodies as its input.
+
+        Command is executed without a shell, args are shell words, e.g.
+        quoted awk program, split with shlex. Bodies are concatenated into
+        the command standard input: a single regular file is passed as a
+        descriptor positioned after its header, otherwise bodies are copied
+        into a pipe by one thread (in kernel for regular files).
+
+        If separate is True, every body is passed as /dev/fd/N argument
+        instead, e.g. join reads files by their positions.
+        If transform function is passed, concatenated bodies are copied
+        through it.
+
+        """
+        transform = kwargs.get('transform')
+        separate = kwargs.get('separate', False)
+        command = shlex.split(" ".join(args))
+        env = dict(os.environ, LC_ALL='C')
+        feeders = []
+
+        if separate:
+            descriptors = [self._pipe([f], feeders) for f in self]
+            process = subprocess.Popen(
+                command + ['/dev/fd/{}'.format(fd) for fd in descriptors],
+                pass_fds=descriptors, env=env)
+            for fd in descriptors:
+                os.close(fd)
+        elif transform is None:
+            descriptor = self._stdin(feeders)
+            process = subprocess.Popen(command, stdin=descriptor, env=env)
+            os.close(descriptor)
+        else:
+            process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, env=env)
+            with os.fdopen(self._stdin(feeders), 'rb') as source:
+                transform(source, process.stdin)
+            process.stdin.close()
+
+        code = process.wait()
+        self._wait(feeders)
+        return code
+
+    def process(self, function):
+        """ Call function with binary file of concatenated bodies.
+
+        Bodies are passed as in __call__ without separate and transform
+        options, result of the function is returned.
+
+        """
+        with self.bodies() as source:
+            return function(source)
+
+    @contextlib.contextmanager
+    def bodies(self):
+        """ Binary file of concatenated bodies, files are waited for after
+        it is closed."""
+        feeders = []
+        with os.fdopen(self._stdin(feeders), 'rb') as source:
+            yield source
+        self._wait(feeders)
+
+    def _wait(self, feeders):
+        """ Wait for the feeders and files, raise their errors."""
+        for feeder in feeders:
+            feeder.join()
+            if feeder.error is not None:
+                raise feeder.error
+        for f in self:
+            f.wait()
+
+    def _stdin(self, feeders):
+        """ Descriptor with concatenated bodies."""
+        if len(self) == 1:
+            descriptor = self[0].body_fd()
+            if descriptor is not None:
+                return descriptor
+        return self._pipe(self, feeders)
+
+    @staticmethod
+    def _pipe(files, feeders):
+        """ Read end of a pipe, bodies are written to it by a thread."""
+        read, write = os.pipe()
+        feeder = BodyFeeder(files, write)
+        feeder.start()
+        feeders.append(feeder)
+        return read
+
+
+class BodyFeeder(threading.Thread):
+
+    """ Thread which copies file bodies into a descriptor and closes it.
+
+    Reader could exit before reading all of the data (e.g. head), in this
+    case the rest of the bodies is skipped. Other errors are stored in the
+    error attribute.
+
+    """
+
+    def __init__(self, files, target):
+        super(BodyFeeder, self).__init__(daemon=True)
+        self.files = files
+        self.target = target
+        self.error = None
+
+    def run(self):
+        try:
+            for f in self.files:
+                f.copy_body(self.target)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            os.close(self.target)
@@ -0,0 +1,381 @@
+""" Evaluation of filter expressions in python.
+
+Filter expressions (ttmap -w) are compiled into awk, but some of them could
+be checked before awk starts, e.g. conditions on dataset partition values
+prune whole directories. Evaluation follows awk comparison rules: values are
+compared as numbers if both of them look like numbers, otherwise as strings.
+
+Evaluation is three-valued: result is None if it depends on unknown values,
+e.g. on fields which are not partition keys. Predicate could also be compiled
+into a function of complete rows, e.g. for iter_rows.
+
+"""
+import ast
+import math
+import operator
+import re
+
+NUMBER = re.compile(r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$')
+# Longest prefix converted to number by strtod.
+NUMBER_PREFIX = re.compile(
+    r"\s*([+-]?(?:0x(?:[0-9a-f]+\.?[0-9a-f]*|\.[0-9a-f]+)(?:p[+-]?\d+)?|"
+    r"(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?|inf(?:inity)?|nan))",
+    re.IGNORECASE
+)
+
+COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+
+def awk_number(value):
+    """ Numeric value of a string: its longest numeric prefix or 0."""
+    match = NUMBER_PREFIX.match(value)
+    if match is None:
+        return 0.0
+    number = match.group(1)
+    if number.lstrip("+-")[:2].lower() == "0x":
+        try:
+            return float.fromhex(number)
+        except OverflowError:
+            return -math.inf if number.startswith("-") else math.inf
+    return float(number)
+
+
+def _divide(a, b):
+    """ Division as in awk: by zero gives infinity or NaN."""
+    if b == 0:
+        return math.nan if a == 0 or a != a else math.copysign(
+            math.inf, a) * math.copysign(1, b)
+    return a / b
+
+
+ARITHMETIC = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*"}
+
+
+class Unknown(Exception):
+
+    """ Value could not be determined."""
+
+
+class Predicate:
+
+    """ Conjunction of filter expressions.
+
+    Params
+    ------
+    expressions: list of str, every expression could contain several
+        statements separated by ';', as ttmap --where.
+
+    """
+
+    def __init__(self, expressions):
+        self.expressions = expressions
+        self.statements = [
+            statement.value
+            for expression in expressions
+            for statement in ast.parse(expression).body
+            if isinstance(statement, ast.Expr)
+        ]
+
+    def __call__(self, values):
+        """ Evaluate predicate.
+
+        Params
+        ------
+        values: dict, title -> str value of known fields.
+
+        Returns
+        -------
+        True/False, None if result depends on unknown fields.
+
+        """
+        result = True
+        for statement in self.statements:
+            value = self._evaluate_bool(statement, values)
+            if value is False:
+                return False
+            if value is None:
+                result = None
+        return result
+
+    @property
+    def names(self):
+        """ Set of names used in the expressions."""
+        return {
+            node.id for statement in self.statements
+            for node in ast.walk(statement) if isinstance(node, ast.Name)
+        }
+
+    def _evaluate_bool(self, node, values):
+        if isinstance(node, ast.BoolOp):
+            results = [self._evaluate_bool(v, values) for v in node.values]
+            stop = isinstance(node.op, ast.Or)
+            if stop in results:
+                return stop
+            return None if None in results else not stop
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            result = self._evaluate_bool(node.operand, values)
+            return None if result is None else not result
+
+        try:
+            return self._truth(self._evaluate(node, values))
+        except Unknown:
+            return None
+
+    @classmethod
+    def _truth(cls, value):
+        if cls._is_number(value):
+            return float(value) != 0
+        return value != ""
+
+    def _evaluate(self, node, values):
+        """ Get value of an expression, raise Unknown if it is not known."""
+        if isinstance(node, ast.Constant) and \
+                isinstance(node.value, (str, int, float)) and \
+                not isinstance(node.value, bool):
+            return node.value
+
+        if isinstance(node, ast.Name):
+            if node.id not in values:
+                raise Unknown(node.id)
+            return Value(values[node.id])
+
+        if isinstance(node, ast.Compare):
+            left = self._evaluate(node.left, values)
+            for op, comparator in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.In, ast.NotIn)):
+                    if not isinstance(comparator, (ast.List, ast.Tuple, ast.Set)):
+                        raise Unknown(comparator)
+                    result = any(
+                        self._compare(ast.Eq(), left, self._evaluate(e, values))
+                        for e in comparator.elts
+                    ) != isinstance(op, ast.NotIn)
+                    right = None
+                else:
+                    right = self._evaluate(comparator, values)
+                    result = self._compare(op, left, right)
+                if not result:
+                    return 0
+                left = right
+            return 1
+
+        if isinstance(node, ast.BoolOp) or isinstance(node, ast.UnaryOp) \
+                and isinstance(node.op, ast.Not):
+            result = self._evaluate_bool(node, values)
+            if result is None:
+                raise Unknown(node)
+            return int(result)
+
+        raise Unknown(node)
+
+    def compile(self, titles):
+        """ Compile predicate into a function of a row.
+
+        Params
+        ------
+        titles: list of field titles, row is a sequence of field strings in
+            the same order.
+
+        Returns function row -> bool. Values are compared with the same
+        rules as in __call__, arithmetic operations convert values to
+        numbers as awk does. Other expressions and names which are not
+        titles raise ValueError.
+
+        """
+        compiler = _Compiler(titles)
+        tests = [compiler.truth(statement) for statement in self.statements]
+        source = "lambda row: " + (" and ".join(tests) or "True")
+        return eval(source, compiler.namespace)
+
+    @staticmethod
+    def _is_number(value):
+        """ Numeric constants and numeric looking field values (strnum)."""
+        if isinstance(value, Value):
+            return NUMBER.match(value) is not None
+        return isinstance(value, (int, float))
+
+    @staticmethod
+    def _string(value):
+        """ String value, numbers are converted as awk CONVFMT does."""
+        if isinstance(value, str):
+            return value
+        if float(value).is_integer():
+            return str(int(value))
+        return "%.6g" % value
+
+    def _compare(self, op, left, right):
+        if type(op) not in COMPARISONS:
+            raise Unknown(op)
+        if self._is_number(left) and self._is_number(right):
+            return COMPARISONS[type(op)](float(left), float(right))
+        return COMPARISONS[type(op)](self._string(left), self._string(right))
+
+
+class Value(str):
+
+    """ Field value, compared as a number if it looks like one."""
+
+
+def _strnum(value):
+    """ Number of a field which looks numeric, None otherwise."""
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if "_" in value:
+        return None
+    if math.isfinite(number) or NUMBER.match(value) is not None:
+        return number
+    return None
+
+
+def _field_truth(value):
+    number = _strnum(value)
+    return value != "" if number is None else number != 0
+
+
+class _Compiler:
+
+    """ Python source of filter expressions.
+
+    Values of expressions have kinds: field (string which could look
+    numeric), number or string. Kinds are known from the expression, so
+    comparison rules are resolved once, helpers and constants are passed
+    in the namespace.
+
+    """
+
+    NUMBERS = {
+        "field": _strnum,
+        "number": lambda value: value,
+        "string": lambda value: None,
+    }
+    STRINGS = {
+        "field": str,
+        "number": Predicate._string,
+        "string": str,
+    }
+
+    def __init__(self, titles):
+        self.indexes = {title: index for index, title in enumerate(titles)}
+        self.namespace = {
+            "_truth": _field_truth,
+            "_number": awk_number,
+            "_divide": _divide,
+        }
+
+    def add(self, value):
+        """ Name of the value in namespace."""
+        name = "_v{}".format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def truth(self, node):
+        """ Source of boolean value of the node."""
+        if isinstance(node, ast.BoolOp):
+            op = " and " if isinstance(node.op, ast.And) else " or "
+            return "(" + op.join(self.truth(v) for v in node.values) + ")"
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return "(not {})".format(self.truth(node.operand))
+
+        code, kind = self.compile(node)
+        if kind == "field":
+            return "_truth({})".format(code)
+        if kind == "number":
+            return "({} != 0)".format(code)
+        return "({} != '')".format(code)
+
+    def number(self, node):
+        code, kind = self.compile(node)
+        if kind == "number":
+            return code
+        return "_number({})".format(code)
+
+    def compile(self, node):
+        """ Source and kind of the node value."""
+        if isinstance(node, ast.Constant) and \
+                isinstance(node.value, (str, int, float)) and \
+                not isinstance(node.value, bool):
+            kind = "string" if isinstance(node.value, str) else "number"
+            return self.add(node.value), kind
+
+        if isinstance(node, ast.Name):
+            if node.id not in self.indexes:
+                raise ValueError("Variable {} not in context".format(node.id))
+            return "row[{}]".format(self.indexes[node.id]), "field"
+
+        if isinstance(node, ast.Compare):
+            return self.compare(node), "number"
+
+        if isinstance(node, (ast.BoolOp, ast.UnaryOp)) and \
+                isinstance(node.op, (ast.And, ast.Or, ast.Not)):
+            return self.truth(node), "number"
+
+        if isinstance(node, ast.UnaryOp) and \
+                isinstance(node.op, (ast.USub, ast.UAdd)):
+            sign = "-" if isinstance(node.op, ast.USub) else "+"
+            return "({}{})".format(sign, self.number(node.operand)), "number"
+
+        if isinstance(node, ast.BinOp) and \
+                isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div)):
+            left, right = self.number(node.left), self.number(node.right)
+            if isinstance(node.op, ast.Div):
+                return "_divide({}, {})".format(left, right), "number"
+            return "({} {} {})".format(
+                left, ARITHMETIC[type(node.op)], right), "number"
+
+        raise ValueError("Not supported expression {}".format(ast.dump(node)))
+
+    def compare(self, node):
+        """ Source of comparison chain, operands could be evaluated twice."""
+        left, left_kind = self.compile(node.left)
+        if any(isinstance(op, (ast.In, ast.NotIn)) for op in node.ops):
+            if len(node.ops) > 1 or not isinstance(
+                    node.comparators[0], (ast.List, ast.Tuple, ast.Set)):
+                raise ValueError("IN expects list of values")
+            tests = [
+                "{}({}, {})".format(
+                    self.comparison(ast.Eq(), left_kind, kind), "_left", code)
+                for code, kind in map(self.compile, node.comparators[0].elts)
+            ]
+            member = self.add(eval(
+                "lambda row, _left: " + (" or ".join(tests) or "False"),
+                self.namespace))
+            negate = "not " if isinstance(node.ops[0], ast.NotIn) else ""
+            return "({}{}(row, {}))".format(negate, member, left)
+
+        tests = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in COMPARISONS:
+                raise ValueError("Unknown comparator {}".format(op))
+            right, right_kind = self.compile(comparator)
+            tests.append("{}({}, {})".format(
+                self.comparison(op, left_kind, right_kind), left, right))
+            left, left_kind = right, right_kind
+        return "(" + " and ".join(tests) + ")"
+
+    def comparison(self, op, left_kind, right_kind):
+        """ Name of function which compares values of the kinds."""
+        op = COMPARISONS[type(op)]
+        left_number = self.NUMBERS[left_kind]
+        right_number = self.NUMBERS[right_kind]
+        left_string = self.STRINGS[left_kind]
+        right_string = self.STRINGS[right_kind]
+
+        def compare(a, b):
+            x = left_number(a)
+            if x is not None:
+                y = right_number(b)
+                if y is not None:
+                    return op(x, y)
+            return op(left_string(a), right_string(b))
+        return self.add(compare)
+
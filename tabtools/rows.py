@@ -0,0 +1,91 @@
+""" Iteration over rows of delimited files in python.
+
+iter_rows reads file bodies by large blocks, every line becomes a record: a
+tuple of field strings with field titles as attributes. Records have no
+per row dict, num fields are converted to float only when the attribute is
+read. Filter expressions (ttmap -w) are compiled into a python function of
+a record once.
+
+"""
+import math
+from operator import itemgetter
+
+from .base import Field
+from .files import FileList
+from .predicate import Predicate
+from .vectorized import read_text
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def record_class(fields, typed=True, name="Record"):
+    """ Tuple subclass with field strings and field titles as attributes.
+
+    Params
+    ------
+    fields: tabtools.base.DataDescription.fields
+    typed: bool, attributes of num fields are float, NaN if the string is
+        empty or not a number. Items are strings anyway.
+
+    """
+    attributes = {
+        "__slots__": (),
+        "titles": tuple(field.title for field in fields),
+    }
+    for index, field in enumerate(fields):
+        getter = itemgetter(index)
+        if typed and field.type == Field.TYPES.NUMBER:
+            attributes[field.title] = property(
+                lambda record, getter=getter: _float(getter(record)))
+        else:
+            attributes[field.title] = property(getter)
+
+    def __repr__(self):
+        return "{}({})".format(name, ", ".join(
+            "{}={!r}".format(title, value)
+            for title, value in zip(self.titles, self)))
+
+    attributes["__repr__"] = __repr__
+    return type(name, (tuple,), attributes)
+
+
+def iter_rows(paths=None, where=None, typed=True, header_line=''):
+    """ Iterate over rows of delimited files.
+
+    Params
+    ------
+    paths: list of paths or file objects, standard input by default.
+    where: list of filter expressions, optional, as ttmap --where.
+    typed: bool, see record_class.
+    header_line: str, optional, see FileList.
+
+    Header is resolved by FileList once, all records are instances of the
+    same record_class. Missing fields are empty strings and extra fields are
+    dropped, as awk reads them.
+
+    """
+    files = FileList(paths, header_line=header_line)
+    header = files.header
+    record = record_class(header.fields, typed)
+    delimiter, width = header.delimiter, len(header.fields)
+    padding = [""] * width
+    test = Predicate(where).compile(record.titles) if where else None
+
+    def make(line):
+        fields = line.split(delimiter)
+        if len(fields) != width:
+            fields = (fields + padding)[:width]
+        return tuple.__new__(record, fields)
+
+    with files.bodies() as source:
+        for text in read_text(source, encoding='utf8'):
+            records = map(make, text[:-1].split("\n"))
+            if test is None:
+                yield from records
+            else:
+                yield from filter(test, records)
@@ -1,32 +1,42 @@
 #!/usr/bin/env python3
-""" Scripts of tool."""
+""" Scripts of tool.
+
+Modules which are needed by some of the tools only (awk compiler, numpy
+engine, columnar cache, ...) are imported by these tools, startup time of
+the other ones does not depend on them.
+
+"""
 import argparse
 import os
-from pipes import quote
-import re
-import subprocess
 import sys
-import tempfile
-from distutils.spawn import find_executable
-from itertools import zip_longest
+from shlex import quote
 
 from tabtools import __version__
-from .base import Header, Field
+from .base import Header, Field, SubheaderOrder, sort_key_options
 from .files import FileList
-from .awk import AWKStreamProgram, AWKGroupProgram
-
-AWK_INTERPRETER = find_executable(os.environ.get('AWKPATH', 'awk'))
+from .arrow import OUTPUT_FORMATS
+from .compressed import COMPRESSION_NAMES
 
 # see https://stackoverflow.com/questions/14207708/ioerror-errno-32-broken-pipe-python#answer-30091579
 from signal import signal, SIGPIPE, SIG_DFL
 signal(SIGPIPE, SIG_DFL)
 
+def file_or_dataset(path):
+    """ Argument type: open file, partitioned dataset for directories."""
+    from .dataset import Dataset
+    if os.path.isdir(path):
+        return Dataset(path)
+    return argparse.FileType('r')(path)
+
+
 def add_common_arguments(parser):
     parser.add_argument(
         '--version', action='version',
         version='%(prog)s {version}'.format(version=__version__))
     parser.add_argument(
-        'files', metavar='FILE', type=argparse.FileType('r'), nargs="*")
+        'files', metavar='FILE', type=file_or_dataset, nargs="*",
+        help="Input file or partitioned dataset directory "
+        "(root/key=value/.../file)")
     # If args.header is '' (default), get it from input files.
     # If header is None: deduce it from the input
     # If header is set, user whatever is set.
@@ -35,13 +45,51 @@ def add_common_arguments(parser):
         help="Header of the output data")
     parser.add_argument(
         '-N', '--no-header', action='store_true', help="Do not output header")
+    add_compress_argument(parser)
     return parser
 
 
+def add_compress_argument(parser):
+    parser.add_argument(
+        '--compress', choices=COMPRESSION_NAMES,
+        help="Compress the output, compressed input files are detected "
+        "automatically")
+
+
+def add_output_format_argument(parser):
+    parser.add_argument(
+        '--output-format', choices=OUTPUT_FORMATS, default='tsv',
+        help="Output format: tsv, Arrow IPC stream (arrow) or file "
+        "(feather), Arrow formats require pyarrow. Arrow input files are "
+        "detected automatically")
+
+
+def parse_args(parser):
+    """ Parse arguments, compress or convert standard output if it is
+    requested."""
+    args = parser.parse_args()
+    if args.compress is not None:
+        from .compressed import compress_output
+        compress_output(args.compress)
+    if getattr(args, 'output_format', 'tsv') != 'tsv':
+        from .arrow import arrow_output
+        if args.no_header:
+            parser.error("--output-format {} requires header".format(
+                args.output_format))
+        try:
+            arrow_output(args.output_format)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
+
 def ttcat():
     """ cat function.
 
-    tact file1, file2
+    ttcat file1, file2
+
+    Bodies of regular files are copied to the output in kernel
+    (copy_file_range/sendfile) starting after their headers.
 
     """
     parser = argparse.ArgumentParser(
@@ -50,14 +98,14 @@ def ttcat():
     )
     add_common_arguments(parser)
 
-    args = parser.parse_args()
+    args = parse_args(parser)
     files = FileList(args.files, header_line=args.header)
 
     if not args.no_header:
         sys.stdout.write(str(files.header) + '\n')
-        sys.stdout.flush()
+    sys.stdout.flush()
 
-    files("cat")
+    files.copy_bodies(sys.stdout.fileno())
 
 
 def tttail():
@@ -70,7 +118,7 @@ def tttail():
     parser.add_argument('-n', '--lines', default=10)
     add_common_arguments(parser)
 
-    args = parser.parse_args()
+    args = parse_args(parser)
     files = FileList(args.files, header_line=args.header)
 
     if not args.no_header:
@@ -78,7 +126,7 @@ def tttail():
         sys.stdout.flush()
 
     command = "tail -q" + " -n{}".format(args.lines) if args.lines else ""
-    files(command)
+    files(command, separate=True)
 
 
 def ttsort():
@@ -91,124 +139,675 @@ def ttsort():
         add_help=True,
         description="Sort lines of text files"
     )
-    parser.add_argument(
-        'files', metavar='FILE', type=argparse.FileType('r'), nargs="*")
     parser.add_argument('-k', '--keys', action="append", default=[])
     add_common_arguments(parser)
+    add_output_format_argument(parser)
 
-    args = parser.parse_args()
+    args = parse_args(parser)
     files = FileList(args.files, header_line=args.header)
+    header = files.header
 
-
-    fields = [f.title for f in files.header.fields]
     options = [
-        '--field-separator=' + quote(files.header.delimiter),
-    ] + [
-        '-k{0},{0}'.format(fields.index(key) + 1) for key in args.keys
-    ]
+        '--field-separator=' + quote(header.delimiter),
+    ] + sort_key_options(header, args.keys)
+
+    if args.keys:
+        header = Header(
+            delimiter=header.delimiter,
+            fields=header.fields,
+            subheaders=[
+                s for s in header.subheaders if s.key != "order"
+            ] + [SubheaderOrder.from_titles(args.keys)]
+        )
 
     if not args.no_header:
-        sys.stdout.write(str(files.header) + '\n')
+        sys.stdout.write(str(header) + '\n')
         sys.stdout.flush()
 
     files("sort", *options)
 
 
+class QueryAction(argparse.Action):
+
+    """ Collect query blocks, -o PATH starts a new block.
+
+    Options before the first -o belong to the standard output block, e.g.
+    ttmap -s a -o a.tsv -s b -w 'c > 0' -o b.tsv -s c file.
+
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        queries = getattr(namespace, 'queries', None) or [
+            {"output": None, "select": [], "where": []}]
+        if self.dest == "output":
+            queries.append({"output": values, "select": [], "where": []})
+        else:
+            queries[-1][self.dest].append(values)
+        namespace.queries = queries
+
+
 def ttmap():
+    from .awk import AWKStreamProgram, AWKMultiStreamProgram, awk_interpreter
+
     parser = argparse.ArgumentParser(
         add_help=True,
         description="Perform a map operation on all FILE(s)"
         "and write result to standard output.\n"
         "Current awk interpreter: '{}'."
         "To use specific AWK interpreter set AWKPATH environment variable:"
-        "export AWKPATH=$(which mawk)".format(AWK_INTERPRETER)
+        "export AWKPATH=$(which mawk)".format(awk_interpreter())
     )
     parser.add_argument('-a', '--all-columns', action='store_true',
                         default=False,
                         help="Output all of the original columns first")
-    # FIXME: does MUTABLE default=[] value affect the execution?
-    parser.add_argument('-s', '--select', action="append",
-                        help="Output fields", default=[])
-    parser.add_argument('-w', '--where', action="append", default=[],
+    parser.add_argument('-s', '--select', action=QueryAction,
+                        help="Output fields")
+    parser.add_argument('-w', '--where', action=QueryAction,
                         help="Filter expression")
+    parser.add_argument('-o', '--output', action=QueryAction,
+                        help="Start a new query: following --select and "
+                        "--where options define rows appended to OUTPUT "
+                        "file. All of the queries are computed in one pass")
+    parser.set_defaults(queries=None)
     parser.add_argument('-v', '--variables', action="append", default=[],
                         help="Assigns value to program variable var")
     parser.add_argument('--debug', action='store_true', default=False,
                         help="Print result program")
+    parser.add_argument('--engine', choices=['awk', 'numpy'], default='awk',
+                        help="Evaluate expressions with awk row by row "
+                        "(default) or with numpy over column batches, numpy "
+                        "supports a single query without variables. "
+                        "Expressions without stateful functions (SUM, AVG, "
+                        "EMA, PREV, MIN, MAX) run in awk, it is faster for "
+                        "them")
     add_common_arguments(parser)
-
-    args = parser.parse_args()
-    files = FileList(args.files, header_line=args.header)
-
-    select = args.select or ['*']
-    if '*' in select:
-        i = select.index('*')
-        select = select[:i] + [f.title for f in files.header.fields] + select[i + 1:]
-
-    program = AWKStreamProgram(
-        files.header.fields,
-        filter_expressions=args.where,
-        output_expressions=select
+    add_output_format_argument(parser)
+
+    args = parse_args(parser)
+    queries = args.queries or [{"output": None, "select": [], "where": []}]
+    if len(queries) > 1 and not queries[0]["select"] + queries[0]["where"]:
+        queries = queries[1:]
+    if args.engine == 'numpy' and (
+            len(queries) > 1 or queries[0]["output"] is not None or
+            args.variables):
+        parser.error("--engine numpy supports a single query without "
+                     "variables")
+
+    # Dataset partitions could be skipped only if every query skips them.
+    files = FileList(
+        args.files, header_line=args.header,
+        filters=queries[0]["where"] if len(queries) == 1 else None
     )
 
+    for query in queries:
+        select = query["select"] or ['*']
+        if '*' in select:
+            i = select.index('*')
+            select = select[:i] + [f.title for f in files.header.fields] + select[i + 1:]
+        query["select"] = select
+
+    if len(queries) == 1 and queries[0]["output"] is None:
+        program = AWKStreamProgram(
+            files.header.fields,
+            filter_expressions=queries[0]["where"],
+            output_expressions=queries[0]["select"]
+        )
+        fields = program.output
+    else:
+        program = AWKMultiStreamProgram(files.header.fields, [
+            (query["where"], query["select"], query["output"])
+            for query in queries
+        ])
+        fields = program.queries[0]["fields"]
+
     if args.debug:
         sys.stdout.write("%s\n" % program)
 
+    if args.engine == 'numpy':
+        from .vectorized import NumpyStreamProgram
+        try:
+            numpy_program = NumpyStreamProgram(
+                files.header.fields,
+                filter_expressions=queries[0]["where"],
+                output_expressions=queries[0]["select"],
+                delimiter=files.header.delimiter
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        if numpy_program.stateful:
+            program = numpy_program
+        else:
+            args.engine = 'awk'
+
     header = Header(
         delimiter=files.header.delimiter,
         fields=[
-            Field(o.title, o._type) for o in program.output
+            Field(o.title, o._type) for o in fields
             if o.title and not o.title.startswith('_')
         ]
     )
 
-    if not args.no_header:
+    if isinstance(program, AWKMultiStreamProgram):
+        for query in program.queries:
+            if query["path"] is None:
+                continue
+            with open(query["path"], 'w') as f:
+                f.write(str(Header(
+                    delimiter=header.delimiter,
+                    fields=[Field(o.title, o._type) for o in query["fields"]]
+                )) + '\n')
+
+    if not args.no_header and queries[0]["output"] is None:
         sys.stdout.write(str(header) + '\n')
         sys.stdout.flush()
 
-    files(AWK_INTERPRETER, '-F', quote(header.delimiter), '-v', 'OFS=' + quote(header.delimiter), str(program))
+    if args.engine == 'numpy':
+        program.run(files, sys.stdout.buffer)
+        sys.stdout.flush()
+        return
+
+    transform = None
+    if program.semijoins:
+        from .bloom import semijoin
+        transform = semijoin(program.semijoins, files.header.delimiter)
+
+    files(awk_interpreter(), '-F', quote(header.delimiter), '-v', 'OFS=' + quote(header.delimiter), str(program), transform=transform)
 
 
 def ttreduce():
+    from .awk import AWKGroupProgram, awk_interpreter
+
     parser = argparse.ArgumentParser(
         add_help=True,
         description="Perform a group operation on all FILE(s)"
         "and write result to standard output.\n"
         "Current awk interpreter: '{}'."
         "To use specific AWK interpreter set AWKPATH environment variable:"
-        "export AWKPATH=$(which mawk).".format(AWK_INTERPRETER)
+        "export AWKPATH=$(which mawk).".format(awk_interpreter())
     )
     add_common_arguments(parser)
+    add_output_format_argument(parser)
     parser.add_argument('-g', '--groupby', help="Group expression")
     parser.add_argument('-s', '--select', action="append",
                         default=[], help="Group expression")
+    parser.add_argument('--hash', action='store_true', default=False,
+                        help="Keep state of all groups in memory, input does "
+                        "not need to be sorted by group key")
+    parser.add_argument('--explode', action='store_true', default=False,
+                        help="Output one row per element of TOPK/BOTTOMK "
+                        "lists")
+    parser.add_argument('--list-separator',
+                        help="Separator of TOPK/BOTTOMK list elements, "
+                        "default is ',' (';' for comma delimited files)")
+    parser.add_argument('--grouping-set', action='append',
+                        dest='grouping_sets', metavar='FIELDS',
+                        help="Comma separated group key fields to aggregate "
+                        "by in the same pass, empty for grand total. Option "
+                        "could be repeated, output has grouping_id column")
+    parser.add_argument('--rollup', action='store_true', default=False,
+                        help="Grouping sets of all group key prefixes, e.g. "
+                        "(a, b), (a) and ()")
+    parser.add_argument('--grouping-output', metavar='TEMPLATE',
+                        help="Write every grouping set to its own file, {} in "
+                        "TEMPLATE is replaced with set fields joined by '_' "
+                        "or 'total'")
     parser.add_argument('--debug', action='store_true', default=False,
                         help="Print result program")
-    args = parser.parse_args()
+    parser.add_argument('--engine', choices=['awk', 'numpy'], default='awk',
+                        help="Aggregate with awk row by row (default) or with "
+                        "numpy over column batches, numpy does not need "
+                        "sorted input and supports SUM, COUNT, MIN, MAX, "
+                        "FIRST and LAST")
+    args = parse_args(parser)
+    if args.engine == 'numpy' and (
+            args.rollup or args.grouping_sets is not None or
+            args.grouping_output):
+        parser.error("--engine numpy does not support grouping sets")
     files = FileList(args.files)
 
+    list_separator = args.list_separator or \
+        (";" if files.header.delimiter == "," else ",")
+    key_titles = AWKGroupProgram(
+        files.header.fields, args.groupby, []).key_titles
+
+    grouping_sets = None
+    if args.rollup:
+        grouping_sets = AWKGroupProgram.rollup(key_titles)
+    elif args.grouping_sets is not None:
+        grouping_sets = [
+            tuple(f for f in s.split(",") if f) for s in args.grouping_sets]
+
+    outputs = None
+    if args.grouping_output:
+        outputs = [
+            args.grouping_output.format("_".join(s) or "total")
+            for s in grouping_sets or [key_titles]
+        ]
+
     program = AWKGroupProgram(
         files.header.fields,
         group_key=args.groupby,
-        group_expressions=args.select
+        group_expressions=args.select,
+        mode="hash" if args.hash else "sorted",
+        explode=args.explode,
+        list_separator=list_separator,
+        grouping_sets=grouping_sets,
+        outputs=outputs
+    )
+
+    if args.debug:
+        sys.stdout.write("%s\n" % program)
+
+    fields = [Field(o.title, o._type) for o in program.key + program.output
+              if o.title and not o.title.startswith('_')]
+    key_fields = fields[:len(program.key_titles)]
+    output_fields = fields[len(program.key_titles):]
+    if program.has_grouping_id:
+        fields = [Field("grouping_id", "num")] + fields
+
+    if args.engine == 'numpy':
+        from .vectorized import NumpyGroupProgram
+        try:
+            program = NumpyGroupProgram(
+                files.header.fields,
+                group_key=args.groupby,
+                group_expressions=args.select,
+                delimiter=files.header.delimiter
+            )
+        except ValueError as e:
+            parser.error(str(e))
+
+    if outputs is not None:
+        for grouping_set, output in zip(program.grouping_sets, outputs):
+            header = Header(
+                delimiter=files.header.delimiter,
+                fields=[f for f in key_fields if f.title in grouping_set] +
+                output_fields
+            )
+            with open(output, 'w') as f:
+                f.write(str(header) + '\n')
+    elif not args.no_header:
+        header = Header(delimiter=files.header.delimiter, fields=fields)
+        sys.stdout.write(str(header) + '\n')
+        sys.stdout.flush()
+
+    if args.engine == 'numpy':
+        program.run(files, sys.stdout.buffer)
+        sys.stdout.flush()
+        return
+
+    delimiter = files.header.delimiter
+
+    files(awk_interpreter(), '-F', quote(delimiter), '-v', 'OFS=' + quote(delimiter), str(program))
+
+
+def ttjoin():
+    """ join function.
+
+    ttjoin -k field1 -k left_field2=right_field2 file1 file2
+
+    """
+    from .awk import AWKJoinProgram, AWKMergeJoinProgram, awk_interpreter
+
+    parser = argparse.ArgumentParser(
+        add_help=True,
+        description="Join lines of two files on common fields. "
+        "Hash strategy loads the smaller file into memory and streams the "
+        "other one through it, files do not need to be sorted. "
+        "Merge strategy streams both files, they should be sorted by join "
+        "fields (ttsort -k ...)."
+    )
+    parser.add_argument(
+        '--version', action='version',
+        version='%(prog)s {version}'.format(version=__version__))
+    parser.add_argument(
+        'files', metavar='FILE', type=argparse.FileType('r'), nargs=2)
+    parser.add_argument('-k', '--keys', action="append", default=[],
+                        help="Join field, use left=right if titles differ")
+    parser.add_argument('-l', '--left', action='store_true', default=False,
+                        help="Output unmatched lines of the first file")
+    parser.add_argument('--strategy', choices=['auto', 'hash', 'merge'],
+                        default='auto',
+                        help="Join strategy. Auto uses merge join if both "
+                        "files are sorted by join fields according to their "
+                        "ORDER subheaders, hash join otherwise")
+    parser.add_argument(
+        '-N', '--no-header', action='store_true', help="Do not output header")
+    parser.add_argument('--debug', action='store_true', default=False,
+                        help="Print result program")
+    add_compress_argument(parser)
+
+    args = parse_args(parser)
+    if not args.keys:
+        parser.error("at least one join field is required")
+
+    files = FileList(args.files)
+    left, right = files
+    if left.header.delimiter != right.header.delimiter:
+        parser.error("files have different delimiters")
+
+    # Left join streams the first file, inner join streams the larger one.
+    build = "right"
+    if not args.left and left.size is not None and \
+            (right.size is None or left.size < right.size):
+        build = "left"
+
+    program = AWKJoinProgram(
+        left.header.fields,
+        right.header.fields,
+        keys=args.keys,
+        how="left" if args.left else "inner",
+        build=build
+    )
+
+    strategy = args.strategy
+    if strategy == 'auto':
+        # Size alone does not choose merge join: unsorted input would fail
+        # after part of the output is written.
+        is_sorted = all(
+            any(
+                isinstance(s, SubheaderOrder) and s.is_sorted(titles)
+                for s in f.header.subheaders
+            )
+            for f, titles in zip(files, zip(*program.keys))
+        )
+        strategy = 'merge' if is_sorted else 'hash'
+
+    if strategy == 'merge':
+        program = AWKMergeJoinProgram(
+            left.header.fields,
+            right.header.fields,
+            keys=args.keys,
+            how="left" if args.left else "inner",
+        )
+
+    if args.debug:
+        sys.stdout.write("%s\n" % program)
+
+    header = Header(delimiter=left.header.delimiter, fields=program.fields)
+
+    if not args.no_header:
+        sys.stdout.write(str(header) + '\n')
+        sys.stdout.flush()
+
+    # Hash join build side goes first, awk distinguishes it by ARGV[1].
+    if strategy == 'hash' and build == "right":
+        files.reverse()
+
+    # Merge join exits with non-zero status if files are not sorted.
+    sys.exit(files(awk_interpreter(), '-F', quote(header.delimiter), '-v', 'OFS=' + quote(header.delimiter), str(program), separate=True))
+
+
+def ttuniq():
+    """ Distinct function.
+
+    ttuniq -k field1 -k field2 file1
+
+    """
+    import shutil
+    import tempfile
+    from .awk import AWKUniqProgram, awk_interpreter
+
+    parser = argparse.ArgumentParser(
+        add_help=True,
+        description="Output the first line of every distinct key in the "
+        "input order. Unlike sort -u does not sort the input."
+    )
+    parser.add_argument('-k', '--keys', action="append", default=[],
+                        help="Key field, all of the fields by default")
+    parser.add_argument('-c', '--count', action='store_true', default=False,
+                        help="Append number of lines with the same key")
+    parser.add_argument('--count-title', default='count',
+                        help="Title of the count field")
+    parser.add_argument('-m', '--max-keys', type=int,
+                        help="Maximum number of keys in memory, lines with "
+                        "other keys are spilled to temporary files")
+    parser.add_argument('--partitions', type=int, default=64,
+                        help="Number of spill files")
+    parser.add_argument('--debug', action='store_true', default=False,
+                        help="Print result program")
+    add_common_arguments(parser)
+
+    args = parse_args(parser)
+    files = FileList(args.files, header_line=args.header)
+
+    spill_directory = None
+    if args.max_keys is not None:
+        spill_directory = tempfile.mkdtemp(prefix='ttuniq')
+
+    program = AWKUniqProgram(
+        files.header.fields,
+        keys=args.keys,
+        count=args.count,
+        max_keys=args.max_keys,
+        spill_directory=spill_directory,
+        partitions=args.partitions
     )
 
     if args.debug:
         sys.stdout.write("%s\n" % program)
 
+    fields = list(files.header.fields)
+    if args.count:
+        fields.append(Field(args.count_title, Field.TYPES.NUMBER))
+
     header = Header(
         delimiter=files.header.delimiter,
-        fields=[
-            Field(o.title, o._type) for o in program.key + program.output
-            if o.title and not o.title.startswith('_')
-        ]
+        fields=fields,
+        subheaders=[s for s in files.header.subheaders if s.key != "count"]
     )
 
     if not args.no_header:
         sys.stdout.write(str(header) + '\n')
         sys.stdout.flush()
 
-    files(AWK_INTERPRETER, '-F', quote(header.delimiter), '-v', 'OFS=' + quote(header.delimiter), str(program))
+    try:
+        files(awk_interpreter(), '-F', quote(header.delimiter), '-v', 'OFS=' + quote(header.delimiter), str(program))
+    finally:
+        if spill_directory is not None:
+            shutil.rmtree(spill_directory)
+
+
+def ttcache():
+    """ Columnar cache function.
+
+    ttcache file1 file2
+
+    """
+    from .columnar import ColumnarCache
+    from .compressed import detect
+
+    parser = argparse.ArgumentParser(
+        add_help=True,
+        description="Build columnar cache of the files (<FILE>.ttcache "
+        "directory). ttmap and ttreduce --engine numpy and read_batches "
+        "read columns from the cache while the file does not change, awk "
+        "reads the file itself"
+    )
+    parser.add_argument(
+        '--version', action='version',
+        version='%(prog)s {version}'.format(version=__version__))
+    parser.add_argument('files', metavar='FILE', nargs='+')
+    parser.add_argument('-d', '--delete', action='store_true', default=False,
+                        help="Delete cache of the files")
+
+    args = parser.parse_args()
+    for path in args.files:
+        if args.delete:
+            ColumnarCache.remove(path)
+            continue
+
+        with open(path) as f:
+            if detect(f) is not None:
+                parser.error("compressed file {} could not be cached".format(
+                    path))
+        ColumnarCache.build(path)
+
+
+def ttsplit():
+    """ Split function.
+
+    ttsplit -p 'data/{symbol}/{date}.tsv' file1
+
+    """
+    from .awk import AWKSplitProgram, awk_interpreter
+    from .compressed import get_compression
+
+    parser = argparse.ArgumentParser(
+        add_help=True,
+        description="Write every line into the file chosen by its values. "
+        "Every created file gets the header, files are kept open in the "
+        "least recently used order."
+    )
+    parser.add_argument('-p', '--path', required=True,
+                        help="Output file template, {expression} is replaced "
+                        "with the expression value, e.g. 'data/{symbol}.tsv'")
+    parser.add_argument('--max-open-files', type=int, default=256,
+                        help="Number of simultaneously open files")
+    parser.add_argument('--debug', action='store_true', default=False,
+                        help="Print result program")
+    add_common_arguments(parser)
+
+    args = parser.parse_args()
+    files = FileList(args.files, header_line=args.header)
+
+    header = Header(
+        delimiter=files.header.delimiter,
+        fields=files.header.fields,
+        subheaders=[s for s in files.header.subheaders if s.key != "count"]
+    )
+    program = AWKSplitProgram(
+        files.header.fields,
+        template=args.path,
+        header=None if args.no_header else str(header),
+        max_open_files=args.max_open_files,
+        compress=None if args.compress is None else
+        get_compression(args.compress).compress_command
+    )
+
+    if args.debug:
+        sys.stdout.write("%s\n" % program)
+
+    sys.exit(files(awk_interpreter(), '-F', quote(header.delimiter), '-v', 'OFS=' + quote(header.delimiter), str(program)))
+
+
+def ttcompile():
+    """ Compile ttmap or ttreduce into a shell script.
+
+    ttcompile map -s 'Date; spread = High - Low' prices.tsv -o spread.sh
+    ./spread.sh prices.tsv
+
+    ttmap and ttreduce do not cache compiled programs on disk: compilation
+    of typical expressions takes 0.2-0.3ms and a cache would save only that,
+    interpreter startup and import of the compiler (about 17ms) would
+    remain. The compiled script skips both, so does the daemon.
+
+    """
+    from .awk import AWKStreamProgram, AWKGroupProgram, shell_script
+
+    parser = argparse.ArgumentParser(
+        add_help=True,
+        description="Write a POSIX shell script which runs ttmap or ttreduce "
+        "with awk only, without Python. The program is compiled for the "
+        "header of FILE or --header, inputs of the script should have the "
+        "same header fields",
+        epilog="ttmap and ttreduce do not cache compiled programs on disk, "
+        "compilation takes less than a millisecond while Python startup "
+        "and imports take tens of milliseconds: use the script of ttcompile "
+        "or the daemon (TABTOOLS_SOCKET) to skip them"
+    )
+    parser.add_argument(
+        '--version', action='version',
+        version='%(prog)s {version}'.format(version=__version__))
+    commands = parser.add_subparsers(dest='command')
+
+    map_parser = commands.add_parser('map', help="Compile ttmap")
+    map_parser.add_argument('-s', '--select', action="append", default=[],
+                            help="Output fields")
+    map_parser.add_argument('-w', '--where', action="append", default=[],
+                            help="Filter expression")
+
+    reduce_parser = commands.add_parser('reduce', help="Compile ttreduce")
+    reduce_parser.add_argument('-g', '--groupby', help="Group expression")
+    reduce_parser.add_argument('-s', '--select', action="append",
+                               default=[], help="Group expression")
+    reduce_parser.add_argument('--hash', action='store_true', default=False,
+                               help="Keep state of all groups in memory")
+    reduce_parser.add_argument('--explode', action='store_true',
+                               default=False,
+                               help="Output one row per element of "
+                               "TOPK/BOTTOMK lists")
+    reduce_parser.add_argument('--list-separator',
+                               help="Separator of TOPK/BOTTOMK list elements")
+
+    for command_parser in (map_parser, reduce_parser):
+        command_parser.add_argument(
+            'file', metavar='FILE', nargs='?',
+            help="File with the input header")
+        command_parser.add_argument(
+            '-H', '--header', help="Input header instead of FILE")
+        command_parser.add_argument(
+            '-N', '--no-header', action='store_true',
+            help="Script does not output header")
+        command_parser.add_argument(
+            '-o', '--output', help="Script path, standard output by default")
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("map or reduce command is required")
+    if (args.file is None) == (args.header is None):
+        parser.error("either FILE or --header is required")
+
+    if args.header is not None:
+        input_header = Header.parse(args.header)
+    else:
+        with open(args.file) as f:
+            input_header = FileList([f]).header
+
+    if args.command == 'map':
+        select = args.select or ['*']
+        if '*' in select:
+            i = select.index('*')
+            select = select[:i] + [f.title for f in input_header.fields] + select[i + 1:]
+        program = AWKStreamProgram(
+            input_header.fields,
+            filter_expressions=args.where,
+            output_expressions=select
+        )
+        if program.semijoins:
+            parser.error("FILE membership of large files is not supported")
+        fields = program.output
+    else:
+        program = AWKGroupProgram(
+            input_header.fields,
+            group_key=args.groupby,
+            group_expressions=args.select,
+            mode="hash" if args.hash else "sorted",
+            explode=args.explode,
+            list_separator=args.list_separator or
+            (";" if input_header.delimiter == "," else ",")
+        )
+        fields = program.key + program.output
+
+    header = Header(
+        delimiter=input_header.delimiter,
+        fields=[
+            Field(o.title, o._type) for o in fields
+            if o.title and not o.title.startswith('_')
+        ]
+    )
+    script = shell_script(
+        program, input_header, None if args.no_header else header,
+        comment="Generated by ttcompile {}: ttcompile {}".format(
+            __version__, " ".join(map(quote, sys.argv[1:]))))
+
+    if args.output is None:
+        sys.stdout.write(script)
+        return
+
+    with open(args.output, 'w') as f:
+        f.write(script)
+    os.chmod(args.output, 0o755)
 
 
 def ttpretty():
@@ -218,6 +817,9 @@ def ttpretty():
     tcat file | tpretty
 
     """
+    import tempfile
+    from itertools import zip_longest
+
     DELIMITER = '\t'
     header = sys.stdin.readline()
     fields = Header.parse(header).fields
@@ -265,6 +867,10 @@ def ttplot():
     cat data.tsv | tplot -c script.gnu > ouput3.png
 
     """
+    import re
+    import subprocess
+    import tempfile
+
     parser = argparse.ArgumentParser(
         add_help=True,
         description="Plot file from stdin with gnuplot"
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from ..aio import Pipeline, Runner
+from ..files import FileList
+
+
+class TestRunner(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, "data.tsv")
+        with open(self.path, "w") as f:
+            f.write("a:num\tb\n")
+            f.writelines("{}\t{}\n".format(i, "xy"[i % 2]) for i in range(1000))
+
+    @staticmethod
+    async def collect(pipeline):
+        return [line async for line in pipeline]
+
+    def test_map(self):
+        async def main():
+            pipeline = await Runner().map(
+                [self.path], ["a", "c = a * 2"], ["a < 3"])
+            return str(pipeline.header), await self.collect(pipeline)
+
+        header, lines = asyncio.run(main())
+        self.assertEqual(header, "a\tc")
+        self.assertEqual(lines, ["0\t0", "1\t2", "2\t4"])
+
+    def test_reduce_and_sort(self):
+        async def main():
+            runner = Runner(max_workers=1)
+            reduce = await runner.reduce(
+                [self.path], "b", ["n = COUNT()", "s = SUM(a)"])
+            sort = await runner.sort([self.path], ["b", "a"])
+            # Both pipelines are consumed at once, the second one waits for
+            # the semaphore.
+            return await asyncio.gather(
+                self.collect(reduce), self.collect(sort))
+
+        grouped, ordered = asyncio.run(main())
+        self.assertEqual(grouped, ["x\t500\t249500", "y\t500\t250000"])
+        self.assertEqual(len(ordered), 1000)
+        self.assertEqual(ordered[:2], ["0\tx", "10\tx"])
+
+    def test_batches(self):
+        async def main():
+            pipeline = Pipeline(FileList([self.path]), "cat")
+            return [batch async for batch in pipeline.batches()]
+
+        batches = asyncio.run(main())
+        self.assertEqual(sum(batches, [])[-1], "999\ty")
+        self.assertEqual(len(sum(batches, [])), 1000)
+
+    def test_early_exit(self):
+        async def main():
+            # yes never stops, bounded queue keeps it blocked on write.
+            pipeline = Pipeline(FileList([self.path]), "yes", queue_size=1)
+            async for line in pipeline:
+                return line
+
+        self.assertEqual(asyncio.run(asyncio.wait_for(main(), 10)), "y")
+
+    def test_error(self):
+        async def main():
+            return await self.collect(Pipeline(FileList([self.path]), "false"))
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            asyncio.run(main())
@@ -0,0 +1,64 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..arrow import arrow_output, is_arrow, write_arrow
+from ..files import FileList
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+
+class TestArrow(unittest.TestCase):
+    TSV = b"a:num\tb\n1\tx\n\ty z\n2.5\t\n"
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, output_format):
+        path = os.path.join(self.root, output_format)
+        with open(path, "wb") as target:
+            write_arrow(io.BufferedReader(io.BytesIO(self.TSV)), target,
+                        output_format)
+        return path
+
+    def test_is_arrow(self):
+        path = os.path.join(self.root, "data.tsv")
+        with open(path, "wb") as f:
+            f.write(self.TSV)
+        with open(path) as fd:
+            self.assertFalse(is_arrow(fd))
+
+    @unittest.skipIf(pyarrow is not None, "pyarrow is installed")
+    def test_no_pyarrow(self):
+        with self.assertRaises(ValueError):
+            arrow_output("arrow")
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_write(self):
+        with pyarrow.ipc.open_stream(self.write("arrow")) as reader:
+            table = reader.read_all()
+        self.assertEqual(table.schema.names, ["a", "b"])
+        self.assertEqual(table.column("a").to_pylist(), [1.0, None, 2.5])
+        self.assertEqual(table.column("b").to_pylist(), ["x", "y z", ""])
+
+        with pyarrow.ipc.open_file(self.write("feather")) as reader:
+            self.assertEqual(reader.read_all(), table)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_read(self):
+        for output_format in ("arrow", "feather"):
+            with open(self.write(output_format)) as fd:
+                self.assertTrue(is_arrow(fd))
+                files = FileList([fd])
+                self.assertEqual(str(files.header), "a:num\tb")
+                with tempfile.TemporaryFile() as target:
+                    files.copy_bodies(target.fileno())
+                    target.seek(0)
+                    self.assertEqual(target.read(), b"1\tx\n\ty z\n2.5\t\n")
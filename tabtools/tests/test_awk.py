@@ -1,6 +1,39 @@
+import gzip
+import os
+import random
+import shutil
+import subprocess
+import tempfile
 import unittest
+from unittest import mock
 
-from ..awk import Expression, StreamExpression, AWKBaseProgram
+from ..awk import (
+    Expression, StreamExpression, AWKBaseProgram, AWKStreamProgram,
+    AWKMultiStreamProgram, AWKGroupProgram, AWKJoinProgram,
+    AWKMergeJoinProgram, AWKUniqProgram, AWKSplitProgram, awk_interpreter,
+    shell_script
+)
+from ..base import Field, Header
+
+
+def run_awk(program, *inputs):
+    """ Run program over given bodies (list of rows), return output rows."""
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for index, rows in enumerate(inputs):
+            path = os.path.join(directory, str(index))
+            with open(path, 'w') as f:
+                f.write("".join("\t".join(row) + "\n" for row in rows))
+            paths.append(path)
+
+        output = subprocess.check_output(
+            ['awk', '-F', '\t', '-v', 'OFS=\t', str(program)[1:-1]] + paths,
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        )
+    finally:
+        shutil.rmtree(directory)
+    return [line.split('\t') for line in output.splitlines()]
 
 
 class TestAWKNodeTransformer(unittest.TestCase):
@@ -59,6 +92,46 @@ class TestAWKNodeTransformer(unittest.TestCase):
         )
 
 
+    def test_in_list(self):
+        expression = 'a = x in (1, "b")'
+        context = dict(x=Expression('$1', 'x'))
+        output = Expression.from_str(expression, context)
+        self.assertEqual(str(output[-1]), "a = (($1) in __in_1)")
+        self.assertEqual(output[-1].begin, '__in_1["1"] = 1; __in_1["b"] = 1')
+
+    def test_not_in_list(self):
+        expression = 'x not in [1] and x > 0'
+        context = dict(x=Expression('$1', 'x'))
+        output = Expression.from_str(expression, context)
+        self.assertEqual(len(output), 1)
+        self.assertEqual(
+            str(output[0]), "(!(($1) in __in_1)) && (($1) > (0))")
+        self.assertEqual(output[0].begin, '__in_1["1"] = 1')
+
+    def test_in_file(self):
+        expression = 'x in FILE("tabtools/tests/files/sample3.tsv")'
+        context = dict(x=Expression('$1', 'x'))
+        output = Expression.from_str(expression, context)
+        self.assertIn(
+            'getline __line < "tabtools/tests/files/sample3.tsv"',
+            output[0].begin)
+        self.assertEqual(output[0].semijoins, set())
+
+    def test_in_file_semijoin(self):
+        path = "tabtools/tests/files/sample3.tsv"
+        context = dict(x=Expression('$1', 'x'), y=Expression('$2', 'y'))
+        self.addCleanup(setattr, Expression, "SEMIJOIN_MIN_SIZE",
+                        Expression.SEMIJOIN_MIN_SIZE)
+        Expression.SEMIJOIN_MIN_SIZE = 0
+
+        output = Expression.from_str('not x in FILE("{}")'.format(path), context)
+        semijoin = (os.path.abspath(path), 1)
+        self.assertEqual(output[0].semijoins, {semijoin})
+        self.assertEqual(output[0].begin, None)
+
+        with self.assertRaises(ValueError):
+            Expression.from_str('x + 1 in FILE("{}")'.format(path), context)
+
     def test_transform_function(self):
         expression = "a = exp(x + 1) + rand()"
         context = dict(x=Expression('$1', 'x'))
@@ -165,3 +238,422 @@ class TestAWKNodeTransformer(unittest.TestCase):
             self.files.description.fields, output_expressions=expressions)
         self.files('awk', '-F', '"\t"', '-v', 'OFS="\t"', str(program))
         self.stdout.getvalue()
+
+
+class TestAWKJoinProgram(unittest.TestCase):
+    def setUp(self):
+        self.left_fields = (Field("id"), Field("name"))
+        self.right_fields = (Field("key"), Field("value"), Field("id"))
+        self.left = [["1", "a"], ["2", "b"], ["3", "c"]]
+        self.right = [["2", "x", "20"], ["1", "y", "10"], ["2", "z", "21"]]
+
+    def test_fields(self):
+        program = AWKJoinProgram(
+            self.left_fields, self.right_fields[:2], keys=["id=key"])
+        self.assertEqual(
+            program.fields, (Field("id"), Field("name"), Field("value")))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            AWKJoinProgram(self.left_fields, self.right_fields, keys=[])
+
+        with self.assertRaises(ValueError):
+            AWKJoinProgram(self.left_fields, self.right_fields, keys=["name"])
+
+        with self.assertRaises(ValueError):
+            AWKJoinProgram(
+                self.left_fields, self.right_fields, keys=["id"], how="left",
+                build="left")
+
+        # Both files have non-key "id" field.
+        with self.assertRaises(ValueError):
+            AWKJoinProgram(
+                self.left_fields, self.right_fields, keys=["id=key"])
+
+    def test_inner_build_right(self):
+        program = AWKJoinProgram(
+            self.left_fields, self.right_fields[:2], keys=["id=key"])
+        self.assertEqual(run_awk(program, self.right, self.left), [
+            ["1", "a", "y"], ["2", "b", "x"], ["2", "b", "z"]])
+
+    def test_inner_build_left(self):
+        program = AWKJoinProgram(
+            self.left_fields, self.right_fields[:2], keys=["id=key"],
+            build="left")
+        self.assertEqual(run_awk(program, self.left, self.right), [
+            ["2", "b", "x"], ["1", "a", "y"], ["2", "b", "z"]])
+
+    def test_left(self):
+        program = AWKJoinProgram(
+            self.left_fields, (Field("id"), Field("name"), Field("weight")),
+            keys=["id", "name"], how="left")
+        self.assertEqual(
+            run_awk(program, [["1", "a", "10"]], self.left),
+            [["1", "a", "10"], ["2", "b", ""], ["3", "c", ""]]
+        )
+
+
+class TestAWKMergeJoinProgram(unittest.TestCase):
+    def setUp(self):
+        self.left_fields = (Field("id"), Field("name"))
+        self.right_fields = (Field("id"), Field("value"))
+        self.left = [["1", "a"], ["10", "b"], ["2", "c"], ["2", "d"], ["3", "e"]]
+        self.right = [["10", "x"], ["2", "y"], ["2", "z"], ["4", "w"]]
+
+    def test_inner(self):
+        program = AWKMergeJoinProgram(
+            self.left_fields, self.right_fields, keys=["id"])
+        self.assertEqual(run_awk(program, self.left, self.right), [
+            ["10", "b", "x"],
+            ["2", "c", "y"], ["2", "c", "z"],
+            ["2", "d", "y"], ["2", "d", "z"],
+        ])
+
+    def test_left(self):
+        program = AWKMergeJoinProgram(
+            self.left_fields, self.right_fields, keys=["id"], how="left")
+        self.assertEqual(run_awk(program, self.left, self.right[:1]), [
+            ["1", "a", ""], ["10", "b", "x"], ["2", "c", ""], ["2", "d", ""],
+            ["3", "e", ""],
+        ])
+
+    def test_unsorted(self):
+        program = AWKMergeJoinProgram(
+            self.left_fields, self.right_fields, keys=["id"])
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_awk(program, self.left, [["2", "y"], ["10", "x"]])
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_awk(program, self.left[::-1], self.right)
+
+
+class TestAWKStreamProgram(unittest.TestCase):
+    def test_semijoins_code(self):
+        path = os.path.abspath("tabtools/tests/files/sample3.tsv")
+        self.addCleanup(setattr, Expression, "SEMIJOIN_MIN_SIZE",
+                        Expression.SEMIJOIN_MIN_SIZE)
+        Expression.SEMIJOIN_MIN_SIZE = 0
+
+        program = AWKStreamProgram(
+            (Field("a"), Field("b")),
+            filter_expressions=['a in FILE("{}")'.format(path)],
+            output_expressions=['a', 'c = b not in FILE("{}")'.format(path)],
+        )
+        self.assertEqual(program.semijoins, [(path, 1), (path, 2)])
+        self.assertEqual(
+            run_awk(program, [["1", "0", "1", "0"], ["2", "1", "0", "1"]]),
+            [["1", "1"]]
+        )
+
+
+class TestAWKMultiStreamProgram(unittest.TestCase):
+    def test_queries(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "output")
+
+        program = AWKMultiStreamProgram((Field("a"), Field("b")), [
+            ([], ["a", "s = SUM(b)"], None),
+            (["b > 2"], ["s = SUM(b)", "a = b * 2"], path),
+        ])
+        self.assertEqual([f.title for f in program.queries[1]["fields"]],
+                         ["s", "a"])
+        self.assertEqual(str(program).count("+="), 1)
+        self.assertEqual(
+            run_awk(program, [["x", "1"], ["y", "3"], ["z", "5"]]),
+            [["x", "1"], ["y", "4"], ["z", "9"]]
+        )
+        with open(path) as f:
+            self.assertEqual(f.read(), "4\t6\n9\t10\n")
+
+
+class TestAWKUniqProgram(unittest.TestCase):
+    def setUp(self):
+        self.fields = (Field("k"), Field("v"))
+        self.rows = [[str(i * 7 % 5), str(i)] for i in range(20)]
+        self.expected = [["0", "0"], ["2", "1"], ["4", "2"], ["1", "3"], ["3", "4"]]
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            AWKUniqProgram(self.fields, keys=["x"])
+
+        with self.assertRaises(ValueError):
+            AWKUniqProgram(self.fields, max_keys=1)
+
+    def test_rows(self):
+        program = AWKUniqProgram(self.fields)
+        self.assertEqual(run_awk(program, self.rows + self.rows), self.rows)
+
+    def test_keys(self):
+        program = AWKUniqProgram(self.fields, keys=["k"])
+        self.assertEqual(run_awk(program, self.rows), self.expected)
+
+    def test_count(self):
+        program = AWKUniqProgram(self.fields, keys=["k"], count=True)
+        self.assertEqual(
+            run_awk(program, self.rows),
+            [row + ["4"] for row in self.expected]
+        )
+
+    def test_spill(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        for count in (False, True):
+            program = AWKUniqProgram(
+                self.fields, keys=["k"], count=count, max_keys=2,
+                spill_directory=directory, partitions=2)
+            self.assertEqual(
+                run_awk(program, self.rows),
+                [row + (["4"] if count else []) for row in self.expected]
+            )
+
+
+class TestAWKGroupProgram(unittest.TestCase):
+    def setUp(self):
+        self.fields = (Field("s"), Field("v"))
+        self.rows = [
+            ["a", "5"], ["a", "1"], ["a", "7"], ["a", "3"], ["b", "2"],
+            ["c", "9"], ["c", "10"], ["c", "4"],
+        ]
+        self.select = ["top = TOPK(v, 2)", "bottom = BOTTOMK(v, 2)",
+                       "n = COUNT(v)"]
+        self.expected = [
+            ["a", "7,5", "1,3", "4"],
+            ["b", "2", "2", "1"],
+            ["c", "10,9", "4,9", "3"],
+        ]
+
+    def test_mode(self):
+        with self.assertRaises(ValueError):
+            AWKGroupProgram(self.fields, "s", self.select, mode="tree")
+
+    def test_sorted(self):
+        program = AWKGroupProgram(self.fields, "s", self.select)
+        self.assertEqual(run_awk(program, self.rows), self.expected)
+        self.assertEqual(run_awk(program, []), [])
+
+    def test_hash(self):
+        program = AWKGroupProgram(self.fields, "s", self.select, mode="hash")
+        rows = self.rows[5:] + self.rows[:5]
+        rows = rows[::2] + rows[1::2]
+        self.assertEqual(
+            run_awk(program, rows),
+            [self.expected[2], self.expected[0], self.expected[1]]
+        )
+
+    def test_explode(self):
+        program = AWKGroupProgram(
+            self.fields, "s", self.select, explode=True, list_separator=";")
+        self.assertEqual(run_awk(program, self.rows), [
+            ["a", "7", "1", "4"], ["a", "5", "3", "4"],
+            ["b", "2", "2", "1"],
+            ["c", "10", "4", "3"], ["c", "9", "9", "3"],
+        ])
+
+    def test_sketches(self):
+        rows = [["a", str(i * 7919 % 1000)] for i in range(3000)] + \
+            [["b", "xxxxxxyyyz"[i % 10]] for i in range(100)]
+        program = AWKGroupProgram(self.fields, "s", [
+            "d = COUNT_DISTINCT(v)", "m = QUANTILE(v, 0.5)",
+            "t = TOP_VALUES(v, 3)",
+        ])
+        (a, distinct, median, top), b = run_awk(program, rows)
+        self.assertLess(abs(int(distinct) - 1000), 50)
+        self.assertLess(abs(float(median) - 500), 20)
+        self.assertEqual(b, ["b", "3", "x", "x:60,y:30,z:10"])
+
+    def test_top_values(self):
+        # Zipf distributed values among uniform noise, counts are exact.
+        counts = {str(i): 3000 // i for i in range(1, 11)}
+        counts.update({str(i): 20 for i in range(100, 600)})
+        values = [v for v, c in counts.items() for _ in range(c)]
+        random.Random(1).shuffle(values)
+        top = sorted(counts, key=lambda v: -counts[v])[:3]
+        error = len(values) / 60.0
+
+        program = AWKGroupProgram(self.fields, "s", ["t = TOP_VALUES(v, 3)"])
+        (_, result), = run_awk(program, [["a", v] for v in values])
+        result = [item.split(":") for item in result.split(",")]
+        self.assertEqual([value for value, _ in result], top)
+        for value, count in result:
+            self.assertLessEqual(int(count), counts[value])
+            self.assertGreaterEqual(int(count), counts[value] - error)
+
+        program = AWKGroupProgram(
+            self.fields, "s", ["t = TOP_VALUES(v, 3, 300)"])
+        (_, result), = run_awk(program, [["a", v] for v in values])
+        self.assertEqual(result, "1:3000,2:1500,3:1000")
+
+    def test_sketches_merge(self):
+        rows = [["a", str(i)] for i in range(1000)] + \
+            [["b", str(i)] for i in range(500, 2000)]
+        program = AWKGroupProgram(self.fields, "s", [
+            "h = HLL(v)", "k = KLL(v)", "s = SPACE_SAVING(v, 3)"], mode="hash")
+        states = run_awk(program, rows)
+
+        def merge(select, column):
+            program = AWKGroupProgram(self.fields, "s", [select])
+            return run_awk(program, [
+                ["x", state[column]] for state in states])[0][1]
+
+        self.assertLess(
+            abs(int(merge("d = COUNT_DISTINCT_MERGE(v)", 1)) - 2000), 100)
+        self.assertLess(
+            abs(float(merge("m = QUANTILE_MERGE(v, 0.5)", 2)) - 875), 40)
+        self.assertEqual(
+            len(merge("s = SPACE_SAVING_MERGE(v, 3)", 3).split(" ")), 3)
+
+    def test_moments(self):
+        values = [1e6 + (i * 37 % 101) ** 2 / 100.0 for i in range(300)]
+        n, mean = len(values), sum(values) / len(values)
+        m2, m3, m4 = [sum((v - mean) ** p for v in values) for p in (2, 3, 4)]
+        expected = [mean, m2 / (n - 1), (m2 / (n - 1)) ** 0.5,
+                    n ** 0.5 * m3 / m2 ** 1.5, n * m4 / m2 ** 2 - 3]
+
+        select = ["AVG", "VAR", "STD", "SKEW", "KURT"]
+        program = AWKGroupProgram(self.fields, "s", [
+            "{} = {}(v)".format(f.lower(), f) for f in select])
+        rows = [["a", repr(v)] for v in values]
+        result = run_awk(program, rows)
+        for value, output in zip(expected, result[0][1:]):
+            self.assertAlmostEqual(float(output) / value, 1, places=4)
+
+        program = AWKGroupProgram(
+            self.fields, "s", ["m = MOMENTS(v)"], mode="hash")
+        states = run_awk(program, [
+            [str(index % 3), value] for index, (_, value) in enumerate(rows)])
+        program = AWKGroupProgram(self.fields, "s", [
+            "{} = {}_MERGE(v)".format(f.lower(), f) for f in select])
+        merged = run_awk(program, [["a", state] for _, state in states])
+        self.assertEqual(merged, result)
+        self.assertEqual(run_awk(program, [["a", "1 1 0 0 0"]]),
+                         [["a", "1", "", "", "", ""]])
+
+    def test_grouping_sets(self):
+        fields = (Field("s"), Field("d"), Field("v"))
+        rows = [["a", "1", "5"], ["a", "1", "2"], ["a", "2", "3"],
+                ["b", "1", "1"]]
+        with self.assertRaises(ValueError):
+            AWKGroupProgram(fields, "s; d", ["t = SUM(v)"], grouping_sets=[
+                ("v",)])
+
+        program = AWKGroupProgram(fields, "s; d", ["t = SUM(v)"])
+        self.assertFalse(program.has_grouping_id)
+        self.assertEqual(run_awk(program, rows), [
+            ["a", "1", "7"], ["a", "2", "3"], ["b", "1", "1"]])
+
+        program = AWKGroupProgram(
+            fields, "s; d", ["t = SUM(v)"],
+            grouping_sets=AWKGroupProgram.rollup(["s", "d"]))
+        self.assertEqual(run_awk(program, rows), [
+            ["0", "a", "1", "7"], ["0", "a", "2", "3"], ["1", "a", "", "10"],
+            ["0", "b", "1", "1"], ["1", "b", "", "1"], ["3", "", "", "11"],
+        ])
+
+        program = AWKGroupProgram(
+            fields, "s; d", ["t = SUM(v)"], grouping_sets=[("d",), ("s",)])
+        self.assertEqual(run_awk(program, rows), [
+            ["1", "a", "", "10"], ["2", "", "1", "8"], ["2", "", "2", "3"],
+            ["1", "b", "", "1"],
+        ])
+
+    def test_grouping_outputs(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        outputs = [os.path.join(directory, name) for name in ("d", "total")]
+
+        program = AWKGroupProgram(
+            (Field("s"), Field("d"), Field("v")), "s; d", ["t = SUM(v)"],
+            grouping_sets=[("d",), ()], outputs=outputs)
+        self.assertEqual(run_awk(program, [
+            ["a", "1", "5"], ["b", "1", "2"], ["b", "2", "3"]]), [])
+        with open(outputs[0]) as d, open(outputs[1]) as total:
+            self.assertEqual(d.read(), "1\t7\n2\t3\n")
+            self.assertEqual(total.read(), "10\n")
+
+
+class TestAWKSplitProgram(unittest.TestCase):
+    def test_split(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        fields = (Field("s"), Field("v"))
+
+        with self.assertRaises(ValueError):
+            AWKSplitProgram(fields, os.path.join(directory, "x"), "s\tv")
+
+        program = AWKSplitProgram(
+            fields, os.path.join(directory, "{s}", "{v > 2}.tsv"), "s\tv",
+            max_open_files=1)
+        rows = [["a", "1"], ["b'c", "5"], ["a", "3"], ["a", "2"], ["b'c", "4"]]
+        self.assertEqual(run_awk(program, rows), [])
+
+        result = {}
+        for path in ("a/0.tsv", "a/1.tsv", "b'c/1.tsv"):
+            with open(os.path.join(directory, path)) as f:
+                result[path] = f.read()
+        self.assertEqual(result, {
+            "a/0.tsv": "s\tv\na\t1\na\t2\n",
+            "a/1.tsv": "s\tv\na\t3\n",
+            "b'c/1.tsv": "s\tv\nb'c\t5\nb'c\t4\n",
+        })
+
+    def test_compress(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        program = AWKSplitProgram(
+            (Field("s"), Field("v")), os.path.join(directory, "{s}.tsv.gz"),
+            "s\tv", max_open_files=1, compress="gzip -c")
+        rows = [["a", "1"], ["b", "2"], ["a", "3"]]
+        self.assertEqual(run_awk(program, rows), [])
+
+        with gzip.open(os.path.join(directory, "a.tsv.gz"), "rt") as f:
+            self.assertEqual(f.read(), "s\tv\na\t1\na\t3\n")
+
+
+
+class TestShellScript(unittest.TestCase):
+    def test_script(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        header = Header.parse("a:num\tb")
+        program = AWKStreamProgram(header.fields, ["a > 1"], ["b", "c = a * 2"])
+        path = os.path.join(directory, "map.sh")
+        with open(path, "w") as f:
+            f.write(shell_script(program, header, Header.parse("b\tc:num")))
+
+        inputs = []
+        for index, text in enumerate([
+                "a:num\tb #ORDER:a\n1\tx\n2\ty\n", "a:num\tb\n3\tz\n"]):
+            inputs.append(os.path.join(directory, str(index)))
+            with open(inputs[-1], "w") as f:
+                f.write(text)
+
+        output = subprocess.check_output(["sh", path] + inputs)
+        self.assertEqual(output, b"b\tc:num\ny\t4\nz\t6\n")
+        output = subprocess.check_output(
+            ["sh", path], input=b"a:num\tb\n5\tw\n")
+        self.assertEqual(output, b"b\tc:num\nw\t10\n")
+
+        process = subprocess.run(
+            ["sh", path], input=b"a\tb\n5\tw\n", stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        self.assertEqual(process.returncode, 1)
+        self.assertEqual(process.stdout, b"")
+
+
+class TestAWKInterpreter(unittest.TestCase):
+    def test_path(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "awk")
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(path, 0o755)
+
+        default = awk_interpreter()
+        with mock.patch.dict(os.environ, PATH=directory):
+            self.assertEqual(awk_interpreter(), path)
+        with mock.patch.dict(os.environ, AWKPATH=path):
+            self.assertEqual(awk_interpreter(), path)
+        self.assertEqual(awk_interpreter(), default)
@@ -1,6 +1,6 @@
 import unittest
 
-from ..base import Field, Header, Subheader, SubheaderCount
+from ..base import Field, Header, Subheader, SubheaderCount, SubheaderOrder
 
 
 class TestField(unittest.TestCase):
@@ -125,6 +125,23 @@ class TestSubheaderCount(unittest.TestCase):
         ), SubheaderCount("count", 3))
 
 
+class TestSubheaderOrder(unittest.TestCase):
+    def test_parse(self):
+        subheader = Subheader.parse("ORDER: id:desc value:asc:numeric").proxy
+        self.assertTrue(isinstance(subheader, SubheaderOrder))
+        self.assertEqual(subheader.fields, [
+            ("id", "desc", ""), ("value", "asc", "numeric")])
+
+    def test_is_sorted(self):
+        subheader = SubheaderOrder.from_titles(["a", "b"])
+        self.assertEqual(str(subheader), "ORDER:a:asc b:asc")
+        self.assertTrue(subheader.is_sorted(["a"]))
+        self.assertTrue(subheader.is_sorted(["a", "b"]))
+        self.assertFalse(subheader.is_sorted(["b"]))
+        self.assertFalse(subheader.is_sorted(["a", "b", "c"]))
+        self.assertFalse(SubheaderOrder("order", "a:asc:numeric").is_sorted(["a"]))
+
+
 class TestHeader(unittest.TestCase):
     def setUp(self):
         self.fields = (
@@ -134,7 +151,7 @@ class TestHeader(unittest.TestCase):
         )
         self.subheaders = (
             SubheaderCount("COUNT", 1),
-            Subheader("ORDER", "a:asc"),
+            SubheaderOrder("ORDER", "a:asc"),
         )
 
     def test_str(self):
@@ -0,0 +1,166 @@
+""" Benchmarks of the tools against the code paths they replace.
+
+Skipped unless TABTOOLS_BENCHMARK_ROWS is set (make benchmark), every
+benchmark generates input of this many rows and checks that the faster path
+wins by the best of RUNS wall times. Outputs of both paths are compared too.
+
+"""
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from ..columnar import ColumnarCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+ROWS = int(os.environ.get("TABTOOLS_BENCHMARK_ROWS", 0))
+RUNS = 3
+TOOL = "import sys; sys.argv = {1!r}; from tabtools.scripts import {0}; {0}()"
+
+
+@unittest.skipUnless(ROWS, "TABTOOLS_BENCHMARK_ROWS is not set")
+class Benchmark(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.random = random.Random(1)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def run_code(self, code):
+        """ Best wall time in seconds and output of the python code."""
+        best = None
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", code],
+                cwd=self.root, env=dict(os.environ, PYTHONPATH=ROOT),
+                stdout=subprocess.PIPE, check=True).stdout
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
+
+    @staticmethod
+    def tool(argv, setup=""):
+        """ Code which runs the tool with argv after setup code."""
+        return setup + TOOL.format(argv[0], argv)
+
+    def write_trades(self, name):
+        """ File of ROWS trades: date, symbol, qty:num, price:num, note."""
+        symbols = ["AAPL", "MSFT", "GOOG", "AMZN", "HSBA"]
+        generator = random.Random(1)
+        with open(self.path(name), "w") as f:
+            f.write("date\tsymbol\tqty:num\tprice:num\tnote\n")
+            for _ in range(ROWS):
+                f.write("2024-{:02d}-{:02d}\t{}\t{}\t{!r}\t{}\n".format(
+                    generator.randint(1, 12), generator.randint(1, 28),
+                    generator.choice(symbols), generator.randint(1, 10000),
+                    round(generator.uniform(1, 1000), 2),
+                    generator.choice(["buy", "sell", "hold"])))
+
+    def assertFaster(self, fast, slow):
+        """ Run both codes, compare their time and output."""
+        fast_time, fast_output = self.run_code(fast)
+        slow_time, slow_output = self.run_code(slow)
+        sys.stderr.write("\n{}: {:.2f}s against {:.2f}s\n".format(
+            self.id(), fast_time, slow_time))
+        self.assertEqual(fast_output, slow_output)
+        self.assertLess(fast_time, slow_time)
+
+
+class TestSemijoin(Benchmark):
+    def setUp(self):
+        super().setUp()
+        keys = ["k{:012d}".format(self.random.randrange(10 ** 12))
+                for _ in range(2 * ROWS)]
+        with open(self.path("keys.tsv"), "w") as f:
+            f.write("key\tcomment\n")
+            f.writelines("{}\tcomment\n".format(key) for key in keys)
+        with open(self.path("rows.tsv"), "w") as f:
+            f.write("id\tkey\n")
+            for i in range(ROWS):
+                key = self.random.choice(keys) if i % 3 == 0 else \
+                    "k{:012d}".format(self.random.randrange(10 ** 12))
+                f.write("{}\t{}\n".format(i, key))
+
+    def test_bloom_against_awk_array(self):
+        argv = ["ttmap", "-w", "key in FILE('keys.tsv')", "-s", "id",
+                "rows.tsv"]
+        bloom = "from tabtools.awk import Expression; " \
+            "Expression.SEMIJOIN_MIN_SIZE = 0; "
+        array = "from tabtools.awk import Expression; " \
+            "Expression.SEMIJOIN_MIN_SIZE = float('inf'); "
+        # Bloom filter cache is built by the first run.
+        self.run_code(self.tool(argv, bloom))
+        self.assertFaster(self.tool(argv, bloom), self.tool(argv, array))
+
+
+class TestColumnarCache(Benchmark):
+
+    """ Columnar cache is read by in-process engines only, cached.tsv has
+    cache and plain.tsv is the same file without it."""
+
+    READ = "from tabtools.vectorized import read_batches; print(sum(" \
+        "batch['qty'].sum() + batch['price'].sum() + len(set(batch['note']))" \
+        " for batch in read_batches([{!r}])))"
+
+    def setUp(self):
+        super().setUp()
+        self.write_trades("cached.tsv")
+        self.write_trades("plain.tsv")
+        ColumnarCache.build(self.path("cached.tsv"))
+
+    def test_read_batches(self):
+        self.assertFaster(
+            self.READ.format("cached.tsv"), self.READ.format("plain.tsv"))
+
+    def test_numpy_engine(self):
+        argv = ["ttreduce", "--engine", "numpy", "-g", "symbol",
+                "-s", "n = COUNT()", "-s", "qty = SUM(qty)",
+                "-s", "high = MAX(price)"]
+        self.assertFaster(
+            self.tool(argv + ["cached.tsv"]), self.tool(argv + ["plain.tsv"]))
+
+
+class TestNumpyStream(Benchmark):
+
+    """ ttmap --engine numpy against awk on window functions. Plain select
+    and filter are faster in awk: numpy engine splits fields and formats
+    printed fractions with python, ttmap runs them in awk."""
+
+    def test_window_functions(self):
+        self.write_trades("trades.tsv")
+        argv = ["ttmap", "-s", "date", "-s", "average = AVG(price, 20)",
+                "-s", "high = MAX(price, 10)", "-s", "total = SUM(qty)",
+                "trades.tsv"]
+        self.assertFaster(
+            self.tool(argv + ["--engine", "numpy"]), self.tool(argv))
+
+
+class TestNumpyGroup(Benchmark):
+
+    """ ttreduce --engine numpy against awk hash mode on a computed key.
+    Keys of string fields read from text are faster in awk: the engine
+    splits and parses the text with python."""
+
+    ARGV = ["ttreduce", "-g", "level = int(price / 10)", "-s", "n = COUNT()",
+            "-s", "qty = SUM(qty)", "-s", "low = MIN(price)"]
+
+    def test_text(self):
+        self.write_trades("trades.tsv")
+        self.assertFaster(
+            self.tool(self.ARGV + ["--engine", "numpy", "trades.tsv"]),
+            self.tool(self.ARGV + ["--hash", "trades.tsv"]))
+
+    def test_columnar_cache(self):
+        self.write_trades("trades.tsv")
+        ColumnarCache.build(self.path("trades.tsv"))
+        self.assertFaster(
+            self.tool(self.ARGV + ["--engine", "numpy", "trades.tsv"]),
+            self.tool(self.ARGV + ["--hash", "trades.tsv"]))
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from ..bloom import BloomFilter, KeySet, key_hash, key_hashes, semijoin
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestKeyHashes(unittest.TestCase):
+    def test_key_hashes(self):
+        keys = [b"", b"a", b"a\0", b"ab", b"x" * 100]
+        self.assertEqual(key_hashes(keys).tolist(), list(map(key_hash, keys)))
+        self.assertEqual(len(set(map(key_hash, keys))), len(keys))
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_from_capacity(self):
+        bloom = BloomFilter.from_capacity(1000, error_rate=0.01)
+        self.assertEqual(bloom.size, 9586)
+        self.assertEqual(bloom.hashes, 7)
+        self.assertEqual(len(bloom.bits), 1199)
+
+    def test_contains(self):
+        bloom = BloomFilter.from_capacity(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(str(i).encode())
+
+        for i in range(1000):
+            self.assertIn(str(i).encode(), bloom)
+
+        false_positives = sum(
+            str(i).encode() in bloom for i in range(1000, 11000))
+        self.assertLess(false_positives, 300)
+
+
+class TestKeySet(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "keys.tsv")
+        with open(self.path, "w") as f:
+            f.write("key\tcomment\n")
+            for key in ["b", "a", "10", "b", "2", "ccc", "l" * 100]:
+                f.write("{}\tcomment\n".format(key))
+
+    def test_contains(self):
+        keys = KeySet(self.path)
+        for key in [b"a", b"b", b"10", b"2", b"ccc", b"l" * 100]:
+            self.assertIn(key, keys)
+
+        for key in [b"key", b"1", b"c", b"", b"comment", b"d", b"l" * 99]:
+            self.assertNotIn(key, keys)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_contains_vector(self):
+        keys = KeySet(self.path)
+        values = [b"a", b"key", b"10", b"1", b"", b"ccc", b"cc", b"cccc"]
+        self.assertEqual(
+            keys.contains(values).tolist(), [v in keys for v in values])
+
+        values.append(b"l" * 100)
+        self.assertEqual(
+            keys.contains(values).tolist(), [v in keys for v in values])
+
+    def test_cache(self):
+        KeySet(self.path)
+        self.assertTrue(os.path.exists(self.path + ".bloom"))
+
+        with open(self.path, "a") as f:
+            f.write("new\tcomment\n")
+        self.assertIn(b"new", KeySet(self.path))
+
+    def test_semijoin(self):
+        transform = semijoin([(self.path, 2), (self.path, 1)], "\t")
+        target = BytesIO()
+        transform(BytesIO(b"x\ta\n2\ty\n3"), target)
+        self.assertEqual(
+            target.getvalue(), b"x\ta\t1\t0\n2\ty\t0\t1\n3\t0\t0\n")
+
+    def test_semijoin_without_numpy(self):
+        with mock.patch("tabtools.bloom._numpy", return_value=None):
+            transform = semijoin([(self.path, 2), (self.path, 1)], "\t")
+            target = BytesIO()
+            transform(BytesIO(b"x\ta\n2\ty\n3"), target)
+        self.assertEqual(
+            target.getvalue(), b"x\ta\t1\t0\n2\ty\t0\t1\n3\t0\t0\n")
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from ..columnar import ColumnarCache
+from ..files import FileList
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestColumnarCache(unittest.TestCase):
+    BODY = "1\ta\t0.5\t1\n-2\tb c\t1e-05\t1.0\n3\ta\t2.0\tx\r\n"
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, "data.tsv")
+        with open(self.path, "w", newline='') as f:
+            f.write("i\ts\tf:num\tm #COUNT:1\n" + self.BODY)
+
+    def test_build(self):
+        self.assertIsNone(ColumnarCache.load(self.path))
+        cache = ColumnarCache.build(self.path)
+        self.assertEqual(cache.kinds, {
+            "i": "int", "s": "str", "f": "float", "m": "str"})
+        self.assertEqual(
+            str(cache.header), "i:num\ts\tf:num\tm #COUNT:3")
+        self.assertEqual(list(cache.values("i")), [1, -2, 3])
+        self.assertEqual(list(cache.values("s")), [0, 1, 0])
+        self.assertEqual(cache.dictionary("m"), ["1", "1.0", "x\r"])
+
+        with open(self.path, "a") as f:
+            f.write("4\td\t1.5\ty\n")
+        self.assertIsNone(ColumnarCache.load(self.path))
+
+        ColumnarCache.remove(self.path)
+        self.assertFalse(os.path.exists(self.path + ColumnarCache.SUFFIX))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy(self):
+        cache = ColumnarCache.build(self.path)
+        self.assertEqual(
+            numpy.load(cache.array_path("f"), mmap_mode="r").tolist(),
+            [0.5, 1e-05, 2.0])
+
+    def test_kind_change(self):
+        with open(self.path, "w", newline='') as f:
+            f.write("a\tb\tc\n" + "1\t0.5\tx\n" * 10 + "2\t0.5\t7\n" +
+                    "3.0\t1\ty\n" * 10)
+        with mock.patch.object(ColumnarCache, "BLOCK_SIZE", 8):
+            cache = ColumnarCache.build(self.path)
+        self.assertEqual(cache.count, 21)
+        self.assertEqual(cache.kinds, {"a": "str", "b": "str", "c": "str"})
+        dictionary = cache.dictionary("a")
+        self.assertEqual(
+            [dictionary[code] for code in cache.values("a")],
+            ["1"] * 10 + ["2"] + ["3.0"] * 10)
+        self.assertEqual(cache.dictionary("b"), ["0.5", "1"])
+
+    def test_width(self):
+        with open(self.path, "a") as f:
+            f.write("4\td\n")
+        with self.assertRaisesRegex(ValueError, "Line 5 has 2 values"):
+            ColumnarCache.build(self.path)
+        self.assertEqual(os.listdir(self.root), ["data.tsv"])
+
+    def test_file_list(self):
+        with open(self.path) as fd:
+            self.assertIsNone(FileList([fd]).columnar_caches())
+
+        ColumnarCache.build(self.path)
+        with open(self.path) as fd:
+            files = FileList([fd])
+            self.assertEqual(str(files.header), "i\ts\tf:num\tm #COUNT:1")
+            caches = files.columnar_caches()
+            self.assertEqual(len(caches), 1)
+            self.assertEqual(caches[0].count, 3)
+
+        other = os.path.join(self.root, "other.tsv")
+        with open(other, "w") as f:
+            f.write("i\ts\tf:num\tm\n")
+        self.assertIsNone(FileList([self.path, other]).columnar_caches())
@@ -0,0 +1,69 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from ..client import SOCKET_VARIABLE, request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+CLIENT = "import sys; from tabtools import client; client.{0}()"
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        with open(os.path.join(self.root, "data.tsv"), "w") as f:
+            f.write("a:num\tb\n1\tx\n2\ty\n3\tx\n")
+        self.socket = os.path.join(self.root, "tabtools.sock")
+        self.env = dict(os.environ, PYTHONPATH=ROOT)
+
+    def start(self):
+        daemon = subprocess.Popen(
+            [sys.executable, "-c",
+             "from tabtools.daemon import serve; serve({!r}, 2)".format(
+                 self.socket)],
+            env=self.env, stderr=subprocess.DEVNULL)
+        self.addCleanup(daemon.wait)
+        self.addCleanup(daemon.terminate)
+        for _ in range(100):
+            if os.path.exists(self.socket):
+                return daemon
+            time.sleep(0.05)
+        self.fail("daemon did not start")
+
+    def run_tool(self, tool, *args, **kwargs):
+        env = dict(self.env, **{SOCKET_VARIABLE: self.socket})
+        return subprocess.run(
+            [sys.executable, "-c", CLIENT.format(tool)] + list(args),
+            cwd=self.root, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, **kwargs)
+
+    def test_no_daemon(self):
+        self.assertIsNone(request("ttcat", ["ttcat"], self.socket))
+        result = self.run_tool("ttmap", "data.tsv", "-s", "b")
+        self.assertEqual(result.stdout, b"b\nx\ny\nx\n")
+
+    def test_request(self):
+        daemon = self.start()
+        result = self.run_tool(
+            "ttmap", "data.tsv", "-s", "a; c = a * 10", "-w", "a > 1")
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, b"a\tc\n2\t20\n3\t30\n")
+
+        result = self.run_tool(
+            "ttreduce", "-g", "b", "-s", "n = COUNT()", "-N",
+            input=b"a:num\tb\n1\tx\n2\tx\n")
+        self.assertEqual(result.stdout, b"x\t2\n")
+
+        result = self.run_tool("ttcat", "missing.tsv")
+        self.assertEqual(result.returncode, 2)
+        self.assertIn(b"missing.tsv", result.stderr)
+
+        daemon.terminate()
+        daemon.wait()
+        self.assertFalse(os.path.exists(self.socket))
@@ -1,5 +1,17 @@
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
-from ..files import File, RegularFile
+from unittest import mock
+
+from ..compressed import COMPRESSIONS, Compression, get_compression
+from ..dataset import Dataset
+from ..files import File, FileList, HeaderCache, RegularFile, copy_range
 
 
 class TestFile(unittest.TestCase):
@@ -7,3 +19,194 @@ class TestFile(unittest.TestCase):
         with open('tabtools/tests/files/sample1.tsv') as fd:
             f = File(fd, has_header=True)
             self.assertTrue(isinstance(f.proxy, RegularFile))
+
+
+class TestFileList(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.paths = []
+        for i in range(40):
+            path = os.path.join(self.root, "{}.tsv".format(i))
+            with open(path, "w") as f:
+                f.write("a\tb:num #COUNT: 1\n{}\t{}\n".format(i, i * 2))
+            self.paths.append(path)
+
+    def open(self):
+        fds = [open(path) for path in self.paths]
+        for fd in fds:
+            self.addCleanup(fd.close)
+        return fds
+
+    def test_header(self):
+        files = FileList(self.open())
+        self.assertEqual(str(files.header), "a\tb:num #COUNT:40")
+        self.assertIs(files.header, files.header)
+        self.assertTrue(all(f.fd.tell() == 0 for f in files))
+
+    def test_header_cache(self):
+        cache_path = os.path.join(self.root, "headers.json")
+        FileList(self.open(), header_cache=HeaderCache(cache_path))
+        cache = HeaderCache(cache_path)
+        self.assertEqual(len(cache.lines), 40)
+
+        with open(self.paths[0], "w") as f:
+            f.write("a\tb #COUNT: 2\n")
+        files = FileList(self.open(), header_cache=cache)
+        self.assertEqual(str(files.header), "a\tb #COUNT:41")
+        self.assertEqual(
+            HeaderCache(cache_path).lines[self.paths[0]][3],
+            "a\tb #COUNT: 2\n")
+
+    def test_copy_bodies(self):
+        with tempfile.TemporaryFile() as target:
+            FileList(self.open()[:3]).copy_bodies(target.fileno())
+            target.seek(0)
+            self.assertEqual(target.read(), b"0\t0\n1\t2\n2\t4\n")
+
+    def test_copy_bodies_stream(self):
+        read, write = os.pipe()
+        os.write(write, b"a\tb\n1\t2\n")
+        os.close(write)
+        with os.fdopen(read) as source, tempfile.TemporaryFile() as target:
+            FileList([source]).copy_bodies(target.fileno())
+            target.seek(0)
+            self.assertEqual(target.read(), b"1\t2\n")
+
+    def test_call(self):
+        output = os.path.join(self.root, "output")
+        command = "sh -c 'cat \"$@\" > {}' sh".format(output)
+
+        def run(files, **kwargs):
+            self.assertEqual(FileList(files)(command, **kwargs), 0)
+            with open(output) as f:
+                return f.read()
+
+        self.assertEqual(run(self.open()[:1]), "0\t0\n")
+        self.assertEqual(run(self.open()[:2]), "0\t0\n1\t2\n")
+        self.assertEqual(
+            run(self.open()[:2], separate=True), "0\t0\n1\t2\n")
+        self.assertEqual(
+            run(self.open()[:2], transform=lambda source, target:
+                target.write(source.read().upper().replace(b"\t", b","))),
+            "0,0\n1,2\n")
+
+
+class TestCompressed(unittest.TestCase):
+    DATA = b"a\tb\n" + b"".join(b"%d\t%d\n" % (i, i) for i in range(1000))
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.paths = {}
+        for name, compress in [("gzip", gzip.compress), ("bz2", bz2.compress),
+                               ("xz", lzma.compress)]:
+            path = os.path.join(self.root, name)
+            with open(path, "wb") as f:
+                # Concatenated streams, as appended by ttsplit.
+                f.write(compress(self.DATA[:100]) + compress(self.DATA[100:]))
+            self.paths[name] = path
+
+    def read(self):
+        for name, path in sorted(self.paths.items()):
+            with open(path) as fd, tempfile.TemporaryFile() as target:
+                files = FileList([fd])
+                self.assertEqual(str(files.header), "a\tb")
+                files.copy_bodies(target.fileno())
+                target.seek(0)
+                self.assertEqual(target.read(), self.DATA[4:], name)
+
+    def test_commands(self):
+        self.read()
+
+    def test_modules(self):
+        with mock.patch.object(Compression, 'command', None):
+            self.read()
+
+    def test_corrupted(self):
+        with open(self.paths["gzip"], "r+b") as f:
+            f.truncate(30)
+        with open(self.paths["gzip"]) as fd, open(os.devnull, "wb") as null:
+            with self.assertRaises(ValueError):
+                FileList([fd]).copy_bodies(null.fileno())
+
+    def test_compress_output(self):
+        for compression in COMPRESSIONS:
+            if compression.command is None:
+                continue
+            output = subprocess.check_output([
+                sys.executable, '-c',
+                'from tabtools.compressed import compress_output; '
+                'compress_output("{}"); print("x", flush=True); '
+                'import subprocess; subprocess.call(["echo", "y"])'.format(
+                    compression.name)
+            ])
+            self.assertEqual(
+                subprocess.check_output(
+                    compression.command + ["-dc"], input=output),
+                b"x\ny\n")
+
+        with self.assertRaises(ValueError):
+            get_compression("zip")
+
+
+class TestCopyRange(unittest.TestCase):
+    def test_copy_range(self):
+        with tempfile.TemporaryFile() as source:
+            source.write(b"header\n" + b"x" * 100000)
+            source.flush()
+            with tempfile.TemporaryFile() as target:
+                target.write(b"y")
+                target.flush()
+                copy_range(source.fileno(), target.fileno(), 7, 100000)
+                target.seek(0)
+                self.assertEqual(target.read(), b"y" + b"x" * 100000)
+
+            read, write = os.pipe()
+            copy_range(source.fileno(), write, 0, 6)
+            os.close(write)
+            with os.fdopen(read, 'rb') as pipe:
+                self.assertEqual(pipe.read(), b"header")
+
+
+class TestDataset(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for date, symbol, body in [("2024-01-01", "A", "1\t2\n"),
+                                   ("2024-01-01", "B%2Fx", "3\t4\n"),
+                                   ("2024-01-02", "A", "5\t6\n")]:
+            directory = os.path.join(
+                self.root, "date=" + date, "symbol=" + symbol)
+            os.makedirs(directory)
+            with open(os.path.join(directory, "part.tsv"), "w") as f:
+                f.write("p\tq\n" + body)
+        open(os.path.join(self.root, "_SUCCESS"), "w").close()
+
+    def test_partitions(self):
+        dataset = Dataset(self.root)
+        self.assertEqual(
+            [partition for _, partition in dataset.partitions()], [
+                [("date", "2024-01-01"), ("symbol", "A")],
+                [("date", "2024-01-01"), ("symbol", "B/x")],
+                [("date", "2024-01-02"), ("symbol", "A")],
+            ])
+        self.assertEqual(
+            len(dataset.partitions(['date > "2024-01-01" and p > 0'])), 1)
+        self.assertEqual(dataset.partitions(['symbol == "C"']), [])
+
+    def test_file_list(self):
+        files = FileList([Dataset(self.root)], filters=['symbol != "A"'])
+        self.assertEqual(
+            [f.title for f in files.header.fields],
+            ["p", "q", "date", "symbol"])
+        output = os.path.join(self.root, "output")
+        self.assertEqual(
+            files("sh -c 'cat > {}'".format(output)), 0)
+        with open(output) as f:
+            self.assertEqual(f.read(), "3\t4\t2024-01-01\tB/x\n")
+
+        with tempfile.TemporaryFile() as target:
+            files.copy_bodies(target.fileno())
+            target.seek(0)
+            self.assertEqual(target.read(), b"3\t4\t2024-01-01\tB/x\n")
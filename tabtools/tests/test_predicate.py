@@ -0,0 +1,47 @@
+import unittest
+
+from ..predicate import Predicate
+
+
+class TestPredicate(unittest.TestCase):
+    def test_compare(self):
+        self.assertIs(Predicate(['v > 10'])({'v': '9'}), False)
+        # string constant, compared as string like in awk
+        self.assertIs(Predicate(['v > "10"'])({'v': '9'}), True)
+        self.assertIs(Predicate(['1 < v <= 3'])({'v': '3'}), True)
+        self.assertIs(Predicate(['s in ["a", "b"]'])({'s': 'c'}), False)
+        self.assertIs(Predicate(['s not in ["a", "b"]'])({'s': 'c'}), True)
+
+    def test_unknown(self):
+        predicate = Predicate(['d >= "2024-01-02" and v > 1', 'SUM(v) > 0'])
+        self.assertIsNone(predicate({'d': '2024-01-02'}))
+        self.assertIs(predicate({'d': '2024-01-01'}), False)
+        self.assertIs(Predicate(['v > 1 or s == "a"'])({'s': 'a'}), True)
+        self.assertIsNone(Predicate(['not v'])({}))
+        self.assertEqual(Predicate(['v > 1; s == "a"']).names, {'v', 's'})
+
+    def test_compile(self):
+        titles = ['v', 's']
+        cases = [
+            ('v > 10', ('9', 'a'), False),
+            ('v > "10"', ('9', 'a'), True),
+            ('1 < v <= 3', ('3', ''), True),
+            ('s in ["a", "b"]', ('1', 'b'), True),
+            ('s not in ["a", "b"]', ('1', 'b'), False),
+            ('v in (1, 2)', ('1.0', ''), True),
+            ('not v', ('0', 'x'), True),
+            ('v and s', ('0x1', ''), False),
+            ('v - 1 > 8 or s == "x"', ('9.5', ''), True),
+            ('v / 0 > 1', ('1', ''), True),
+            ('-v < -2', ('3', ''), True),
+            ('v > 1; s', ('2', ''), False),
+        ]
+        for expression, row, expected in cases:
+            self.assertIs(
+                bool(Predicate([expression]).compile(titles)(row)), expected,
+                expression)
+
+        with self.assertRaises(ValueError):
+            Predicate(['x > 1']).compile(titles)
+        with self.assertRaises(ValueError):
+            Predicate(['SUM(v) > 1']).compile(titles)
@@ -0,0 +1,48 @@
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..base import Header
+from ..rows import iter_rows, record_class
+
+
+class TestRows(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, text):
+        path = os.path.join(self.root, name)
+        with open(path, "w", encoding="utf8") as f:
+            f.write(text)
+        return path
+
+    def test_record_class(self):
+        record = record_class(Header.parse("a:num\tb").fields)
+        row = tuple.__new__(record, ["1.5", "x"])
+        self.assertEqual(row.a, 1.5)
+        self.assertEqual(row.b, "x")
+        self.assertEqual(row, ("1.5", "x"))
+        self.assertEqual(repr(row), "Record(a='1.5', b='x')")
+        with self.assertRaises(AttributeError):
+            row.c = 1
+
+        row = tuple.__new__(record, ["", "x"])
+        self.assertTrue(math.isnan(row.a))
+        row = tuple.__new__(record_class(
+            Header.parse("a:num").fields, typed=False), ["1"])
+        self.assertEqual(row.a, "1")
+
+    def test_iter_rows(self):
+        paths = [
+            self.write("1.tsv", "a:num\tb\n1\tx\n20\tü\t?\n"),
+            self.write("2.tsv", "a:num\tb\n3\n"),
+        ]
+        rows = list(iter_rows(paths))
+        self.assertEqual(rows, [("1", "x"), ("20", "ü"), ("3", "")])
+        self.assertEqual([row.a for row in rows], [1.0, 20.0, 3.0])
+
+        rows = list(iter_rows(paths, where=["a > 2", "b != 'x'"]))
+        self.assertEqual(rows, [("20", "ü"), ("3", "")])
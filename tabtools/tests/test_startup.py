@@ -0,0 +1,102 @@
+""" Startup cost of the command line tools.
+
+Tools are run under python -X importtime. Heavy modules should be imported
+only by the tools which use them.
+
+Import time budget is checked if TABTOOLS_IMPORT_BUDGET_MS is set (make
+startup), timings of a shared machine are too noisy for every test run.
+Import time of the modules which are not imported by the bare interpreter
+minus import time of the standard modules every tool needs (argparse,
+subprocess) is compared with the budget, so the check depends on the
+machine speed less.
+
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+BUDGET_MS = os.environ.get("TABTOOLS_IMPORT_BUDGET_MS")
+RUNS = 5
+FLOOR = "import argparse, shlex, subprocess; " \
+    "argparse.ArgumentParser().add_argument('-a')"
+TOOL = "import sys; sys.argv = {1!r}; from tabtools.client import {0}; {0}()"
+NEVER = {"distutils", "setuptools", "numpy", "pyarrow", "asyncio",
+         "concurrent.futures"}
+COMPILER = {"ast", "tabtools.awk", "tabtools.predicate", "tabtools.vectorized"}
+COMMANDS = [
+    ["ttcat", "data.tsv"],
+    ["ttsort", "-k", "a", "data.tsv"],
+    ["ttmap", "-s", "b", "-w", "a > 0", "data.tsv"],
+    ["ttreduce", "-g", "a", "-s", "n = COUNT()", "data.tsv"],
+    ["ttuniq", "-k", "a", "data.tsv"],
+    ["ttjoin", "-k", "a", "data.tsv", "other.tsv"],
+    ["ttcompile", "map", "-s", "b", "data.tsv"],
+]
+
+
+def import_times(code, cwd=None):
+    """ Get {module: cumulative microseconds}, nested modules are indented
+    with spaces."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=cwd,
+        env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    result = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            result[name[1:]] = int(cumulative)
+    return result
+
+
+class TestStartup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Bytecode is not written if PYTHONDONTWRITEBYTECODE is set.
+        subprocess.run(
+            [sys.executable, "-m", "compileall", "-q",
+             os.path.join(ROOT, "tabtools")],
+            stdout=subprocess.DEVNULL, check=True)
+        cls.interpreter = set(import_times("pass"))
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, text in (("data.tsv", "a\tb\n1\t2\n"),
+                           ("other.tsv", "a\tc\n1\t3\n")):
+            with open(os.path.join(self.root, name), "w") as f:
+                f.write(text)
+
+    def milliseconds(self, times):
+        return sum(
+            value for name, value in times.items()
+            if not name.startswith(" ") and name not in self.interpreter
+        ) / 1000
+
+    def test_modules(self):
+        for command in COMMANDS:
+            times = import_times(
+                TOOL.format(command[0], command), self.root)
+            modules = {name.strip() for name in times}
+            self.assertFalse(modules & NEVER, command[0])
+            if command[0] in ("ttcat", "ttsort"):
+                self.assertFalse(modules & COMPILER, command[0])
+
+    @unittest.skipIf(BUDGET_MS is None, "TABTOOLS_IMPORT_BUDGET_MS is not set")
+    def test_budget(self):
+        floor = min(
+            self.milliseconds(import_times(FLOOR)) for _ in range(RUNS))
+        for command in COMMANDS:
+            overhead = min(
+                self.milliseconds(import_times(
+                    TOOL.format(command[0], command), self.root))
+                for _ in range(RUNS)
+            ) - floor
+            self.assertLess(overhead, float(BUDGET_MS), command[0])
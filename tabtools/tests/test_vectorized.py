@@ -0,0 +1,310 @@
+import io
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from ..awk import AWKGroupProgram, AWKStreamProgram
+from ..base import Header
+from ..columnar import ColumnarCache
+from ..files import FileList
+from ..vectorized import (
+    NumpyGroupProgram, NumpyStreamProgram, awk_number, awk_strnum,
+    format_number, read_batches)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STOCK = os.path.join(os.path.dirname(__file__), "files", "hsbc-stock.tsv")
+
+
+def run_awk(program, body):
+    return subprocess.check_output(
+        ['awk', '-F', '\t', '-v', 'OFS=\t', str(program)[1:-1]],
+        input=body, env=dict(os.environ, LC_ALL='C'))
+
+
+def run_numpy(program, body, batch_bytes=None):
+    if batch_bytes is not None:
+        program.batch_bytes = batch_bytes
+    target = io.BytesIO()
+    program(io.BytesIO(body), target)
+    return target.getvalue()
+
+
+def run_cached(program, header, body):
+    """ Output of the program which reads columnar cache of the body."""
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "data.tsv")
+        with open(path, "wb") as f:
+            f.write(header.rstrip("\n").encode('utf8') + b"\n" + body)
+        ColumnarCache.build(path)
+        files = FileList([path])
+        target = io.BytesIO()
+        program.run(files, target)
+        return target.getvalue()
+
+
+class TestFunctions(unittest.TestCase):
+    def test_awk_number(self):
+        self.assertEqual(awk_number(" 12abc"), 12)
+        self.assertEqual(awk_number("0x1A"), 26)
+        self.assertEqual(awk_number("1_000"), 1)
+        self.assertEqual(awk_number(".5e"), 0.5)
+        self.assertEqual(awk_number("abc"), 0)
+        self.assertEqual(awk_number("0x1p2000"), float("inf"))
+
+    def test_awk_strnum(self):
+        for value in [" 12 ", "-0", "5.", "0x10", "-0x9", "0x10e2", "0x.8",
+                      "0x1p-1074", "0e-400", "1.7976931348623157e308"]:
+            self.assertTrue(awk_strnum(value), value)
+        for value in ["", "0x1A", "0x", "1e5.", "\r5", "inf", "nan", "1e309",
+                      "1e-400", "2e-310", "0x1p2000", "00x10"]:
+            self.assertFalse(awk_strnum(value), value)
+
+    def test_format_number(self):
+        self.assertEqual(format_number(3.0), "3")
+        self.assertEqual(format_number(-0.0), "0")
+        self.assertEqual(format_number(2.0 ** 31), "2.14748e+09")
+        self.assertEqual(format_number(1 / 3), "0.333333")
+        self.assertEqual(format_number(float("inf")), "inf")
+        self.assertEqual(format_number(-float("nan")), "-nan")
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestNumpyStreamProgram(unittest.TestCase):
+
+    """ Output of numpy engine is compared with awk output."""
+
+    def assertSameOutput(self, header, body, select, where=None,
+                         cached=True):
+        fields = Header.parse(header).fields
+        expected = run_awk(AWKStreamProgram(
+            fields, filter_expressions=where, output_expressions=select),
+            body)
+        for batch_bytes in (None, 50):
+            # Stateful functions carry state across many small batches.
+            program = NumpyStreamProgram(
+                fields, filter_expressions=where, output_expressions=select)
+            self.assertEqual(run_numpy(program, body, batch_bytes), expected)
+        if cached:
+            program = NumpyStreamProgram(
+                fields, filter_expressions=where, output_expressions=select)
+            self.assertEqual(run_cached(program, header, body), expected)
+
+    def test_stateful(self):
+        fields = Header.parse("a\tb").fields
+        self.assertFalse(NumpyStreamProgram(
+            fields, ["a > 1"], ["a", "c = max(a, b) * 2"]).stateful)
+        self.assertTrue(NumpyStreamProgram(
+            fields, ["a > PREV(a)"], ["a"]).stateful)
+        self.assertTrue(NumpyStreamProgram(fields, None, ["s = SUM(a)"]).stateful)
+
+    def test_stock(self):
+        with open(STOCK, 'rb') as f:
+            header = f.readline().decode('utf8')
+            body = f.read()
+
+        self.assertSameOutput(header, body, [
+            "Date", "Close",
+            "spread = (High - Low) / Close * 100",
+            "change = Close - PREV(Close)",
+            "total = SUM(Volume)", "volume = SUM(Volume, 10)",
+            "average = AVG(Close)", "ma = AVG(Close, 20)",
+            "ema = EMA(Close, 12)",
+            "low = MIN(Low)", "high = MAX(High)",
+            "low10 = MIN(Low, 10)", "high10 = MAX(High, 10)",
+            "up = Close > Open", "bigger = max(Open, Close)",
+            "level = int(Close / 10)", "root = sqrt(Volume)",
+        ])
+        self.assertSameOutput(
+            header, body, ["Date", "Open"],
+            ["Close > Open and Volume > 10000 or not Low > 80"])
+        self.assertSameOutput(
+            header, body,
+            ["Date", "kind = 'up' if Close > Open else Close - Open"],
+            ["Date > '2014-06' and Date < '2014-09'"])
+
+    def test_strings(self):
+        values = [
+            "1", "3.50", "", "abc", " 12 ", "0x1A", "1e3", "-0", "nan",
+            "inf", "1_000", "12abc", "2", "0012", "10", "-7.25", "B", "a",
+            "ü", "3000000000", "0x10", "0x9", "1e309", "-1e400", "1e-400",
+            "2e-310", "0x1p-1074", "+0x10", "0x1p2000", "5.",
+        ]
+        rows = [(a, b) for a in values for b in values[::-3]]
+        body = "".join("{}\t{}\n".format(*row) for row in rows).encode()
+        self.assertSameOutput("a\tb", body, [
+            "a", "b", "lt = a < b", "eq = a == b", "num = a < 5",
+            "text = a >= 'B'", "t = a if a else 'empty'", "n = -a",
+            "m = MIN(a)", "mx = MAX(b, 3)", "p = PREV(b)", "e = EMA(a, 2)",
+            "s = SUM(a, 2) / 3", "both = a and not b", "z = max(a, b)",
+            "member = a in (1, 'abc', 3.5)", "f = a not in (2,)",
+        ])
+        self.assertSameOutput("a\tb", body, ["b"], ["a"])
+        self.assertSameOutput("a\tb", body, ["a"], ["a > 3"])
+
+    def test_numbers(self):
+        generator = random.Random(1)
+        values = [
+            str(generator.choice([
+                generator.randint(-10, 10),
+                generator.randint(-2 ** 33, 2 ** 33),
+                generator.uniform(-1e7, 1e7),
+                generator.uniform(-1, 1) * 10 ** generator.randint(-30, 30),
+            ]))
+            for _ in range(500)
+        ]
+        body = "".join(
+            "{}\t{}\n".format(a, b)
+            for a, b in zip(values, values[1:])).encode()
+        self.assertSameOutput("a\tb", body, [
+            "a", "c = a + b", "d = a * b", "q = a / b", "r = b - a",
+            "s = SUM(a)", "av = AVG(b)", "w = AVG(a, 7)", "e = EMA(b, 5)",
+            "lo = MIN(a, 4)", "hi = MAX(b)", "ratio = a / 0",
+        ])
+
+    def test_ragged_lines(self):
+        body = b"1\t2\t3\n4\n\n5\t6\t7\t8\n9\t10"
+        self.assertSameOutput(
+            "a\tb\tc", body, ["c", "a", "s = SUM(b)", "b"], cached=False)
+
+    def test_not_supported(self):
+        fields = Header.parse("a\tb").fields
+        with self.assertRaises(ValueError):
+            NumpyStreamProgram(fields, [], ["c = DateEpoch(a)"])
+        with self.assertRaises(ValueError):
+            NumpyStreamProgram(fields, ["a in FILE('path')"], ["a"])
+        with self.assertRaises(ValueError):
+            NumpyStreamProgram(fields, [], ["c = d"])
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestNumpyGroupProgram(unittest.TestCase):
+
+    """ Output of numpy engine is compared with awk output in hash mode."""
+
+    def assertSameOutput(self, header, body, key, select):
+        fields = Header.parse(header).fields
+        expected = run_awk(
+            AWKGroupProgram(fields, key, select, mode="hash"), body)
+        for batch_bytes in (None, 50):
+            program = NumpyGroupProgram(fields, key, select)
+            self.assertEqual(run_numpy(program, body, batch_bytes), expected)
+        program = NumpyGroupProgram(fields, key, select)
+        self.assertEqual(run_cached(program, header, body), expected)
+
+    def test_stock(self):
+        with open(STOCK, 'rb') as f:
+            header = f.readline().decode('utf8')
+            body = f.read()
+
+        select = [
+            "first = FIRST(Open)", "last = LAST(Close)", "low = MIN(Low)",
+            "high = MAX(High)", "volume = SUM(Volume)", "days = COUNT()",
+            "average = volume / days", "spread = MAX(High - Low)",
+            "rising = SUM(Close > Open)",
+        ]
+        self.assertSameOutput(header, body, "level = int(Close / 10)", select)
+        self.assertSameOutput(
+            header, body, "up = Close > Open; level = int(Low / 20)", select)
+        self.assertSameOutput(header, body, None, select)
+
+    def test_strings(self):
+        values = [
+            "1", "3.50", "", "abc", " 12 ", "0x1A", "1e3", "-0", "nan",
+            "inf", "1_000", "12abc", "2", "0012", "10", "-7.25", "B", "a",
+        ]
+        rows = [(a, b) for a in values[:6] for b in values[::-1]]
+        body = "".join("{}\t{}\n".format(*row) for row in rows).encode()
+        self.assertSameOutput("a\tb", body, "a", [
+            "s = SUM(b)", "n = COUNT()", "lo = MIN(b)", "hi = MAX(b)",
+            "f = FIRST(b)", "l = LAST(b)", "m = MIN(b / 2)",
+        ])
+        self.assertSameOutput("a\tb", body, "b", ["s = SUM(a)"])
+
+    def test_numeric_keys(self):
+        values = ["1.0000001", "1.0000002", "2", "2.5", "-0", "0", "1e3",
+                  "3000000000", "3000000001", "-7.25", "x", ""]
+        body = "".join(
+            "{}\t{}\n".format(a, i) for i, a in enumerate(values * 3)
+        ).encode()
+        select = ["n = COUNT()", "s = SUM(b)", "f = FIRST(b)"]
+        self.assertSameOutput("a\tb", body, "k = a * 1", select)
+        self.assertSameOutput("a\tb", body, "k = a * 1; a", select)
+        self.assertSameOutput("a\tb", body, "a; k = int(b / 4)", select)
+
+    def test_empty(self):
+        self.assertSameOutput("a\tb", b"", "a", ["n = COUNT()"])
+        self.assertSameOutput("a\tb", b"", None, ["n = COUNT()"])
+
+    def test_not_supported(self):
+        fields = Header.parse("a\tb").fields
+        with self.assertRaises(ValueError):
+            NumpyGroupProgram(fields, "a", ["c = TOPK(b, 2)"])
+        with self.assertRaises(ValueError):
+            NumpyGroupProgram(fields, "a", ["c = SUM(MAX(b))"])
+        with self.assertRaises(ValueError):
+            NumpyGroupProgram(fields, "a", ["c = b"])
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestReadBatches(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, text):
+        path = os.path.join(self.root, name)
+        with open(path, "w", encoding="utf8") as f:
+            f.write(text)
+        return path
+
+    def test_read(self):
+        paths = [
+            self.write("1.tsv", "a:num\tb\tc:num\n1\tx\t0.5\n-2\tü\t1e3\n"),
+            self.write("2.tsv", "a:num\tb\tc:num\n3\t\t\n\n4.5\ty\n"),
+        ]
+        batches = list(read_batches(paths, batch_rows=2))
+        self.assertEqual([len(batch["a"]) for batch in batches], [2, 2, 1])
+        self.assertEqual(list(batches[0]), ["a", "b", "c"])
+
+        columns = {
+            title: numpy.concatenate([batch[title] for batch in batches])
+            for title in ("a", "b", "c")
+        }
+        self.assertEqual(columns["a"].dtype, numpy.float64)
+        self.assertEqual(columns["b"].tolist(), ["x", "ü", "", "", "y"])
+        numpy.testing.assert_equal(
+            columns["a"], [1, -2, 3, numpy.nan, 4.5])
+        numpy.testing.assert_equal(
+            columns["c"], [0.5, 1e3, numpy.nan, numpy.nan, numpy.nan])
+
+    def test_cache(self):
+        paths = [
+            self.write("1.tsv", "a:num\tb\tc:num\n1\tx\t0.5\n-2\tü\t1e3\n"),
+            self.write("2.tsv", "a:num\tb\tc:num\n3\t\t\n4.5\ty\tz\n"),
+        ]
+        expected = list(read_batches(paths, batch_rows=3))
+        for path in paths:
+            ColumnarCache.build(path)
+        batches = list(read_batches(paths, batch_rows=3))
+        self.assertEqual(len(batches), len(expected))
+        for batch, other in zip(batches, expected):
+            self.assertEqual(list(batch), ["a", "b", "c"])
+            self.assertEqual(batch["a"].dtype, numpy.float64)
+            numpy.testing.assert_equal(batch, other)
+
+    def test_columns(self):
+        path = self.write("data.tsv", "a:num\tb\n1\tx\n2\ty\n")
+        batches = list(read_batches([path], columns=["b", "a"]))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(list(batches[0]), ["b", "a"])
+        self.assertEqual(batches[0]["a"].tolist(), [1.0, 2.0])
+
+        with self.assertRaises(ValueError):
+            list(read_batches([path], columns=["c"]))
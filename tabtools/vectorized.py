@@ -0,0 +1,1619 @@
+""" Vectorized execution of stream and group programs.
+
+Requires optional numpy (pip install tabtools[numpy]). ttmap --engine numpy
+evaluates the same select and where expressions as AWKStreamProgram, but
+over column batches of the input instead of one row at a time in awk.
+ttreduce --engine numpy evaluates AWKGroupProgram expressions, group state
+is updated with every batch, so the input does not need to be sorted.
+
+Values follow awk (mawk) semantics, so the output is the same as awk output:
+every element is a number, a string or a field which looks numeric (strnum).
+Two values are compared as numbers if both of them are numeric, otherwise as
+strings. Numbers are printed with "%d" if they are integers and with OFMT
+("%.6g") otherwise, NaN compares equal to any number.
+
+Fields are parsed to numbers only if they are used as numbers, distinct
+strings which python float does not parse as awk are converted once. Fields
+are split and printed fractions are formatted by python ("%.6g"), these are
+the main costs of the engine: on 1M rows ttmap --engine numpy is about 1.2x
+faster than mawk with window functions (AVG, MAX, SUM), 1.7x with columnar
+cache, and about 1.5x slower on a plain select and filter, so ttmap runs
+programs without stateful functions in awk. ttreduce --engine numpy is about
+1.1x faster than awk hash mode on a computed numeric key, 1.5x with columnar
+cache, and about 1.2x slower on a string field key read from text (make
+benchmark).
+
+Stateful functions (SUM, AVG, EMA, MIN, MAX, PREV) carry their state across
+batches. Running AVG and EMA are recurrences in floating point, they are
+computed sequentially to round exactly as awk does. Group functions (SUM,
+COUNT, MIN, MAX, FIRST, LAST) keep state of every group in arrays.
+
+"""
+import ast
+import io
+import math
+import re
+from collections import deque
+from itertools import repeat
+
+from .base import Field
+from .files import FileList
+from .predicate import awk_number
+
+BATCH_BYTES = 1 << 20
+BATCH_ROWS = 1 << 16
+# Largest integer printed by mawk with "%d", larger numbers use OFMT.
+MAX_INT = 2 ** 31 - 1
+
+# Field string which looks numeric: awk compares it as a number. strtod reads
+# all of it but blanks, hexadecimal too, and it ends with a digit or dot.
+STRNUM = re.compile(
+    r"[ \t]*([+-]?(?:0[xX](?:[0-9a-fA-F]+\.?[0-9a-fA-F]*|\.[0-9a-fA-F]+)"
+    r"(?:[pP][+-]?\d+)?|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?))(?<=[\d.])"
+    r"[ \t]*\Z"
+)
+# Smallest normal float, smaller results of strtod could be out of range.
+MIN_NORMAL = 2.2250738585072014e-308
+NONZERO = re.compile(r"[1-9]")
+# Characters accepted around numbers by python float but not by awk.
+NOT_AWK_NUMBER = "_\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ValueError(
+            "numpy is required for numpy engine, install tabtools[numpy]")
+    return numpy
+
+
+def _awk_floats(text):
+    """ Whether python float parses numbers of the text as awk does: text
+    is ASCII without NOT_AWK_NUMBER characters."""
+    return text.isascii() and not any(c in text for c in NOT_AWK_NUMBER)
+
+
+def _exact(number, text):
+    """ Whether float number is exactly the value of the number text."""
+    from fractions import Fraction
+
+    sign = -1 if text.startswith("-") else 1
+    text = text.lstrip("+-")
+    if text[:2].lower() != "0x":
+        return Fraction(number) == sign * Fraction(text)
+
+    text, _, exponent = text[2:].lower().partition("p")
+    whole, _, fraction = text.partition(".")
+    value = Fraction(int(whole + fraction or "0", 16), 16 ** len(fraction))
+    return Fraction(number) == sign * value * Fraction(2) ** int(exponent or 0)
+
+
+def awk_strnum(value):
+    """ Whether field string looks numeric to mawk, see STRNUM.
+
+    Numbers out of range of float are strings: strtod overflows to infinity
+    or underflows to a subnormal number or zero which is not exact.
+
+    """
+    match = STRNUM.match(value)
+    if match is None:
+        return False
+    number = awk_number(match.group(1))
+    if math.isinf(number):
+        return False
+    return abs(number) >= MIN_NORMAL or _exact(number, match.group(1))
+
+
+def format_number(number):
+    """ Number as awk prints it."""
+    if math.isfinite(number) and number == int(number) and \
+            abs(number) <= MAX_INT:
+        return "%d" % number
+    if math.isnan(number):
+        return "-nan" if math.copysign(1, number) < 0 else "nan"
+    return "%.6g" % number
+
+
+def format_numbers(numbers):
+    """ Array of strings of the numbers, see format_number."""
+    np = _numpy()
+    result = np.empty(len(numbers), dtype=object)
+    with np.errstate(invalid="ignore"):
+        integer = (numbers == np.trunc(numbers)) & (np.abs(numbers) <= MAX_INT)
+    result[integer] = numbers[integer].astype(np.int64).astype(str)
+
+    other = ~integer
+    finite = other & np.isfinite(numbers)
+    result[finite] = ["%.6g" % n for n in numbers[finite].tolist()]
+    other &= ~finite
+    if other.any():
+        result[other] = [format_number(n) for n in numbers[other].tolist()]
+    return result
+
+
+def parse_numbers(strings, fast=True):
+    """ Numeric values and strnum flags of field strings.
+
+    Python float is used if it parses every string as awk would (fast is
+    True if there are no characters which python float skips around
+    numbers) and numbers are in range of normal floats or zeros written
+    without other digits, otherwise distinct strings are converted one by
+    one, see awk_strnum.
+
+    """
+    np = _numpy()
+    if fast:
+        for mask in (None, strings != ""):
+            try:
+                values = strings if mask is None else strings[mask]
+                numbers = values.astype(np.float64)
+            except ValueError:
+                continue
+            if not np.isfinite(numbers).all():
+                break
+            tiny = np.abs(numbers) < MIN_NORMAL
+            if tiny.any() and ((numbers[tiny] != 0).any() or any(map(
+                    NONZERO.search, values[tiny].tolist()))):
+                break
+            if mask is None:
+                return numbers, np.ones(len(strings), dtype=bool)
+            result = np.zeros(len(strings))
+            result[mask] = numbers
+            return result, mask
+
+    # Distinct strings are converted once, e.g. repeated dates.
+    distinct = list(dict.fromkeys(strings.tolist()))
+    codes = np.fromiter(
+        map(dict(zip(distinct, range(len(distinct)))).__getitem__, strings),
+        np.intp, len(strings))
+    numbers = np.fromiter(map(awk_number, distinct), np.float64, len(distinct))
+    strnum = np.fromiter(map(awk_strnum, distinct), bool, len(distinct))
+    return numbers[codes], strnum[codes]
+
+
+def read_text(source, size=BATCH_BYTES, encoding='latin-1'):
+    """ Text of complete lines read from binary file by blocks.
+
+    Bytes are decoded as latin-1 by default: strings compare as bytes in the
+    C locale and are encoded back without changes.
+
+    """
+    rest = b""
+    while True:
+        block = source.read(size)
+        if not block:
+            break
+        end = block.rfind(b"\n") + 1
+        if not end:
+            rest += block
+            continue
+        yield (rest + block[:end]).decode(encoding)
+        rest = block[end:]
+    if rest:
+        yield (rest + b"\n").decode(encoding)
+
+
+def _is_uniform(text, delimiter, width):
+    """ Whether every text line has width fields."""
+    np = _numpy()
+    if len(delimiter) != 1 or ord(delimiter) > 127:
+        return False
+    data = np.frombuffer(text.encode('utf8'), dtype=np.uint8)
+    separators = data[np.flatnonzero(
+        (data == ord("\n")) | (data == ord(delimiter)))]
+    if len(separators) % width:
+        return False
+    pattern = np.full(width, ord(delimiter), dtype=np.uint8)
+    pattern[-1] = ord("\n")
+    return bool((separators.reshape(-1, width) == pattern).all())
+
+
+def split_lines(text, delimiter, width):
+    """ Fields of text lines, 2D object array with width columns.
+
+    Missing fields are empty strings and extra fields are dropped, as awk
+    reads them. All of the lines are split at once, fields are placed by
+    the number of delimiters in every line.
+
+    """
+    np = _numpy()
+    lines = text[:-1].split("\n")
+    if len(delimiter) == 1:
+        fields = text[:-1].replace("\n", delimiter).split(delimiter)
+    else:
+        fields = [field for line in lines for field in line.split(delimiter)]
+    fields = np.array(fields, dtype=object)
+    sizes = np.fromiter(
+        map(str.count, lines, repeat(delimiter)), np.int64, len(lines)) + 1
+    starts = np.cumsum(sizes) - sizes
+    result = np.full((len(lines), width), "", dtype=object)
+    for column in range(width):
+        rows = np.flatnonzero(sizes > column)
+        result[rows, column] = fields[starts[rows] + column]
+    return result
+
+
+def split_fields(text, delimiter, width):
+    """ Fields of text lines, 2D object array with width columns."""
+    np = _numpy()
+    if _is_uniform(text, delimiter, width):
+        fields = text[:-1].replace("\n", delimiter).split(delimiter)
+        return np.array(fields, dtype=object).reshape(-1, width)
+    return split_lines(text, delimiter, width)
+
+
+def split_columns(text, delimiter, width, indexes):
+    """ Lists of field strings of text lines for columns at indexes."""
+    if _is_uniform(text, delimiter, width):
+        fields = text[:-1].replace("\n", delimiter).split(delimiter)
+        return [fields[index::width] for index in indexes]
+
+    rows = split_lines(text, delimiter, width)
+    return [rows[:, index] for index in indexes]
+
+
+def parse_floats(strings):
+    """ float64 array of strings, empty and not numeric strings are NaN."""
+    np = _numpy()
+    try:
+        return np.array(strings, dtype=np.float64)
+    except ValueError:
+        pass
+
+    def parse(value):
+        try:
+            return float(value)
+        except ValueError:
+            return math.nan
+
+    return np.fromiter(map(parse, strings), np.float64, len(strings))
+
+
+def read_columns(text, delimiter, width, indexes, numbers):
+    """ Arrays of text lines for columns at indexes.
+
+    numbers are flags of float64 columns, they are parsed by numpy loadtxt
+    if every value is a number, other columns are split by python.
+
+    """
+    np = _numpy()
+    result = [None] * len(indexes)
+    floats = [k for k, number in enumerate(numbers) if number]
+    if floats:
+        try:
+            values = np.loadtxt(
+                io.StringIO(text), dtype=np.float64, delimiter=delimiter,
+                comments=None, usecols=[indexes[k] for k in floats], ndmin=2)
+        except ValueError:
+            values = None
+        # Empty lines are skipped by loadtxt.
+        if values is not None and len(values) == text.count("\n"):
+            for column, k in enumerate(floats):
+                result[k] = values[:, column].copy()
+
+    missing = [k for k, values in enumerate(result) if values is None]
+    if missing:
+        lists = split_columns(
+            text, delimiter, width, [indexes[k] for k in missing])
+        for k, values in zip(missing, lists):
+            result[k] = parse_floats(values) if numbers[k] else \
+                np.array(values, dtype=object)
+    return result
+
+
+class CachedColumns:
+
+    """ Columns of a tabtools.columnar.ColumnarCache as numpy arrays.
+
+    Params
+    ------
+    cache: ColumnarCache
+    partition: list of (key, value), dataset partition columns follow the
+        cached ones.
+    encoding: str, strings are encoded back as utf8 and decoded with it,
+        e.g. latin-1 for programs which read lines as read_text does.
+
+    Numbers are memory mapped and are not parsed. Strings are dictionary
+    codes: dictionary values are converted once per column and taken by
+    codes.
+
+    """
+
+    def __init__(self, cache, partition=None, encoding='utf8'):
+        self.cache = cache
+        self.kinds = cache.meta["kinds"]
+        self.partition = [value for _, value in partition or []]
+        self.encoding = encoding
+        self._arrays = {}
+        self._dictionaries = {}
+
+    def __len__(self):
+        return self.cache.count
+
+    def _decode(self, value):
+        if self.encoding == 'utf8':
+            return value
+        return value.encode('utf8').decode(self.encoding)
+
+    def _array(self, index):
+        """ Memory mapped values, dictionary codes of strings."""
+        if index not in self._arrays:
+            self._arrays[index] = _numpy().load(
+                self.cache.array_path(self.cache.titles[index]),
+                mmap_mode='r')
+        return self._arrays[index]
+
+    def _dictionary(self, index, convert=None):
+        """ Strings of the column dictionary or their conversion, e.g.
+        parse_floats, computed once."""
+        key = index, convert and convert.__name__
+        if key not in self._dictionaries:
+            if convert is None:
+                self._dictionaries[key] = _numpy().array([
+                    self._decode(value) for value in
+                    self.cache.dictionary(self.cache.titles[index])
+                ], dtype=object)
+            else:
+                self._dictionaries[key] = convert(self._dictionary(index))
+        return self._dictionaries[key]
+
+    def _partition(self, index, start, end):
+        """ Strings of partition column, None for cached columns."""
+        if index < len(self.kinds):
+            return None
+        value = self._decode(self.partition[index - len(self.kinds)])
+        return _numpy().full(end - start, value, dtype=object)
+
+    def strings(self, index, start, end):
+        """ Object array of field strings of rows start:end."""
+        np = _numpy()
+        strings = self._partition(index, start, end)
+        if strings is not None:
+            return strings
+        values = self._array(index)[start:end]
+        kind = self.kinds[index]
+        if kind == "str":
+            return self._dictionary(index)[values]
+        if kind == "int":
+            return values.astype(str).astype(object)
+        # Distinct floats are formatted once, e.g. prices. Bits are compared
+        # to keep -0.0 apart from 0.0.
+        bits, codes = np.unique(
+            values.view(np.int64), return_inverse=True)
+        return np.array(list(map(
+            repr, bits.view(np.float64).tolist())), dtype=object)[codes]
+
+    def floats(self, index, start, end):
+        """ float64 values of rows start:end as read_columns parses them."""
+        np = _numpy()
+        strings = self._partition(index, start, end)
+        if strings is not None:
+            return parse_floats(strings)
+        values = self._array(index)[start:end]
+        if self.kinds[index] == "str":
+            return self._dictionary(index, parse_floats)[values]
+        return values.astype(np.float64)
+
+    def values(self, index, start, end):
+        """ Values of rows start:end, see Values.field."""
+        np = _numpy()
+        strings = self._partition(index, start, end)
+        if strings is not None:
+            return Values.field(strings, False)
+        values = self._array(index)[start:end]
+        kind = self.kinds[index]
+        if kind == "str":
+            return self._dictionary(index, _dictionary_values)[values]
+
+        number = values.astype(np.float64)
+        if kind == "int" and (
+                not len(number) or np.abs(number).max() <= MAX_INT):
+            # Printed with "%d" as the field text.
+            return Values(number)
+        return Values(
+            number, self.strings(index, start, end),
+            np.ones(len(number), dtype=bool))
+
+
+def _dictionary_values(strings):
+    """ Values of dictionary strings of a cached column."""
+    text = "".join(strings)
+    number, numeric = parse_numbers(strings, _awk_floats(text))
+    return Values(number, strings, numeric)
+
+
+def _batches(chunks, columns, batch_rows):
+    """ Dicts of batch_rows rows of chunks, lists of column arrays."""
+    np = _numpy()
+    pending, size = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk[0])
+        if size < batch_rows:
+            continue
+
+        arrays = [np.concatenate(values) for values in zip(*pending)]
+        end = size - size % batch_rows
+        for start in range(0, end, batch_rows):
+            yield dict(zip(columns, (
+                values[start:start + batch_rows] for values in arrays)))
+        pending = [[values[end:] for values in arrays]]
+        size -= end
+
+    if size:
+        arrays = [np.concatenate(values) for values in zip(*pending)]
+        yield dict(zip(columns, arrays))
+
+
+def read_batches(paths=None, columns=None, batch_rows=BATCH_ROWS,
+                 header_line=''):
+    """ Read delimited files as batches of numpy column arrays.
+
+    Params
+    ------
+    paths: list of paths or file objects, standard input by default.
+    columns: list of titles, all fields by default.
+    batch_rows: int, number of rows in a batch, the last one could be smaller.
+    header_line: str, optional, see FileList.
+
+    Header of the files is resolved by FileList. If every file has columnar
+    cache (ttcache), requested columns are read from the caches. Otherwise
+    bodies are read by large blocks split at line ends, only requested
+    columns are converted.
+
+    Yields dict of title: array for every batch. num fields are float64
+    arrays, empty and not numeric values are NaN. Other fields are object
+    arrays of strings.
+
+    """
+    if batch_rows < 1:
+        raise ValueError("Batch rows should be positive")
+
+    files = FileList(paths, header_line=header_line)
+    header = files.header
+    titles = [field.title for field in header.fields]
+    columns = titles if columns is None else list(columns)
+    unknown = [title for title in columns if title not in titles]
+    if unknown:
+        raise ValueError("Columns {} are not in header {}".format(
+            unknown, header))
+    if not columns:
+        raise ValueError("Columns are not set")
+    indexes = [titles.index(title) for title in columns]
+    numbers = [
+        header.fields[index].type == Field.TYPES.NUMBER for index in indexes]
+
+    caches = files.columnar_caches()
+    if caches is not None:
+        yield from _batches((
+            [
+                cached.floats(index, start, start + batch_rows) if number
+                else cached.strings(index, start, start + batch_rows)
+                for index, number in zip(indexes, numbers)
+            ]
+            for cached in (
+                CachedColumns(cache, f.partition)
+                for f, cache in zip(files, caches))
+            for start in range(0, len(cached), batch_rows)
+        ), columns, batch_rows)
+        return
+
+    with files.bodies() as source:
+        yield from _batches((
+            read_columns(text, header.delimiter, len(titles), indexes, numbers)
+            for text in read_text(source, encoding='utf8')
+        ), columns, batch_rows)
+
+
+def sliding_argmin(values, window):
+    """ Positions of the last minimum in every window of values.
+
+    Windows end at positions window - 1, ..., len(values) - 1. Van Herk/Gil-
+    Werman algorithm: values are split into blocks of window size, minimum
+    of a window is the minimum of suffix of one block and prefix of the next
+    one, prefix wins ties as it is closer to the window end.
+
+    """
+    np = _numpy()
+    size = len(values)
+    blocks = -(-size // window)
+    matrix = np.full(blocks * window, np.inf)
+    matrix[:size] = values
+    matrix = matrix.reshape(blocks, window)
+    index = np.arange(blocks * window).reshape(blocks, window)
+
+    prefix = np.minimum.accumulate(matrix, axis=1)
+    prefix_at = np.maximum.accumulate(
+        np.where(matrix == prefix, index, -1), axis=1)
+    reverse = matrix[:, ::-1]
+    suffix = np.minimum.accumulate(reverse, axis=1)
+    new = np.ones_like(reverse, dtype=bool)
+    new[:, 1:] = reverse[:, 1:] < suffix[:, :-1]
+    suffix_at = np.minimum.accumulate(
+        np.where(new, index[:, ::-1], size), axis=1)[:, ::-1].ravel()
+    suffix = suffix[:, ::-1].ravel()
+    prefix, prefix_at = prefix.ravel(), prefix_at.ravel()
+
+    end = np.arange(window - 1, size)
+    start = end - window + 1
+    return np.where(
+        (start % window != 0) & (suffix[start] < prefix[end]),
+        suffix_at[start], prefix_at[end])
+
+
+class Values:
+
+    """ Column of awk values.
+
+    Params
+    ------
+    number: float64 array, numeric value of every element.
+    text: object array or None, string of every element or None if the
+        element is a number. None if all of the elements are numbers.
+    numeric: bool array or None, element is a number or strnum. None if all
+        of the elements are numbers.
+
+    Numbers of field strings are parsed when they are used first, fields
+    which are only printed are not parsed.
+
+    """
+
+    __slots__ = ("_number", "text", "_numeric", "_fast")
+
+    def __init__(self, number, text=None, numeric=None):
+        self._number = number
+        self.text = text
+        self._numeric = numeric
+        self._fast = None
+
+    def __len__(self):
+        return len(self.text if self._fast is not None else self._number)
+
+    @classmethod
+    def field(cls, strings, fast=True):
+        """ Values of field strings, see parse_numbers."""
+        values = cls(None, strings)
+        values._fast = fast
+        return values
+
+    def _parse(self):
+        if self._fast is not None:
+            self._number, self._numeric = parse_numbers(self.text, self._fast)
+            self._fast = None
+
+    @property
+    def number(self):
+        self._parse()
+        return self._number
+
+    @number.setter
+    def number(self, number):
+        self._parse()
+        self._number = number
+
+    @property
+    def numeric(self):
+        self._parse()
+        return self._numeric
+
+    @classmethod
+    def constant(cls, value, size):
+        np = _numpy()
+        if isinstance(value, str):
+            return cls(
+                np.full(size, awk_number(value)),
+                np.full(size, value, dtype=object),
+                np.zeros(size, dtype=bool)
+            )
+        return cls(np.full(size, float(value)))
+
+    @classmethod
+    def concatenate(cls, values):
+        np = _numpy()
+        return cls(
+            np.concatenate([v.number for v in values]),
+            None if all(v.text is None for v in values) else
+            np.concatenate([v.texts() for v in values]),
+            None if all(v.numeric is None for v in values) else
+            np.concatenate([v.numerics() for v in values]),
+        )
+
+    def texts(self):
+        """ Text array, None for numbers."""
+        if self.text is None:
+            return _numpy().full(len(self), None, dtype=object)
+        return self.text
+
+    def numerics(self):
+        if self.numeric is None:
+            return _numpy().ones(len(self), dtype=bool)
+        return self.numeric
+
+    def __getitem__(self, index):
+        if self._fast is not None:
+            return Values.field(self.text[index], self._fast)
+        return Values(
+            self.number[index],
+            None if self.text is None else self.text[index],
+            None if self.numeric is None else self.numeric[index],
+        )
+
+    def where(self, condition, other):
+        """ Elements of self where condition is True, of other otherwise."""
+        np = _numpy()
+        return Values(
+            np.where(condition, self.number, other.number),
+            None if self.text is None and other.text is None else
+            np.where(condition, self.texts(), other.texts()),
+            None if self.numeric is None and other.numeric is None else
+            np.where(condition, self.numerics(), other.numerics()),
+        )
+
+    def put(self, index, other):
+        """ Replace elements at index with other values in place."""
+        self.number[index] = other.number
+        self.text[index] = other.texts()
+        self.numeric[index] = other.numerics()
+
+    def strings(self):
+        """ Strings as awk prints or converts the values."""
+        if self.text is None:
+            return format_numbers(self.number)
+        np = _numpy()
+        numbers = np.equal(self.text, None)
+        if not numbers.any():
+            return self.text
+        result = self.text.copy()
+        result[numbers] = format_numbers(self.number[numbers])
+        return result
+
+    def truth(self):
+        """ Boolean array: numbers are true if not 0, strings if not empty."""
+        np = _numpy()
+        nonzero = self.number != 0
+        if self.numeric is None:
+            return nonzero
+        return np.where(self.numeric, nonzero, self.texts() != "")
+
+    def compare(self, other, op):
+        """ awk comparison, op is ast comparison operator."""
+        np = _numpy()
+        # mawk compares numbers by sign of the difference, NaN equals to all.
+        sign = (self.number > other.number).astype(np.int8) - \
+            (self.number < other.number)
+        result = OPERATORS[op](sign, 0)
+        numeric = self.numerics() & other.numerics()
+        if not numeric.all():
+            strings = ~numeric
+            result[strings] = OPERATORS[op](
+                self[strings].strings(), other[strings].strings()
+            ).astype(bool)
+        return Values(result.astype(np.float64))
+
+    def items(self):
+        """ Elements as (number, text, numeric) tuples."""
+        return zip(
+            self.number.tolist(), self.texts().tolist(),
+            self.numerics().tolist())
+
+
+OPERATORS = {
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+}
+UNINITIALIZED = (0.0, "", True)
+
+
+def compare_items(a, b, op):
+    """ awk comparison of (number, text, numeric) tuples."""
+    if a[2] and b[2]:
+        sign = (a[0] > b[0]) - (a[0] < b[0])
+        return OPERATORS[op](sign, 0)
+    return OPERATORS[op](
+        format_number(a[0]) if a[1] is None else a[1],
+        format_number(b[0]) if b[1] is None else b[1],
+    )
+
+
+def from_items(items):
+    """ Values of (number, text, numeric) tuples."""
+    np = _numpy()
+    numbers, texts, numerics = zip(*items) if items else ((), (), ())
+    text = np.empty(len(texts), dtype=object)
+    text[:] = texts
+    return Values(
+        np.array(numbers, dtype=np.float64), text,
+        np.array(numerics, dtype=bool))
+
+
+class Function:
+
+    """ State of a stream function, it is called with values of every batch.
+
+    Params
+    ------
+    window: int, optional, number of last elements.
+
+    """
+
+    arguments = (1, 2)
+
+    def __init__(self, window=None):
+        self.count = 0
+        self.window = window
+        self.init()
+
+    def init(self):
+        pass
+
+    def __call__(self, values):
+        result = self.update(values)
+        self.count += len(values)
+        return result
+
+
+class Sum(Function):
+
+    """ SUM(x): cumulative sum, SUM(x, k): sum of last k elements.
+
+    Moving sum adds the difference of the element and the one k rows before
+    it, as awk does: o += (v - array[NR % k]).
+
+    """
+
+    def init(self):
+        self.total = 0.0
+        if self.window is not None:
+            self.history = _numpy().zeros(self.window)
+
+    def sums(self, number):
+        np = _numpy()
+        if self.window is not None:
+            extended = np.concatenate([self.history, number])
+            self.history = extended[len(extended) - self.window:]
+            number = number - extended[:len(number)]
+        result = np.cumsum(np.concatenate([[self.total], number]))[1:]
+        if len(result):
+            self.total = result[-1]
+        return result
+
+    def update(self, values):
+        return Values(self.sums(values.number))
+
+
+class Sum2(Sum):
+
+    """ SUM2(x): cumulative sum of squares."""
+
+    arguments = (1, 1)
+
+    def update(self, values):
+        return Values(self.sums(values.number ** 2))
+
+
+class Avg(Sum):
+
+    """ AVG(x): average, AVG(x, k): moving average of last k elements.
+
+    Average is updated as in awk: o = ((NR - 1) * o + v) / NR, moving
+    average is moving sum divided by min(NR, k).
+
+    """
+
+    def update(self, values):
+        np = _numpy()
+        if self.window is not None:
+            rows = np.arange(self.count + 1, self.count + len(values) + 1)
+            return Values(
+                self.sums(values.number) / np.minimum(rows, self.window))
+
+        result = []
+        average, row = self.total, self.count
+        for value in values.number.tolist():
+            row += 1
+            average = ((row - 1) * average + value) / row
+            result.append(average)
+        self.total = average
+        return Values(np.array(result, dtype=np.float64))
+
+
+class Ema(Function):
+
+    """ EMA(x, k): o = (NR == 1 ? v : a * v + (1 - a) * o), a = 2 / (k + 1)."""
+
+    arguments = (2, 2)
+
+    def init(self):
+        self.alpha = 2.0 / (1 + self.window)
+        self.beta = 1 - self.alpha
+
+    def update(self, values):
+        np = _numpy()
+        if not len(values):
+            return values
+
+        alpha, beta = self.alpha, self.beta
+        numbers = values.number.tolist()
+        if self.count == 0:
+            # The first average is the value itself, e.g. field string.
+            average, numbers = numbers[0], numbers[1:]
+        else:
+            average = self.average
+
+        result = []
+        for value in numbers:
+            average = alpha * value + beta * average
+            result.append(average)
+        self.average = average
+
+        result = Values(np.array(result, dtype=np.float64))
+        if self.count == 0:
+            result = Values.concatenate([values[:1], result])
+        return result
+
+
+class Prev(Function):
+
+    """ PREV(x): previous element, uninitialized value for the first row."""
+
+    arguments = (1, 1)
+
+    def init(self):
+        self.previous = from_items([UNINITIALIZED])
+
+    def update(self, values):
+        if not len(values):
+            return values
+        extended = Values.concatenate([self.previous, values])
+        self.previous = extended[len(extended) - 1:]
+        return extended[:len(values)]
+
+
+class Extremum(Function):
+
+    """ MIN/MAX(x): running extremum, o = (v < o || NR == 1 ? v : o),
+    MIN/MAX(x, k): moving extremum of last k elements.
+
+    Result is an input element, e.g. field string is kept. Ties are resolved
+    as in awk: running extremum keeps the first element, moving one keeps
+    the last element of the window, see awk deque implementation. Numbers
+    are compared by numpy, other values one by one.
+
+    """
+
+    op = None
+
+    def init(self):
+        # Running extremum item or deque of (NR, item) with the window
+        # elements, which are strictly better than the following ones.
+        self.items = deque()
+
+    def update(self, values):
+        np = _numpy()
+        if not len(values):
+            return values
+
+        if values.numerics().all() and not np.isnan(values.number).any() \
+                and all(item[-1][2] for item in self.items) \
+                and not any(math.isnan(item[-1][0]) for item in self.items):
+            if self.window is None:
+                return self.update_running(values)
+            return self.update_moving(values)
+        return self.update_items(values)
+
+    def update_items(self, values):
+        equal = {ast.Lt: ast.LtE, ast.Gt: ast.GtE}[self.op]
+        result = []
+        for row, item in enumerate(values.items(), self.count + 1):
+            if self.window is None:
+                if not self.items or compare_items(
+                        item, self.items[0][1], self.op):
+                    self.items = deque([(row, item)])
+            else:
+                while self.items and compare_items(
+                        item, self.items[-1][1], equal):
+                    self.items.pop()
+                while self.items and self.items[0][0] <= row - self.window:
+                    self.items.popleft()
+                self.items.append((row, item))
+            result.append(self.items[0][1])
+        return from_items(result)
+
+    def update_running(self, values):
+        np = _numpy()
+        size, number = len(values), values.number
+        accumulate = np.minimum.accumulate if self.op is ast.Lt \
+            else np.maximum.accumulate
+        if self.items:
+            previous = self.items[0][1]
+            extrema = accumulate(np.concatenate([[previous[0]], number]))[:-1]
+            changed = OPERATORS[self.op](number, extrema)
+        else:
+            previous = UNINITIALIZED
+            changed = OPERATORS[self.op](number, np.concatenate(
+                [number[:1], accumulate(number)[:-1]]))
+            changed[0] = True
+
+        positions = np.maximum.accumulate(
+            np.where(changed, np.arange(size), -1))
+        result = values[np.maximum(positions, 0)]
+        if positions[0] < 0:
+            result = from_items([previous] * size).where(
+                positions < 0, result)
+        last = np.flatnonzero(changed)
+        if len(last):
+            row = self.count + 1 + last[-1]
+            self.items = deque([(row, next(result[size - 1:].items()))])
+        return result
+
+    def update_moving(self, values):
+        np = _numpy()
+        size, window = len(values), self.window
+        worst = np.inf if self.op is ast.Lt else -np.inf
+        # Last window - 1 rows before the batch, elements which are not in
+        # the deque can't be chosen, their positions are filled with worst.
+        start = self.count - window + 2
+        history = Values(
+            np.full(window - 1, worst),
+            np.full(window - 1, None, dtype=object))
+        for row, item in self.items:
+            if row >= start:
+                history.number[row - start] = item[0]
+                history.text[row - start] = item[1]
+        extended = Values.concatenate([history, values])
+
+        number = extended.number if self.op is ast.Lt else -extended.number
+        positions = sliding_argmin(number, window)
+
+        # Deque after the batch: elements strictly better than following.
+        tail = number[len(number) - window:]
+        following = np.append(np.minimum.accumulate(tail[::-1])[-2::-1], np.inf)
+        first = self.count + size - window + 1
+        kept = np.flatnonzero((tail < following) & (
+            np.arange(first, first + window) >= max(start, 1)))
+        self.items = deque(zip(
+            (first + kept).tolist(),
+            extended[len(number) - window + kept].items()))
+        return extended[positions]
+
+
+class Min(Extremum):
+    op = ast.Lt
+
+
+class Max(Extremum):
+    op = ast.Gt
+
+
+FUNCTIONS = {
+    "SUM": Sum,
+    "SUM2": Sum2,
+    "AVG": Avg,
+    "EMA": Ema,
+    "PREV": Prev,
+    "MIN": Min,
+    "MAX": Max,
+}
+
+
+class GroupFunction:
+
+    """ State of a group function for every group.
+
+    update is called with argument values of a batch, group codes of its
+    rows and rows which start new groups, result returns values of all
+    groups in order of codes.
+
+    """
+
+    arguments = (1, 1)
+
+    def __init__(self):
+        self.size = 0
+        self.state = from_items([])
+
+    def resize(self, size):
+        """ Add uninitialized state of new groups, capacity is doubled."""
+        np = _numpy()
+        self.size = size
+        if size > len(self.state):
+            added = max(size, 2 * len(self.state)) - len(self.state)
+            self.state = Values.concatenate([self.state, Values(
+                np.zeros(added), np.full(added, "", dtype=object),
+                np.ones(added, dtype=bool))])
+
+    def begin(self, values, codes, starts):
+        """ The first value of a group is copied as awk does: o = v."""
+        self.state.put(codes[starts], values[starts])
+
+    def update(self, values, codes, starts):
+        raise NotImplementedError
+
+    def result(self):
+        return self.state[:self.size]
+
+
+class GroupSum(GroupFunction):
+
+    """ SUM(x): o = v for the first row, o += v for the following ones.
+
+    Values are added with np.add.at one by one in row order, so the sum is
+    rounded as in awk. Group with a single row keeps its value, e.g. field
+    string.
+
+    """
+
+    def update(self, values, codes, starts):
+        np = _numpy()
+        self.begin(values, codes, starts)
+        rest = np.ones(len(codes), dtype=bool)
+        rest[starts] = False
+        groups = codes[rest]
+        np.add.at(self.state.number, groups, values.number[rest])
+        self.state.text[groups] = None
+        self.state.numeric[groups] = True
+
+
+class GroupCount(GroupFunction):
+
+    """ COUNT(): number of rows."""
+
+    arguments = (0, 1)
+
+    def update(self, values, codes, starts):
+        np = _numpy()
+        self.state.number += np.bincount(codes, minlength=len(self.state))
+
+    def result(self):
+        return Values(self.state.number[:self.size])
+
+
+class GroupFirst(GroupFunction):
+
+    """ FIRST(x): value of the first row."""
+
+    def update(self, values, codes, starts):
+        self.begin(values, codes, starts)
+
+
+class GroupLast(GroupFunction):
+
+    """ LAST(x): value of the last row."""
+
+    def update(self, values, codes, starts):
+        np = _numpy()
+        groups, index = np.unique(codes[::-1], return_index=True)
+        self.state.put(groups, values[len(codes) - 1 - index])
+
+
+class GroupExtremum(GroupFunction):
+
+    """ MIN/MAX(x): o = (v < o ? v : o), the first extremum is kept.
+
+    Numbers are reduced with ufunc.at, other values are compared one by one.
+
+    """
+
+    op = None
+
+    def update(self, values, codes, starts):
+        np = _numpy()
+        self.begin(values, codes, starts)
+        rows = np.ones(len(codes), dtype=bool)
+        rows[starts] = False
+        rows = np.flatnonzero(rows)
+        groups = codes[rows]
+        state = self.state
+
+        if values.numerics().all() and not np.isnan(values.number).any() \
+                and state.numerics().all() \
+                and not np.isnan(state.number).any():
+            best = state.number.copy()
+            reduce = np.minimum if self.op is ast.Lt else np.maximum
+            reduce.at(best, groups, values.number[rows])
+            number = values.number[rows]
+            better = (number == best[groups]) & \
+                OPERATORS[self.op](number, state.number[groups])
+            groups, first = np.unique(groups[better], return_index=True)
+            state.put(groups, values[rows[better][first]])
+            return
+
+        items = list(state.items())
+        values = list(values.items())
+        for row, group in zip(rows.tolist(), groups.tolist()):
+            if compare_items(values[row], items[group], self.op):
+                items[group] = values[row]
+        self.state = from_items(items)
+
+
+class GroupMin(GroupExtremum):
+    op = ast.Lt
+
+
+class GroupMax(GroupExtremum):
+    op = ast.Gt
+
+
+GROUP_FUNCTIONS = {
+    "SUM": GroupSum,
+    "COUNT": GroupCount,
+    "FIRST": GroupFirst,
+    "LAST": GroupLast,
+    "MIN": GroupMin,
+    "MAX": GroupMax,
+}
+
+
+class Codes(dict):
+
+    """ Dictionary of group codes, a new key gets the next code."""
+
+    def __missing__(self, key):
+        code = self[key] = len(self)
+        return code
+
+
+class CachedRows:
+
+    """ Rows start:end of CachedColumns, processed as a batch of rows."""
+
+    def __init__(self, columns, start, end):
+        self.columns = columns
+        self.start = start
+        self.end = min(end, len(columns))
+
+    def __len__(self):
+        return self.end - self.start
+
+    def values(self, index):
+        return self.columns.values(index, self.start, self.end)
+
+
+class NumpyProgram:
+
+    """ Base class of programs evaluated by numpy over batches of rows.
+
+    Params
+    ------
+    fields: tabtools.base.DataDescription.fields
+    delimiter: str, fields delimiter of input and output.
+
+    Expressions are evaluated for rows of the current batch, 2D array of
+    field strings or CachedRows, or for group values if rows are None.
+    Program is called with binary file of delimited lines (file bodies) and
+    binary output file, run reads FileList bodies or columnar caches.
+
+    """
+
+    batch_bytes = BATCH_BYTES
+    FUNCTIONS = {}
+
+    def __init__(self, fields, delimiter="\t"):
+        _numpy()
+        if delimiter == " ":
+            raise ValueError("Space delimiter is not supported")
+        self.fields = {
+            field.title: index for index, field in enumerate(fields)}
+        self.width = len(fields)
+        self.delimiter = delimiter
+        self.functions = {}
+        self._start(None, 0)
+
+    @staticmethod
+    def _statements(expressions):
+        """ List of (title, expression node), title is None for filters."""
+        statements = []
+        for statement in ast.parse("; ".join(expressions)).body:
+            if isinstance(statement, ast.Assign) and \
+                    isinstance(statement.targets[0], ast.Name):
+                statements.append((statement.targets[0].id, statement.value))
+            elif isinstance(statement, ast.Expr) and \
+                    isinstance(statement.value, ast.Name):
+                statements.append((statement.value.id, statement.value))
+            elif isinstance(statement, ast.Expr) and isinstance(
+                    statement.value, (ast.Compare, ast.BoolOp, ast.UnaryOp)):
+                statements.append((None, statement.value))
+            else:
+                raise ValueError("Incorrect input {}".format(
+                    ast.dump(statement)))
+        return statements
+
+    def __call__(self, source, target):
+        """ Process delimited lines of source, write output to the target."""
+        for text in read_text(source, self.batch_bytes):
+            rows = split_fields(text, self.delimiter, self.width)
+            fast = _awk_floats(text)
+            target.write(self.process(rows, fast).encode('latin-1'))
+        target.write(self.finalize().encode('latin-1'))
+
+    def run(self, files, target):
+        """ Process bodies of the FileList, write output to the target.
+
+        If every file has columnar cache, rows are read from the caches by
+        batches of BATCH_ROWS, see CachedColumns.
+
+        """
+        caches = files.columnar_caches()
+        if caches is None:
+            files.process(lambda source: self(source, target))
+            return
+
+        for f, cache in zip(files, caches):
+            columns = CachedColumns(cache, f.partition, 'latin-1')
+            for start in range(0, len(columns), BATCH_ROWS):
+                rows = CachedRows(columns, start, start + BATCH_ROWS)
+                target.write(self.process(rows).encode('latin-1'))
+        target.write(self.finalize().encode('latin-1'))
+
+    def _start(self, rows, size, fast=True):
+        self._rows, self._size, self._fast = rows, size, fast
+        self._columns, self._variables = {}, {}
+
+    def _format(self, columns):
+        """ Delimited lines of columns, lists of strings."""
+        if not columns or not columns[0]:
+            return ""
+        return "\n".join(map(self.delimiter.join, zip(*columns))) + "\n"
+
+    def process(self, rows, fast=True):
+        """ Output text of rows, 2D array of field strings or CachedRows."""
+        raise NotImplementedError
+
+    def finalize(self):
+        """ Output text after the last batch."""
+        return ""
+
+    def evaluate(self, node):
+        """ Values of the expression node for current rows."""
+        method = getattr(self, "evaluate_" + node.__class__.__name__, None)
+        if method is None:
+            raise ValueError("Class is not supported {}".format(node))
+        return method(node)
+
+    def evaluate_Name(self, node):
+        if node.id in self.fields and self._rows is not None:
+            if node.id not in self._columns:
+                index = self.fields[node.id]
+                self._columns[node.id] = \
+                    self._rows.values(index) \
+                    if isinstance(self._rows, CachedRows) else \
+                    Values.field(self._rows[:, index], self._fast)
+            return self._columns[node.id]
+        if node.id in self._variables:
+            return self._variables[node.id]
+        raise ValueError("Variable {} not in context".format(node.id))
+
+    def evaluate_Constant(self, node):
+        if isinstance(node.value, bool) or \
+                not isinstance(node.value, (int, float, str)):
+            raise ValueError("Constant is not supported {}".format(
+                node.value))
+        return Values.constant(node.value, self._size)
+
+
+    def evaluate_BinOp(self, node):
+        np = _numpy()
+        operations = {
+            ast.Add: np.add,
+            ast.Sub: np.subtract,
+            ast.Mult: np.multiply,
+            ast.Pow: np.power,
+            ast.Div: np.divide,
+        }
+        operation = operations.get(type(node.op))
+        if operation is None:
+            raise ValueError("Not Supported binary operation {}".format(
+                type(node.op).__name__))
+        return Values(operation(
+            self.evaluate(node.left).number,
+            self.evaluate(node.right).number))
+
+    def evaluate_BoolOp(self, node):
+        truths = [self.evaluate(value).truth() for value in node.values]
+        if isinstance(node.op, ast.And):
+            result = _numpy().logical_and.reduce(truths)
+        else:
+            result = _numpy().logical_or.reduce(truths)
+        return Values(result.astype(float))
+
+    def evaluate_UnaryOp(self, node):
+        operand = self.evaluate(node.operand)
+        if isinstance(node.op, ast.USub):
+            return Values(-operand.number)
+        if isinstance(node.op, ast.Not):
+            return Values((~operand.truth()).astype(float))
+        raise ValueError("Not Supported unary operation {}".format(
+            type(node.op).__name__))
+
+    def evaluate_IfExp(self, node):
+        test = self.evaluate(node.test).truth()
+        return self.evaluate(node.body).where(
+            test, self.evaluate(node.orelse))
+
+    def evaluate_Compare(self, node):
+        """ Comparisons are evaluated from left to right as awk code
+        (a) < (b) < (c), membership test replaces the result."""
+        left = result = self.evaluate(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            op = type(op)
+            if op in (ast.In, ast.NotIn):
+                member = self._membership(left, comparator)
+                result = Values((member != (op is ast.NotIn)).astype(float))
+            elif op in OPERATORS:
+                result = result.compare(self.evaluate(comparator), op)
+            else:
+                raise ValueError('Unknown comparator {}'.format(op))
+        return result
+
+    def _membership(self, value, node):
+        if isinstance(node, ast.Call) and \
+                getattr(node.func, "id", None) == "FILE":
+            raise ValueError("FILE is not supported by numpy engine")
+        try:
+            values = ast.literal_eval(node)
+        except ValueError:
+            raise ValueError("Only constants could be used in IN list")
+        if not isinstance(values, (tuple, list, set, frozenset)):
+            raise ValueError("IN expects list or FILE(\"path\")")
+
+        keys = {str(v) for v in values}
+        strings = value.strings().tolist()
+        return _numpy().fromiter(
+            (s in keys for s in strings), bool, len(strings))
+
+    def evaluate_Call(self, node):
+        np = _numpy()
+        name = getattr(node.func, "id", None)
+        if name in self.FUNCTIONS:
+            return self.evaluate_function(name, node)
+
+        if name not in ("max", "int", "sqrt"):
+            raise ValueError(
+                "Function {} is not supported by numpy engine".format(name))
+
+        args = [self.evaluate(arg) for arg in node.args]
+        if name == "max" and len(args) == 2:
+            return args[0].where(
+                args[0].compare(args[1], ast.Gt).number != 0, args[1])
+        if name == "int" and len(args) == 1:
+            return Values(np.trunc(args[0].number))
+        if name == "sqrt" and len(args) == 1:
+            return Values(np.sqrt(args[0].number))
+        raise ValueError(
+            "{} function: wrong number of arguments".format(name))
+
+
+class NumpyStreamProgram(NumpyProgram):
+
+    """ Stream program evaluated by numpy over batches of rows.
+
+    Params
+    ------
+    fields: tabtools.base.DataDescription.fields
+    filter_expressions: list, optional
+    output_expressions: list, optional
+    delimiter: str, fields delimiter of input and output.
+
+    Expressions are the same as in AWKStreamProgram.
+
+    Supported functions: SUM, SUM2, AVG, EMA, PREV, MIN, MAX, max, int and
+    sqrt. Other functions and FILE membership raise ValueError.
+
+    """
+
+    FUNCTIONS = FUNCTIONS
+
+    @property
+    def stateful(self):
+        """ Whether expressions use stateful functions, programs without
+        them are faster in awk (ttmap --engine numpy runs them in awk)."""
+        return bool(self.functions)
+
+    def __init__(self, fields, filter_expressions=None,
+                 output_expressions=None, delimiter="\t"):
+        super().__init__(fields, delimiter)
+        self.output = self._statements(output_expressions or [])
+        self.filters = self._statements(filter_expressions or [])
+        self.titles = [
+            title for title, _ in self.output
+            if title and not title.startswith('_')
+        ]
+        if not self.titles:
+            raise ValueError("Output fields are not set")
+        # Check expressions with empty batch.
+        self.process(_numpy().empty((0, self.width), dtype=object))
+
+    def process(self, rows, fast=True):
+        """ Output text of rows, 2D array of field strings or CachedRows."""
+        np = _numpy()
+        self._start(rows, len(rows), fast)
+
+        with np.errstate(all='ignore'):
+            for title, node in self.output:
+                value = self.evaluate(node)
+                if title is not None:
+                    self._variables[title] = value
+
+            mask = np.ones(len(rows), dtype=bool)
+            for title, node in self.filters:
+                value = self.evaluate(node)
+                if title is not None:
+                    self._variables[title] = value
+                mask &= value.truth()
+
+        if not mask.any():
+            return ""
+        return self._format([
+            self._variables[title][mask].strings().tolist()
+            for title in self.titles
+        ])
+
+    def evaluate_function(self, name, node):
+        args = [self.evaluate(arg) for arg in node.args]
+        function = self.functions.get(id(node))
+        if function is None:
+            cls = FUNCTIONS[name]
+            if not cls.arguments[0] <= len(args) <= cls.arguments[1]:
+                raise ValueError(
+                    "{} function: wrong number of arguments".format(name))
+            window = None
+            if len(args) > 1:
+                if not isinstance(node.args[1], ast.Constant) or \
+                        isinstance(node.args[1].value, (bool, str)) or \
+                        int(node.args[1].value) < 1:
+                    raise ValueError("{} function: window size should "
+                                     "be positive number".format(name))
+                window = int(node.args[1].value)
+            function = self.functions[id(node)] = cls(window)
+        return function(args[0])
+
+
+class NumpyGroupProgram(NumpyProgram):
+
+    """ Group program evaluated by numpy over batches of rows.
+
+    Params
+    ------
+    fields: tabtools.base.DataDescription.fields
+    group_key: str, optional, key expressions.
+    group_expressions: list, optional
+    delimiter: str, fields delimiter of input and output.
+
+    Expressions are the same as in AWKGroupProgram. Input does not need to be
+    sorted: keys of every batch are factorized by numpy and only distinct
+    keys are looked up in the dictionary of all groups, functions keep state
+    of every group in arrays indexed by group code. Groups are printed after
+    the input in order of the first row, as AWKGroupProgram in hash mode
+    prints them.
+
+    Supported functions: SUM, COUNT, MIN, MAX, FIRST, LAST of fields and row
+    expressions, group expressions could combine their results with
+    max, int, sqrt and operators.
+
+    """
+
+    FUNCTIONS = GROUP_FUNCTIONS
+
+    def __init__(self, fields, group_key=None, group_expressions=None,
+                 delimiter="\t"):
+        super().__init__(fields, delimiter)
+        self.key = self._statements([group_key] if group_key else [])
+        self.output = self._statements(group_expressions or [])
+        if any(title is None for title, _ in self.key + self.output):
+            raise ValueError("Group expressions should have titles")
+        self.key_titles = [
+            title for title, _ in self.key if not title.startswith('_')]
+        self.titles = [
+            title for title, _ in self.output if not title.startswith('_')]
+
+        for _, statement in self.output:
+            for node in ast.walk(statement):
+                name = getattr(getattr(node, "func", None), "id", None)
+                if isinstance(node, ast.Call) and name in GROUP_FUNCTIONS:
+                    cls = GROUP_FUNCTIONS[name]
+                    if not cls.arguments[0] <= len(node.args) <= \
+                            cls.arguments[1]:
+                        raise ValueError("{} function: wrong number of "
+                                         "arguments".format(name))
+                    self.functions[id(node)] = (node, cls())
+
+        # Codes of group keys and printed key values in order of codes.
+        self.groups = Codes()
+        self.values = []
+        # Check expressions with empty batch.
+        self.process(_numpy().empty((0, self.width), dtype=object))
+        self.finalize()
+
+    @staticmethod
+    def _factorize(values):
+        """ Codes of key values and list of their distinct strings.
+
+        Numbers are factorized by numpy and only distinct numbers are
+        formatted, strings by a dictionary. Numbers which are printed
+        equally are one group, as keys of awk arrays are strings.
+
+        """
+        np = _numpy()
+        if values.text is None and not np.isnan(values.number).any():
+            numbers, codes = np.unique(values.number, return_inverse=True)
+            strings = format_numbers(numbers).tolist()
+        else:
+            strings = values.strings().tolist()
+            codes = None
+        distinct = Codes()
+        index = np.fromiter(
+            map(distinct.__getitem__, strings), np.int64, len(strings))
+        return index if codes is None else index[codes], list(distinct)
+
+    def _encode(self, size):
+        """ Group codes of rows and rows which start new groups.
+
+        Key columns are factorized one by one, pairs of codes of the keys
+        so far and of the next column are factorized by numpy. Only
+        distinct keys of the batch are looked up in the groups.
+
+        """
+        np = _numpy()
+        codes, first = np.zeros(size, dtype=np.int64), np.zeros(1, np.int64)
+        keys = [()] if size else []
+        for title in self.key_titles:
+            column, strings = self._factorize(self._variables[title])
+            pairs, first, codes = np.unique(
+                codes * len(strings) + column,
+                return_index=True, return_inverse=True)
+            keys = [
+                keys[pair // len(strings)] + (strings[pair % len(strings)],)
+                for pair in pairs.tolist()
+            ]
+
+        # Groups are numbered in order of their first rows.
+        count = len(self.groups)
+        order = np.argsort(first[:len(keys)], kind='stable')
+        groups = np.empty(len(keys), dtype=np.int64)
+        groups[order] = np.fromiter(
+            (self.groups[keys[k]] for k in order.tolist()),
+            np.int64, len(keys))
+        new = np.flatnonzero(groups >= count)
+        new = new[np.argsort(groups[new])]
+        self.values.extend(self.delimiter.join(keys[k]) for k in new.tolist())
+        return groups[codes], first[new]
+
+    def process(self, rows, fast=True):
+        """ Update group state with rows, 2D array of field strings or
+        CachedRows."""
+        np = _numpy()
+        self._start(rows, len(rows), fast)
+        with np.errstate(all='ignore'):
+            for title, node in self.key:
+                self._variables[title] = self.evaluate(node)
+            codes, starts = self._encode(len(rows))
+            for node, function in self.functions.values():
+                args = [self.evaluate(arg) for arg in node.args]
+                function.resize(len(self.groups))
+                function.update(args[0] if args else None, codes, starts)
+        return ""
+
+    def finalize(self):
+        """ Output text of all groups."""
+        np = _numpy()
+        self._start(None, len(self.groups))
+        with np.errstate(all='ignore'):
+            for title, node in self.output:
+                self._variables[title] = self.evaluate(node)
+        columns = [self.values] if self.key_titles else []
+        return self._format(columns + [
+            self._variables[title].strings().tolist()
+            for title in self.titles
+        ])
+
+    def evaluate_function(self, name, node):
+        if self._rows is not None:
+            raise ValueError(
+                "{} function could not be used in row expressions".format(
+                    name))
+        return self.functions[id(node)][1].result()